@@ -0,0 +1,65 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+class TTLCache:
+    """
+    Кэш результатов в памяти процесса с временем жизни на каждую запись.
+    Одновременные запросы с одним ключом ждут одно вычисление.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: Dict[Hashable, Tuple[float, Any]] = {}
+        self._pending: Dict[Hashable, asyncio.Future] = {}
+
+    def get(self, key: Hashable) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float):
+        if len(self._entries) >= self.max_entries:
+            self._evict()
+        self._entries[key] = (time.monotonic() + ttl, value)
+
+    def _evict(self):
+        now = time.monotonic()
+        for key in [key for key, (expires_at, _) in self._entries.items() if expires_at <= now]:
+            del self._entries[key]
+        # Если всё ещё переполнен, удаляем записи, которые истекут раньше всех
+        overflow = len(self._entries) - self.max_entries + 1
+        if overflow > 0:
+            for key in sorted(self._entries, key=lambda k: self._entries[k][0])[:overflow]:
+                del self._entries[key]
+
+    async def get_or_compute(self, key: Hashable, ttl: float,
+                             compute: Callable[[], Awaitable[Any]]) -> Any:
+        value = self.get(key)
+        if value is not None:
+            return value
+        pending = self._pending.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            value = await compute()
+            self.set(key, value, ttl)
+            future.set_result(value)
+            return value
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже передано ожидающим, здесь оно не должно считаться необработанным
+            future.exception()
+            raise
+        finally:
+            # Вычисление отменено - ожидающие получат CancelledError
+            if not future.done():
+                future.cancel()
+            del self._pending[key]
@@ -1,11 +1,33 @@
-from fastapi import APIRouter, HTTPException, Depends
-from typing import Dict, Any, List
-from datetime import datetime, timedelta
+from fastapi import APIRouter, HTTPException, Depends, Query
+from typing import Dict, Any, List, Optional
+from datetime import datetime, timedelta, timezone
+import re
+from api.cache import TTLCache
+from config.settings import settings
 from storage.elastic_client import ElasticClient
+from processors.rollups import Rollup, merge_rollups
 from http import HTTPStatus
 
 router = APIRouter()
 
+# Результаты агрегаций /stats; время жизни записи зависит от интервала
+stats_cache = TTLCache()
+
+INTERVAL_PATTERN = re.compile(r"^(\d+)([smhd])$")
+INTERVAL_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+def parse_interval(interval: str) -> int:
+    """Интервал гистограммы (30s, 1m, 1h, 1d) в секундах"""
+    match = INTERVAL_PATTERN.match(interval)
+    if not match or int(match.group(1)) == 0:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST,
+                            detail="interval must look like 30s, 5m, 1h or 1d")
+    return int(match.group(1)) * INTERVAL_UNITS[match.group(2)]
+
+def stats_ttl(interval_seconds: int) -> float:
+    """Половина интервала в пределах STATS_CACHE_MIN_TTL_S..STATS_CACHE_MAX_TTL_S"""
+    return min(max(interval_seconds / 2, settings.STATS_CACHE_MIN_TTL_S), settings.STATS_CACHE_MAX_TTL_S)
+
 async def get_elastic_client():
     client = ElasticClient()
     await client.init()
@@ -14,9 +36,10 @@ async def get_elastic_client():
 @router.get("/logs/{service_name}")
 async def get_logs(service_name: str, elastic_client: ElasticClient = Depends(get_elastic_client)):
     """Получение логов сервиса"""
+    now = datetime.now(timezone.utc)
     time_range = {
-        'gte': (datetime.utcnow() - timedelta(hours=24)).isoformat(),
-        'lte': datetime.utcnow().isoformat()
+        'gte': (now - timedelta(hours=24)).isoformat(),
+        'lte': now.isoformat()
     }
     try:
         logs = await elastic_client.get_service_logs(service_name, time_range)
@@ -28,13 +51,104 @@ async def get_logs(service_name: str, elastic_client: ElasticClient = Depends(ge
 @router.get("/logs/errors/{service_name}")
 async def get_error_logs(service_name: str, elastic_client: ElasticClient = Depends(get_elastic_client)):
     """Получение ошибок сервиса"""
+    now = datetime.now(timezone.utc)
     time_range = {
-        'gte': (datetime.utcnow() - timedelta(hours=24)).isoformat(),
-        'lte': datetime.utcnow().isoformat()
+        'gte': (now - timedelta(hours=24)).isoformat(),
+        'lte': now.isoformat()
     }
     try:
         logs = await elastic_client.get_service_logs(service_name, time_range, log_level="ERROR")
         return logs
     except Exception as e:
         print(f"Error getting error logs: {str(e)}")
-        raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR, detail=str(e)) 
\ No newline at end of file
+        raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR, detail=str(e)) 
+
+@router.get("/rollups/{service_name}")
+async def get_rollups(service_name: str,
+                      minutes: int = Query(60, ge=1, le=1440),
+                      endpoint: Optional[str] = None,
+                      elastic_client: ElasticClient = Depends(get_elastic_client)):
+    """Поминутные агрегаты задержек сервиса и итог по эндпоинтам за период"""
+    # Минуты агрегатов хранятся в UTC
+    now = datetime.now(timezone.utc)
+    time_range = {
+        'gte': (now - timedelta(minutes=minutes)).replace(second=0, microsecond=0).isoformat(),
+        'lte': now.isoformat()
+    }
+    try:
+        rollups = await elastic_client.get_rollups(service_name, time_range, endpoint)
+    except Exception as e:
+        print(f"Error getting rollups: {str(e)}")
+        raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR, detail=str(e))
+
+    # Документы разных потребителей за одну минуту объединяются через скетч
+    per_minute = sorted(merge_rollups(rollups).values(), key=lambda r: (r.minute, r.endpoint))
+    totals = {}
+    for rollup in per_minute:
+        if rollup.endpoint in totals:
+            totals[rollup.endpoint].merge(rollup)
+        else:
+            # Копия, чтобы суммирование не изменяло поминутный агрегат
+            totals[rollup.endpoint] = Rollup.from_document(rollup.to_document())
+
+    def summary(rollup):
+        return {
+            "count": rollup.count,
+            "error_count": rollup.error_count,
+            "error_rate": rollup.error_count / rollup.count if rollup.count else 0.0,
+            "avg_ms": rollup.duration_sum_ms / rollup.sketch.count if rollup.sketch.count else None,
+            "p50": rollup.sketch.quantile(0.5),
+            "p95": rollup.sketch.quantile(0.95),
+            "p99": rollup.sketch.quantile(0.99)
+        }
+
+    return {
+        "service": service_name,
+        "from": time_range['gte'],
+        "to": time_range['lte'],
+        "endpoints": {name: summary(total) for name, total in totals.items()},
+        "rollups": [
+            {"minute": rollup.minute.isoformat(), "endpoint": rollup.endpoint, **summary(rollup)}
+            for rollup in per_minute
+        ]
+    }
+
+
+@router.get("/stats/{service_name}")
+async def get_stats(service_name: str,
+                    minutes: int = Query(60, ge=1, le=10080),
+                    interval: str = "1m",
+                    endpoint: Optional[str] = None,
+                    elastic_client: ElasticClient = Depends(get_elastic_client)):
+    """Перцентили задержки, частота запросов и доля ошибок сервиса по эндпоинтам"""
+    interval_seconds = parse_interval(interval)
+    if minutes * 60 / interval_seconds > settings.STATS_MAX_BUCKETS:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST,
+                            detail=f"At most {settings.STATS_MAX_BUCKETS} intervals per request")
+
+    async def compute():
+        # События сервисов помечены временем UTC с поясом (instrumentation.py)
+        now = datetime.now(timezone.utc)
+        time_range = {
+            'gte': (now - timedelta(minutes=minutes)).isoformat(),
+            'lte': now.isoformat()
+        }
+        stats = await elastic_client.get_service_stats(
+            service_name, time_range, interval, interval_seconds, endpoint
+        )
+        return {
+            "service": service_name,
+            "from": time_range['gte'],
+            "to": time_range['lte'],
+            "interval": interval,
+            **stats
+        }
+
+    # Ключ без текущего времени: повторные обновления дашборда в пределах TTL
+    # получают уже посчитанный результат
+    key = (service_name, minutes, interval, endpoint)
+    try:
+        return await stats_cache.get_or_compute(key, stats_ttl(interval_seconds), compute)
+    except Exception as e:
+        print(f"Error getting service stats: {str(e)}")
+        raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR, detail=str(e))
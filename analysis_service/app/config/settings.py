@@ -9,12 +9,49 @@ class Settings(BaseSettings):
     # Kafka настройки
     KAFKA_BROKERS: List[str] = ["kafka:9092"]
     KAFKA_CONSUMER_GROUP: str = "analysis_service_group"
+    # Пакетное чтение: до CONSUMER_BATCH_SIZE сообщений или CONSUMER_MAX_WAIT_MS ожидания
+    CONSUMER_BATCH_SIZE: int = 2000
+    CONSUMER_MAX_WAIT_MS: int = 500
+    # Пауза перед повторным чтением пачки, которую не удалось записать
+    CONSUMER_RETRY_BACKOFF_S: float = 5.0
+    # Топик для сообщений, которые невозможно обработать
+    DEAD_LETTER_TOPIC: str = "logs_dlq"
+    # Отдельный процесс потребителя (consumer_main.py): число воркеров в одной
+    # consumer group, параллельно обрабатываемые партиции и порт метрик первого воркера
+    CONSUMER_WORKERS: int = 2
+    CONSUMER_PARTITION_CONCURRENCY: int = 8
+    CONSUMER_METRICS_PORT: int = 9101
+    # Запускать ли потребителя внутри процесса API
+    RUN_EMBEDDED_CONSUMER: bool = True
+    # Поминутные агрегаты задержек: индекс, период сброса, ожидание
+    # запоздавших событий и относительная точность квантилей
+    ROLLUP_INDEX: str = "rollups-logs"
+    ROLLUP_FLUSH_INTERVAL_S: float = 15.0
+    ROLLUP_GRACE_S: float = 30.0
+    ROLLUP_SKETCH_ACCURACY: float = 0.01
     
     # Elasticsearch настройки
     ELASTICSEARCH_HOST: str = "elasticsearch"
     ELASTICSEARCH_PORT: int = 9200
     ELASTICSEARCH_USERNAME: Optional[str] = None
     ELASTICSEARCH_PASSWORD: Optional[str] = None
+    # Bulk-запись: повтор отдельных документов с временными ошибками (429, 5xx)
+    BULK_MAX_RETRIES: int = 3
+    BULK_RETRY_BACKOFF_S: float = 0.5
+    # Логи пишутся в data stream logs-{service}: ILM переключает запись
+    # на новый индекс по возрасту или размеру и удаляет индексы целиком
+    LOG_ROLLOVER_MAX_AGE: str = "1d"
+    LOG_ROLLOVER_MAX_SIZE: str = "25gb"
+    LOG_RETENTION_DAYS: int = 30
+    LOG_REFRESH_INTERVAL: str = "5s"
+    # Ограничения схемы события: длина keyword-полей и размер неиндексируемого payload
+    LOG_MAX_KEYWORD_CHARS: int = 256
+    LOG_MAX_PAYLOAD_BYTES: int = 4096
+    
+    # /stats: предел числа интервалов в ответе и время жизни кэша агрегаций
+    STATS_MAX_BUCKETS: int = 1440
+    STATS_CACHE_MIN_TTL_S: float = 15.0
+    STATS_CACHE_MAX_TTL_S: float = 300.0
     
     # API настройки
     API_HOST: str = "0.0.0.0"
@@ -0,0 +1,98 @@
+"""
+Отдельный процесс потребителя логов.
+
+Запускает CONSUMER_WORKERS процессов в одной consumer group: Kafka
+распределяет партиции между ними, а внутри процесса партиции
+обрабатываются параллельно. Каждый воркер отдаёт метрики Prometheus
+на порту CONSUMER_METRICS_PORT + номер воркера. Перед чтением каждый
+воркер сам ставит шаблоны индексов логов (не дожидаясь API).
+
+    python consumer_main.py --workers 4
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import signal
+from prometheus_client import start_http_server
+from config.settings import settings
+
+
+async def setup_indices():
+    """
+    Шаблоны data stream и политика ILM ставятся до первого чтения из Kafka:
+    иначе воркер, опередивший API, создаст обычные индексы logs-* с
+    динамическим маппингом. Настройка идемпотентна; пока Elasticsearch
+    поднимается, она повторяется.
+    """
+    from storage.index_manager import IndexManager
+
+    index_manager = IndexManager()
+    try:
+        while True:
+            try:
+                await index_manager.setup_index_lifecycle()
+                return
+            except Exception as e:
+                logging.error(f"Failed to set up log indices, retrying: {e}")
+                await asyncio.sleep(settings.CONSUMER_RETRY_BACKOFF_S)
+    finally:
+        await index_manager.client.close()
+
+
+async def run_worker():
+    # Импорт внутри воркера: клиенты Kafka и Elasticsearch создаются в своём процессе
+    from consumers.kafka_consumer import KafkaLogConsumer
+
+    consumer = KafkaLogConsumer()
+
+    async def consume():
+        await setup_indices()
+        await consumer.start()
+
+    loop = asyncio.get_running_loop()
+    task = asyncio.create_task(consume())
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, task.cancel)
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    finally:
+        await consumer.processor.elastic_client.close()
+
+
+def worker_main(index: int):
+    start_http_server(settings.CONSUMER_METRICS_PORT + index)
+    logging.info(f"Log consumer worker {index} started")
+    asyncio.run(run_worker())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analysis service log consumer")
+    parser.add_argument("--workers", type=int, default=settings.CONSUMER_WORKERS)
+    args = parser.parse_args()
+
+    if args.workers <= 1:
+        worker_main(0)
+        return
+
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=worker_main, args=(i,), name=f"log-consumer-{i}")
+               for i in range(args.workers)]
+    for worker in workers:
+        worker.start()
+
+    def stop_workers(signum, frame):
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+
+    signal.signal(signal.SIGTERM, stop_workers)
+    signal.signal(signal.SIGINT, stop_workers)
+    for worker in workers:
+        worker.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,48 +1,224 @@
 import asyncio
-from aiokafka import AIOKafkaConsumer
-import json
-from typing import Dict, Any
+import os
+import socket
+from aiokafka import AIOKafkaConsumer, AIOKafkaProducer, TopicPartition
+from typing import Dict, Any, List
 from config.settings import settings
 from processors.log_processor import LogProcessor
+from processors.rollups import RollupAggregator
+from metrics import set_consumer_lag, remove_consumer_lag, count_consumed
 
 class KafkaLogConsumer:
     def __init__(self):
+        # Смещения фиксируются вручную только после подтверждения записи
+        # в Elasticsearch, поэтому значения читаются как байты и разбираются
+        # в LogProcessor: некорректное сообщение не ломает getmany
         self.consumer = AIOKafkaConsumer(
             'logs',
             'errors',
             bootstrap_servers=settings.KAFKA_BROKERS,
             group_id=settings.KAFKA_CONSUMER_GROUP,
-            value_deserializer=lambda m: json.loads(m.decode('utf-8')),
-            enable_auto_commit=True,
-            auto_commit_interval_ms=1000,
-            max_poll_interval_ms=300000
+            enable_auto_commit=False,
+            max_poll_interval_ms=300000,
+            max_poll_records=settings.CONSUMER_BATCH_SIZE
+        )
+        self.dead_letter_producer = AIOKafkaProducer(
+            bootstrap_servers=settings.KAFKA_BROKERS
         )
         self.processor = LogProcessor()
+        # Пачки разных партиций записываются параллельно, порядок внутри
+        # партиции сохраняется: следующая пачка читается после записи текущей
+        self._partition_slots = asyncio.Semaphore(settings.CONSUMER_PARTITION_CONCURRENCY)
+        self._lag_partitions = set()
+        # Поминутные агрегаты задержек по сервисам и эндпоинтам
+        self.rollups = RollupAggregator(settings.ROLLUP_SKETCH_ACCURACY, settings.ROLLUP_GRACE_S)
+        self.rollup_source = f"{socket.gethostname()}-{os.getpid()}"
+        self._rollup_task = None
+        self._running = False
 
     async def start(self):
         """
         Запуск потребителя
         """
+        await self.dead_letter_producer.start()
         await self.consumer.start()
+        self._running = True
+        self._rollup_task = asyncio.create_task(self._rollup_flush_loop())
         try:
-            async for message in self.consumer:
-                try:
-                    if message.topic == 'logs':
-                        await self.processor.process_log(message.value)
-                    elif message.topic == 'errors':
-                        await self.processor.process_log(message.value, is_error=True)
-                except Exception as e:
-                    print(f"Error processing message from topic {message.topic}: {str(e)}")
-                    # Продолжаем обработку следующих сообщений
-                    continue
+            while self._running:
+                batches = await self._next_batch()
+                if batches:
+                    await asyncio.gather(*(
+                        self._process_partition(tp, messages)
+                        for tp, messages in batches.items()
+                    ))
+                await self._update_lag()
         except Exception as e:
             print(f"Fatal error in consumer: {str(e)}")
             raise
         finally:
+            self._running = False
+            self._rollup_task.cancel()
+            await self.flush_rollups(force=True)
             await self.consumer.stop()
+            await self.dead_letter_producer.stop()
+
+    async def _next_batch(self) -> Dict[TopicPartition, List[Any]]:
+        """
+        Набор пачки сообщений: до CONSUMER_BATCH_SIZE штук,
+        но не дольше CONSUMER_MAX_WAIT_MS. Сообщения сгруппированы по партициям.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.CONSUMER_MAX_WAIT_MS / 1000
+        batches = {}
+        total = 0
+        while self._running and total < settings.CONSUMER_BATCH_SIZE:
+            remaining_ms = int((deadline - loop.time()) * 1000)
+            if remaining_ms <= 0:
+                break
+            records = await self.consumer.getmany(
+                timeout_ms=remaining_ms,
+                max_records=settings.CONSUMER_BATCH_SIZE - total
+            )
+            for tp, partition_records in records.items():
+                batches.setdefault(tp, []).extend(partition_records)
+                total += len(partition_records)
+        return batches
+
+    async def _process_partition(self, tp: TopicPartition, messages: List[Any]):
+        """
+        Запись пачки одной партиции. Ошибка приостанавливает только эту партицию.
+        """
+        async with self._partition_slots:
+            try:
+                await self._handle_batch(messages)
+            except Exception as e:
+                print(f"Error processing batch of {len(messages)} messages from {tp.topic}-{tp.partition}: {str(e)}")
+                # Смещения не зафиксированы - перечитываем пачку после паузы
+                self._retry_later(tp, messages[0].offset)
+
+    async def _handle_batch(self, messages: List[Any]):
+        """
+        Запись пачки и фиксация смещений (at-least-once)
+        """
+        result = await self.processor.process_batch(messages)
+        if result["retryable"]:
+            raise RuntimeError(
+                f"{len(result['retryable'])} log events were not acknowledged by Elasticsearch"
+            )
+        await self._send_dead_letters(result["dead_letters"])
+        await self._commit(messages)
+        # В агрегаты попадают только зафиксированные события: пачка,
+        # которая будет перечитана, не учитывается дважды
+        self.rollups.add_many(result["logs"])
+        topic = messages[0].topic
+        count_consumed(topic, "indexed", result["indexed"])
+        if result["dead_letters"]:
+            count_consumed(topic, "dead_letter", len(result["dead_letters"]))
+
+    async def _rollup_flush_loop(self):
+        while self._running:
+            await asyncio.sleep(settings.ROLLUP_FLUSH_INTERVAL_S)
+            await self.flush_rollups()
+
+    async def flush_rollups(self, force: bool = False):
+        """
+        Запись завершённых минут в индекс агрегатов.
+        Не записанные агрегаты возвращаются в память до следующей попытки.
+        """
+        rollups = self.rollups.pop_closed(force=force)
+        if not rollups:
+            return
+        try:
+            result = await self.processor.elastic_client.write_rollups(rollups, self.rollup_source)
+        except Exception as e:
+            print(f"Error writing latency rollups: {str(e)}")
+            self.rollups.restore(rollups)
+            return
+        for action, error in result["failed"]:
+            print(f"Latency rollup {action['_id']} rejected by Elasticsearch: {error}")
+        if result["retryable"]:
+            retry_ids = {action["_id"] for action, _ in result["retryable"]}
+            self.rollups.restore([
+                rollup for rollup in rollups
+                if self.processor.elastic_client.rollup_id(rollup, self.rollup_source) in retry_ids
+            ])
+
+    async def _send_dead_letters(self, dead_letters: List[Any]):
+        """
+        Отправка необрабатываемых сообщений в DLQ, чтобы они не блокировали партицию
+        """
+        futures = []
+        for message, reason in dead_letters:
+            print(f"Sending message {message.topic}-{message.partition}-{message.offset} to DLQ: {reason}")
+            futures.append(await self.dead_letter_producer.send(
+                settings.DEAD_LETTER_TOPIC,
+                value=message.value,
+                key=message.key,
+                headers=[
+                    ("source_topic", message.topic.encode('utf-8')),
+                    ("source_partition", str(message.partition).encode('utf-8')),
+                    ("source_offset", str(message.offset).encode('utf-8')),
+                    ("error", reason.encode('utf-8'))
+                ]
+            ))
+        if futures:
+            await asyncio.gather(*futures)
+
+    def _last_offsets(self, messages: List[Any]) -> Dict[TopicPartition, int]:
+        offsets = {}
+        for message in messages:
+            tp = TopicPartition(message.topic, message.partition)
+            offsets[tp] = max(offsets.get(tp, -1), message.offset)
+        return offsets
+
+    async def _commit(self, messages: List[Any]):
+        """
+        Фиксация смещений: следующее чтение начнётся после последнего
+        записанного сообщения каждой партиции
+        """
+        offsets = {tp: offset + 1 for tp, offset in self._last_offsets(messages).items()}
+        await self.consumer.commit(offsets)
+
+    def _retry_later(self, tp: TopicPartition, offset: int):
+        """
+        Возврат партиции к началу незафиксированной пачки и пауза на
+        CONSUMER_RETRY_BACKOFF_S; остальные партиции продолжают читаться
+        """
+        # После ребалансировки партиция могла уйти другому потребителю
+        if tp not in self.consumer.assignment():
+            return
+        self.consumer.seek(tp, offset)
+        self.consumer.pause(tp)
+        asyncio.get_running_loop().call_later(
+            settings.CONSUMER_RETRY_BACKOFF_S, self._resume, tp
+        )
+
+    def _resume(self, tp: TopicPartition):
+        if self._running and tp in self.consumer.assignment():
+            self.consumer.resume(tp)
+
+    async def _update_lag(self):
+        """
+        Экспорт отставания по каждой назначенной партиции в Prometheus
+        """
+        assigned = self.consumer.assignment()
+        for tp in assigned:
+            highwater = self.consumer.highwater(tp)
+            if highwater is None:
+                continue
+            try:
+                position = await self.consumer.position(tp)
+            except Exception:
+                continue
+            set_consumer_lag(tp.topic, tp.partition, max(highwater - position, 0))
+        for tp in self._lag_partitions - assigned:
+            remove_consumer_lag(tp.topic, tp.partition)
+        self._lag_partitions = set(assigned)
 
     async def stop(self):
         """
         Остановка потребителя
         """
-        await self.consumer.stop() 
\ No newline at end of file
+        self._running = False
+        await self.consumer.stop()
@@ -54,11 +54,15 @@ async def startup_event():
         logging.error(f"Failed to initialize index manager: {str(e)}")
         raise
     
-    # Запуск Kafka consumer
+    # Запуск Kafka consumer. В продакшене потребитель работает отдельным
+    # процессом (consumer_main.py) и здесь отключается RUN_EMBEDDED_CONSUMER=false
+    if not settings.RUN_EMBEDDED_CONSUMER:
+        return
     try:
         consumer = KafkaLogConsumer()
+        app.state.consumer = consumer
         # Запускаем consumer в фоне, чтобы не блокировать основной поток
-        asyncio.create_task(consumer.start())
+        app.state.consumer_task = asyncio.create_task(consumer.start())
     except Exception as e:
         logging.error(f"Failed to start Kafka consumer: {str(e)}")
         raise
@@ -69,9 +73,11 @@ async def shutdown_event():
     """
     Остановка потребителя при завершении работы приложения
     """
+    consumer = getattr(app.state, "consumer", None)
+    if consumer is None:
+        return
     try:
         # Остановка Kafka consumer
-        consumer = KafkaLogConsumer()
         await consumer.stop()
     except Exception as e:
         logging.error(f"Failed to stop Kafka consumer: {str(e)}")
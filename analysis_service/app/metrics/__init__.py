@@ -7,5 +7,8 @@ metrics = BaseMetrics('analysis_service')
 metrics_endpoint = metrics.metrics_endpoint
 api_metrics = metrics.api_metrics
 db_metrics = metrics.db_metrics
+set_consumer_lag = metrics.set_consumer_lag
+remove_consumer_lag = metrics.remove_consumer_lag
+count_consumed = metrics.count_consumed
 
-__all__ = ['BaseMetrics', 'metrics_endpoint', 'api_metrics', 'db_metrics'] 
\ No newline at end of file
+__all__ = ['BaseMetrics', 'metrics_endpoint', 'api_metrics', 'db_metrics', 'set_consumer_lag', 'remove_consumer_lag', 'count_consumed'] 
\ No newline at end of file
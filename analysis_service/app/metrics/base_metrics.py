@@ -41,6 +41,19 @@ class BaseMetrics:
             ['service', 'operation']
         )
 
+        # Метрики потребителя логов
+        self.metrics['consumer_lag'] = Gauge(
+            'kafka_consumer_lag',
+            'Number of messages behind the high watermark per partition',
+            ['service', 'topic', 'partition']
+        )
+
+        self.metrics['consumer_records'] = Counter(
+            'kafka_consumer_records_total',
+            'Total number of consumed log events by outcome',
+            ['service', 'topic', 'outcome']
+        )
+
     def api_metrics(self):
         """Декоратор для автоматического сбора метрик API"""
         def decorator(func):
@@ -55,22 +68,26 @@ class BaseMetrics:
                     raise e
                 finally:
                     duration = time.time() - start_time
-                    self.metrics['api_requests'].labels(
-                        service=self.service_name,
-                        endpoint=func.__name__,
-                        method='GET',  # TODO: сделать динамическим
-                        status=status
-                    ).inc()
-                    
-                    self.metrics['api_duration'].labels(
-                        service=self.service_name,
-                        endpoint=func.__name__,
-                        method='GET'  # TODO: сделать динамическим
-                    ).observe(duration)
+                    self.observe_api_request(func.__name__, 'GET', status, duration)
                 return response
             return wrapper
         return decorator
 
+    def observe_api_request(self, endpoint: str, method: str, status: str, duration: float):
+        """Учёт одного API-запроса (используется декоратором и middleware)"""
+        self.metrics['api_requests'].labels(
+            service=self.service_name,
+            endpoint=endpoint,
+            method=method,
+            status=status
+        ).inc()
+
+        self.metrics['api_duration'].labels(
+            service=self.service_name,
+            endpoint=endpoint,
+            method=method
+        ).observe(duration)
+
     def db_metrics(self, operation: str):
         """Декоратор для автоматического сбора метрик БД"""
         def decorator(func):
@@ -99,6 +116,29 @@ class BaseMetrics:
             return wrapper
         return decorator
 
+    def set_consumer_lag(self, topic: str, partition: int, lag: int):
+        """Отставание потребителя по партиции"""
+        self.metrics['consumer_lag'].labels(
+            service=self.service_name,
+            topic=topic,
+            partition=str(partition)
+        ).set(lag)
+
+    def remove_consumer_lag(self, topic: str, partition: int):
+        """Удаление метрики отставания для отозванной партиции"""
+        try:
+            self.metrics['consumer_lag'].remove(self.service_name, topic, str(partition))
+        except KeyError:
+            pass
+
+    def count_consumed(self, topic: str, outcome: str, amount: int = 1):
+        """Учёт обработанных событий: indexed, dead_letter"""
+        self.metrics['consumer_records'].labels(
+            service=self.service_name,
+            topic=topic,
+            outcome=outcome
+        ).inc(amount)
+
     async def metrics_endpoint(self):
         """Эндпоинт для Prometheus"""
         return Response(generate_latest(), media_type='text/plain') 
\ No newline at end of file
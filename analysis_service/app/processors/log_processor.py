@@ -1,7 +1,14 @@
-from typing import Dict, Any
+import json
+from typing import Dict, Any, List
 from datetime import datetime
+from config.settings import settings
 from storage.elastic_client import ElasticClient
 
+# Поля схемы события (см. LOG_MAPPINGS в storage/index_manager.py)
+KEYWORD_FIELDS = {'@timestamp', 'timestamp', 'service', 'endpoint', 'method', 'status',
+                  'trace_id', 'level', 'error_type'}
+TEXT_LIMITS = {'message': 2048, 'error': 2048, 'error_message': 2048, 'stack_trace': 8192}
+
 class LogProcessor:
     def __init__(self):
         self.elastic_client = ElasticClient()
@@ -19,8 +26,7 @@ class LogProcessor:
         """
         try:
             # Добавляем время обработки и тип лога
-            log_data['processed_at'] = datetime.utcnow().isoformat()
-            log_data['log_type'] = 'error' if is_error else 'log'
+            log_data = self.prepare_log(log_data, is_error)
             
             # Сохраняем в Elasticsearch
             return await self.elastic_client.index_log(log_data)
@@ -28,6 +34,94 @@ class LogProcessor:
             print(f"Error processing {'error' if is_error else 'log'}: {str(e)}")
             return False
 
+    def prepare_log(self, log_data: Dict[str, Any], is_error: bool = False) -> Dict[str, Any]:
+        """
+        Приведение события к схеме индекса логов (LOG_MAPPINGS):
+        известные поля приводятся к своим типам, длинные строки обрезаются,
+        тело запроса и прочие поля переносятся в неиндексируемый payload.
+        Пустые значения не сохраняются.
+        """
+        document = {}
+        payload = {}
+        for field, value in log_data.items():
+            if value is None or value == {} or value == "":
+                continue
+            if field in TEXT_LIMITS:
+                document[field] = str(value)[:TEXT_LIMITS[field]]
+            elif field in KEYWORD_FIELDS:
+                document[field] = str(value)[:settings.LOG_MAX_KEYWORD_CHARS]
+            elif field == 'duration_ms':
+                try:
+                    document[field] = round(float(value), 3)
+                except (TypeError, ValueError):
+                    payload[field] = value
+            elif field == 'status_code':
+                try:
+                    document[field] = int(value)
+                except (TypeError, ValueError):
+                    payload[field] = value
+            else:
+                payload[field] = value
+        if payload:
+            size = len(json.dumps(payload, default=str))
+            document['payload'] = payload if size <= settings.LOG_MAX_PAYLOAD_BYTES \
+                else {"truncated": True, "size": size}
+        document['processed_at'] = datetime.utcnow().isoformat()
+        document['log_type'] = 'error' if is_error else 'log'
+        # Поле времени data stream: время события, а не обработки
+        document['@timestamp'] = document.get('timestamp') or document['processed_at']
+        return document
+
+    @staticmethod
+    def document_id(message: Any) -> str:
+        """
+        Детерминированный ID документа: повторная обработка того же
+        сообщения получает конфликт версий, а не создаёт дубликат
+        """
+        return f"{message.topic}-{message.partition}-{message.offset}"
+
+    async def process_batch(self, messages: List[Any]) -> Dict[str, Any]:
+        """
+        Пакетная обработка сообщений Kafka одним bulk-запросом
+        
+        Args:
+            messages: Сообщения из KafkaLogConsumer (ConsumerRecord с value в байтах)
+            
+        Returns:
+            Dict[str, Any]: {"indexed": int,
+                             "dead_letters": [(message, reason), ...] - сообщения для DLQ,
+                             "retryable": [message, ...] - не записаны из-за временных ошибок,
+                             "logs": [log_data, ...] - записанные события для агрегатов}
+        """
+        actions = []
+        dead_letters = []
+        for message in messages:
+            try:
+                log_data = json.loads(message.value)
+                if not isinstance(log_data, dict):
+                    raise ValueError("log event is not a JSON object")
+            except (ValueError, TypeError) as e:
+                dead_letters.append((message, f"Invalid log event: {str(e)}"))
+                continue
+            log_data = self.prepare_log(log_data, is_error=message.topic == 'errors')
+            actions.append({
+                "_index": f"logs-{log_data.get('service', 'unknown')}",
+                "_op_type": "create",
+                "_id": self.document_id(message),
+                "_source": log_data,
+                "message": message
+            })
+        result = await self.elastic_client.bulk_index(actions)
+        for action, error in result["failed"]:
+            dead_letters.append((action["message"], f"Rejected by Elasticsearch: {error}"))
+        rejected = {id(action) for action, _ in result["failed"] + result["retryable"]}
+        return {
+            "indexed": result["indexed"],
+            "dead_letters": dead_letters,
+            "retryable": [action["message"] for action, _ in result["retryable"]],
+            "logs": [action["_source"] for action in actions if id(action) not in rejected]
+        }
+
     async def process_error(self, error_data: Dict[str, Any]) -> bool:
         """
         Обработка и сохранение ошибки
@@ -39,8 +133,8 @@ class LogProcessor:
             bool: Успешность обработки
         """
         try:
-            # Добавляем время обработки
-            error_data['processed_at'] = datetime.utcnow().isoformat()
+            # Добавляем время обработки и тип лога
+            error_data = self.prepare_log(error_data, is_error=True)
             
             # Сохраняем в Elasticsearch
             return await self.elastic_client.index_log(error_data)
@@ -0,0 +1,193 @@
+import math
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List, Optional, Tuple
+
+class QuantileSketch:
+    """
+    Квантильный скетч с относительной точностью (по схеме DDSketch).
+    Значения раскладываются по логарифмическим корзинам, поэтому скетчи
+    разных минут и разных потребителей объединяются простым сложением счётчиков.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value: float):
+        if value <= 0:
+            self.zero_count += 1
+        else:
+            key = math.ceil(math.log(value) / self._log_gamma)
+            self.bins[key] = self.bins.get(key, 0) + 1
+        self.count += 1
+
+    def merge(self, other: "QuantileSketch"):
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot merge sketches with different accuracy")
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def quantile(self, q: float) -> Optional[float]:
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if rank < seen:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.bins) / (self.gamma + 1)
+
+    def to_dict(self) -> Dict[str, Any]:
+        keys = sorted(self.bins)
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "zero_count": self.zero_count,
+            "keys": keys,
+            "counts": [self.bins[key] for key in keys]
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "QuantileSketch":
+        sketch = cls(data["relative_accuracy"])
+        sketch.bins = dict(zip(data["keys"], data["counts"]))
+        sketch.zero_count = data["zero_count"]
+        sketch.count = sketch.zero_count + sum(data["counts"])
+        return sketch
+
+
+class Rollup:
+    """
+    Агрегат запросов одного эндпоинта за одну минуту
+    """
+
+    def __init__(self, service: str, endpoint: str, minute: datetime, relative_accuracy: float):
+        self.service = service
+        self.endpoint = endpoint
+        self.minute = minute
+        self.count = 0
+        self.error_count = 0
+        self.duration_sum_ms = 0.0
+        self.sketch = QuantileSketch(relative_accuracy)
+
+    @property
+    def key(self) -> Tuple[str, str, datetime]:
+        return self.service, self.endpoint, self.minute
+
+    def add(self, duration_ms: Optional[float], is_error: bool):
+        self.count += 1
+        if is_error:
+            self.error_count += 1
+        if duration_ms is not None:
+            self.duration_sum_ms += duration_ms
+            self.sketch.add(duration_ms)
+
+    def merge(self, other: "Rollup"):
+        self.count += other.count
+        self.error_count += other.error_count
+        self.duration_sum_ms += other.duration_sum_ms
+        self.sketch.merge(other.sketch)
+
+    def to_document(self) -> Dict[str, Any]:
+        return {
+            "service": self.service,
+            "endpoint": self.endpoint,
+            "minute": self.minute.isoformat(),
+            "count": self.count,
+            "error_count": self.error_count,
+            "duration_sum_ms": self.duration_sum_ms,
+            "p50": self.sketch.quantile(0.5),
+            "p95": self.sketch.quantile(0.95),
+            "p99": self.sketch.quantile(0.99),
+            "sketch": self.sketch.to_dict()
+        }
+
+    @classmethod
+    def from_document(cls, doc: Dict[str, Any]) -> "Rollup":
+        sketch = QuantileSketch.from_dict(doc["sketch"])
+        rollup = cls(doc["service"], doc["endpoint"],
+                     datetime.fromisoformat(doc["minute"]), sketch.relative_accuracy)
+        rollup.count = doc["count"]
+        rollup.error_count = doc["error_count"]
+        rollup.duration_sum_ms = doc["duration_sum_ms"]
+        rollup.sketch = sketch
+        return rollup
+
+
+class RollupAggregator:
+    """
+    Поминутные агрегаты по сервису и эндпоинту, накапливаемые в памяти
+    потребителя. Минута отдаётся на запись, когда закончилась и прошло
+    grace_seconds на запоздавшие события.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01, grace_seconds: float = 30):
+        self.relative_accuracy = relative_accuracy
+        self.grace = timedelta(seconds=grace_seconds)
+        self._rollups: Dict[Tuple[str, str, datetime], Rollup] = {}
+
+    def add(self, log_data: Dict[str, Any]):
+        try:
+            timestamp = datetime.fromisoformat(log_data["timestamp"])
+        except (KeyError, TypeError, ValueError):
+            return
+        # Минуты хранятся в UTC без пояса; время без пояса считается UTC
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.astimezone(timezone.utc)
+        minute = timestamp.replace(second=0, microsecond=0, tzinfo=None)
+        key = (log_data.get("service", "unknown"), log_data.get("endpoint", "unknown"), minute)
+        rollup = self._rollups.get(key)
+        if rollup is None:
+            rollup = self._rollups[key] = Rollup(*key, self.relative_accuracy)
+        duration_ms = log_data.get("duration_ms")
+        rollup.add(
+            float(duration_ms) if isinstance(duration_ms, (int, float)) else None,
+            log_data.get("status") == "error" or log_data.get("log_type") == "error"
+        )
+
+    def add_many(self, logs: List[Dict[str, Any]]):
+        for log_data in logs:
+            self.add(log_data)
+
+    def pop_closed(self, now: Optional[datetime] = None, force: bool = False) -> List[Rollup]:
+        """
+        Забирает завершённые минуты (или все при force=True)
+        """
+        now = now or datetime.utcnow()
+        closed = [key for key in self._rollups
+                  if force or key[2] + timedelta(minutes=1) + self.grace <= now]
+        return [self._rollups.pop(key) for key in closed]
+
+    def restore(self, rollups: List[Rollup]):
+        """
+        Возврат агрегатов, которые не удалось записать, до следующего сброса
+        """
+        for rollup in rollups:
+            if rollup.key in self._rollups:
+                self._rollups[rollup.key].merge(rollup)
+            else:
+                self._rollups[rollup.key] = rollup
+
+    def __len__(self):
+        return len(self._rollups)
+
+
+def merge_rollups(rollups: List[Rollup]) -> Dict[Tuple[str, str, datetime], Rollup]:
+    """
+    Объединение агрегатов одной минуты от разных потребителей
+    """
+    merged: Dict[Tuple[str, str, datetime], Rollup] = {}
+    for rollup in rollups:
+        if rollup.key in merged:
+            merged[rollup.key].merge(rollup)
+        else:
+            merged[rollup.key] = rollup
+    return merged
@@ -0,0 +1,120 @@
+"""
+Отчёт о размере событий лога до и после перехода на компактную схему.
+
+Генерирует события в формате InstrumentationMiddleware, записывает их
+в два временных индекса - с динамическим маппингом как раньше и с
+LOG_MAPPINGS/LOG_INDEX_SETTINGS после нормализации LogProcessor, -
+сливает сегменты и сравнивает байты на событие.
+
+    python -m scripts.log_size_report --events 20000
+"""
+import argparse
+import asyncio
+import json
+import random
+import uuid
+from datetime import datetime, timedelta
+from elasticsearch import AsyncElasticsearch
+from config.settings import settings
+from processors.log_processor import LogProcessor
+from storage.index_manager import LOG_INDEX_SETTINGS, LOG_MAPPINGS
+
+BEFORE_INDEX = "size-report-before"
+AFTER_INDEX = "size-report-after"
+
+ENDPOINTS = ["/api/products", "/products/{product_id}", "/api/get_product",
+             "/api/cart/add", "/login", "/api/orders"]
+
+
+def generate_event(i: int, start: datetime) -> dict:
+    is_error = random.random() < 0.05
+    event = {
+        "timestamp": (start + timedelta(milliseconds=i * 50)).isoformat(),
+        "service": "main_service",
+        "endpoint": random.choice(ENDPOINTS),
+        "method": random.choice(["GET", "GET", "GET", "POST"]),
+        "status": "error" if is_error else "success",
+        "status_code": 500 if is_error else 200,
+        "duration_ms": random.lognormvariate(3, 0.8),
+        "trace_id": uuid.uuid4().hex,
+        "request_data": {}
+    }
+    # Тело запроса попадает в лог для части POST-запросов
+    if event["method"] == "POST" and random.random() < 0.1:
+        event["request_data"] = {
+            "product_id": random.randint(1, 10000),
+            "quantity": random.randint(1, 5),
+            f"field_{random.randint(1, 500)}": "value"
+        }
+    if is_error:
+        event["error"] = "Internal Server Error"
+    return event
+
+
+async def write(es: AsyncElasticsearch, index: str, documents: list):
+    for start in range(0, len(documents), 1000):
+        operations = []
+        for document in documents[start:start + 1000]:
+            operations.append({"index": {"_index": index}})
+            operations.append(document)
+        await es.bulk(operations=operations)
+    await es.indices.refresh(index=index)
+    await es.indices.forcemerge(index=index, max_num_segments=1)
+
+
+async def index_report(es: AsyncElasticsearch, index: str, documents: list) -> dict:
+    stats = await es.indices.stats(index=index, metric="store,docs")
+    total = stats["indices"][index]["primaries"]
+    mapping = await es.indices.get_mapping(index=index)
+    fields = json.dumps(mapping[index]["mappings"]).count('"type"')
+    return {
+        "source_bytes_per_event": sum(len(json.dumps(d)) for d in documents) / len(documents),
+        "store_bytes_per_event": total["store"]["size_in_bytes"] / total["docs"]["count"],
+        "mapped_fields": fields
+    }
+
+
+async def main(events: int):
+    random.seed(1)
+    es = AsyncElasticsearch(
+        f"http://{settings.ELASTICSEARCH_HOST}:{settings.ELASTICSEARCH_PORT}",
+        basic_auth=(
+            settings.ELASTICSEARCH_USERNAME,
+            settings.ELASTICSEARCH_PASSWORD
+        ) if settings.ELASTICSEARCH_USERNAME else None
+    )
+    processor = LogProcessor()
+    start = datetime.utcnow()
+    raw = [generate_event(i, start) for i in range(events)]
+    # Раньше событие писалось как есть с processed_at и log_type
+    before = [{**event, "processed_at": start.isoformat(), "log_type": "log"} for event in raw]
+    after = [processor.prepare_log(dict(event)) for event in raw]
+    try:
+        await es.indices.delete(index=[BEFORE_INDEX, AFTER_INDEX], ignore_unavailable=True)
+        await es.indices.create(index=BEFORE_INDEX, settings={"number_of_shards": 1, "number_of_replicas": 0})
+        await es.indices.create(
+            index=AFTER_INDEX,
+            settings={**LOG_INDEX_SETTINGS, "number_of_replicas": 0},
+            mappings=LOG_MAPPINGS
+        )
+        await write(es, BEFORE_INDEX, before)
+        await write(es, AFTER_INDEX, after)
+        reports = {
+            "before": await index_report(es, BEFORE_INDEX, before),
+            "after": await index_report(es, AFTER_INDEX, after)
+        }
+    finally:
+        await es.indices.delete(index=[BEFORE_INDEX, AFTER_INDEX], ignore_unavailable=True)
+        await es.close()
+
+    print(f"{'':24}{'before':>12}{'after':>12}{'change':>10}")
+    for metric in ("source_bytes_per_event", "store_bytes_per_event", "mapped_fields"):
+        old, new = reports["before"][metric], reports["after"][metric]
+        print(f"{metric:24}{old:>12.1f}{new:>12.1f}{(new - old) / old:>10.1%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Log event size report")
+    parser.add_argument("--events", type=int, default=20000)
+    args = parser.parse_args()
+    asyncio.run(main(args.events))
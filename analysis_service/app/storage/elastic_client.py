@@ -1,6 +1,18 @@
+import asyncio
+from datetime import datetime
 from elasticsearch import AsyncElasticsearch
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 from config.settings import settings
+from processors.rollups import Rollup
+
+# Статусы bulk-ответа, при которых документ имеет смысл отправить повторно
+RETRYABLE_STATUSES = {429, 502, 503, 504}
+
+# Перцентили задержки в ответах /stats
+STATS_PERCENTILES = [50, 95, 99]
+
+# Размер страницы при выгрузке поминутных агрегатов
+ROLLUP_PAGE_SIZE = 5000
 
 class ElasticClient:
     def __init__(self):
@@ -37,15 +49,244 @@ class ElasticClient:
         try:
             if self.es is None:
                 await self.init()
+            # В data stream допустима только операция create
             response = await self.es.index(
                 index=f"logs-{log_data['service']}",
-                document=log_data
+                document=log_data,
+                op_type="create"
             )
             return response['result'] == 'created'
         except Exception as e:
             print(f"Error indexing log: {str(e)}")
             return False
             
+    async def bulk_index(self, actions: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Пакетное индексирование через Bulk API.
+        Документы, отклонённые с временной ошибкой, отправляются повторно
+        по отдельности с экспоненциальной задержкой.
+        
+        Args:
+            actions: Список {"_index": ..., "_id": (необязательно), "_source": ...,
+                             "_op_type": "index" | "create" (по умолчанию "index")}.
+                     Для create конфликт версий (409) означает, что документ
+                     уже записан при прошлой попытке, и считается успехом.
+            
+        Returns:
+            Dict[str, Any]: {"indexed": int,
+                             "failed": [(action, error), ...] - постоянные ошибки,
+                             "retryable": [(action, error), ...] - исчерпаны повторы}
+        """
+        if not actions:
+            return {"indexed": 0, "failed": [], "retryable": []}
+        if self.es is None:
+            await self.init()
+        indexed = 0
+        failed = []
+        pending = actions
+        last_error = None
+        for attempt in range(settings.BULK_MAX_RETRIES + 1):
+            if attempt:
+                await asyncio.sleep(settings.BULK_RETRY_BACKOFF_S * 2 ** (attempt - 1))
+            operations = []
+            for action in pending:
+                meta = {"_index": action["_index"]}
+                if action.get("_id") is not None:
+                    meta["_id"] = action["_id"]
+                operations.append({action.get("_op_type", "index"): meta})
+                operations.append(action["_source"])
+            try:
+                response = await self.es.bulk(operations=operations)
+            except Exception as e:
+                # Запрос целиком не дошёл до кластера - повторяем всю пачку
+                print(f"Error sending bulk request: {str(e)}")
+                last_error = str(e)
+                continue
+            retry = []
+            for action, item in zip(pending, response["items"]):
+                op_type = action.get("_op_type", "index")
+                result = item[op_type]
+                if result["status"] < 300 or (op_type == "create" and result["status"] == 409):
+                    indexed += 1
+                elif result["status"] in RETRYABLE_STATUSES:
+                    retry.append(action)
+                    last_error = result.get("error")
+                else:
+                    failed.append((action, result.get("error")))
+            pending = retry
+            if not pending:
+                break
+        retryable = [(action, last_error) for action in pending]
+        return {"indexed": indexed, "failed": failed, "retryable": retryable}
+            
+    @staticmethod
+    def rollup_id(rollup: Rollup, source: str) -> str:
+        """
+        ID агрегата: каждый потребитель пишет свой документ на минуту,
+        поэтому параллельные воркеры не перезаписывают данные друг друга
+        """
+        return f"{rollup.service}|{rollup.endpoint}|{rollup.minute.isoformat()}|{source}"
+
+    async def write_rollups(self, rollups: List[Rollup], source: str) -> Dict[str, Any]:
+        """
+        Запись поминутных агрегатов. Если минута уже была сброшена
+        (пришли запоздавшие события), сохранённый агрегат объединяется с новым.
+        
+        Args:
+            rollups: Завершённые агрегаты из RollupAggregator
+            source: Идентификатор потребителя
+            
+        Returns:
+            Dict[str, Any]: Результат bulk_index
+        """
+        if not rollups:
+            return {"indexed": 0, "failed": [], "retryable": []}
+        if self.es is None:
+            await self.init()
+        ids = [self.rollup_id(rollup, source) for rollup in rollups]
+        existing = await self.es.mget(index=settings.ROLLUP_INDEX, ids=ids)
+        actions = []
+        for doc_id, rollup, found in zip(ids, rollups, existing["docs"]):
+            if found.get("found"):
+                merged = Rollup.from_document(found["_source"])
+                merged.merge(rollup)
+                rollup = merged
+            document = rollup.to_document()
+            document["source"] = source
+            actions.append({"_index": settings.ROLLUP_INDEX, "_id": doc_id, "_source": document})
+        return await self.bulk_index(actions)
+
+    async def get_rollups(self,
+                   service_name: str,
+                   time_range: Dict[str, str],
+                   endpoint: Optional[str] = None) -> List[Rollup]:
+        """
+        Получение поминутных агрегатов сервиса за период
+        
+        Args:
+            service_name: Имя сервиса
+            time_range: Временной диапазон по полю minute
+            endpoint: Шаблон маршрута (опционально)
+            
+        Returns:
+            List[Rollup]: Агрегаты всех потребителей без объединения
+        """
+        filters = [
+            {"term": {"service": service_name}},
+            {"range": {"minute": time_range}}
+        ]
+        if endpoint:
+            filters.append({"term": {"endpoint": endpoint}})
+        if self.es is None:
+            await self.init()
+        # Документ агрегата уникален по (service, endpoint, minute, source),
+        # поэтому сортировка по этим полям - полный порядок для search_after:
+        # за сутки документов больше, чем помещается в одну страницу
+        body = {
+            "query": {"bool": {"filter": filters}},
+            "size": ROLLUP_PAGE_SIZE,
+            "sort": [{"minute": "asc"}, {"endpoint": "asc"}, {"source": "asc"}]
+        }
+        rollups = []
+        while True:
+            response = await self.es.search(index=settings.ROLLUP_INDEX, body=body, ignore_unavailable=True)
+            hits = response['hits']['hits']
+            rollups.extend(Rollup.from_document(hit['_source']) for hit in hits)
+            if len(hits) < ROLLUP_PAGE_SIZE:
+                return rollups
+            body["search_after"] = hits[-1]["sort"]
+            
+    async def get_service_stats(self,
+                         service_name: str,
+                         time_range: Dict[str, str],
+                         interval: str,
+                         interval_seconds: float,
+                         endpoint: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Перцентили задержки, частота запросов и доля ошибок сервиса
+        по эндпоинтам и интервалам времени - одним запросом агрегаций
+        без выгрузки документов
+        
+        Args:
+            service_name: Имя сервиса
+            time_range: Временной диапазон
+            interval: Интервал гистограммы в формате Elasticsearch (30s, 1m, 1h)
+            interval_seconds: Тот же интервал в секундах для расчёта частоты
+            endpoint: Шаблон маршрута (опционально)
+            
+        Returns:
+            Dict[str, Any]: Итог по сервису и по каждому эндпоинту
+        """
+        filters = [{"range": {"timestamp": time_range}}]
+        if endpoint:
+            filters.append({"term": {"endpoint": endpoint}})
+        metrics = {
+            "latency": {"percentiles": {"field": "duration_ms", "percents": STATS_PERCENTILES}},
+            "errors": {"filter": {"term": {"status": "error"}}}
+        }
+        if self.es is None:
+            await self.init()
+        response = await self.es.search(
+            index=f"logs-{service_name}",
+            body={
+                "size": 0,
+                "track_total_hits": True,
+                "query": {"bool": {"filter": filters}},
+                "aggs": {
+                    **metrics,
+                    "endpoints": {
+                        "terms": {"field": "endpoint", "size": 100},
+                        "aggs": {
+                            **metrics,
+                            "over_time": {
+                                "date_histogram": {
+                                    "field": "timestamp",
+                                    "fixed_interval": interval,
+                                    "min_doc_count": 0,
+                                    "extended_bounds": {"min": time_range["gte"], "max": time_range["lte"]}
+                                },
+                                "aggs": metrics
+                            }
+                        }
+                    }
+                }
+            },
+            ignore_unavailable=True
+        )
+        aggs = response.get("aggregations")
+        if not aggs:
+            return {"total": self._stats_bucket({"doc_count": 0}, 0), "endpoints": {}}
+        range_seconds = (datetime.fromisoformat(time_range["lte"])
+                         - datetime.fromisoformat(time_range["gte"])).total_seconds()
+        total = self._stats_bucket(
+            {**aggs, "doc_count": response["hits"]["total"]["value"]}, range_seconds
+        )
+        endpoints = {}
+        for bucket in aggs["endpoints"]["buckets"]:
+            endpoints[bucket["key"]] = {
+                **self._stats_bucket(bucket, range_seconds),
+                "over_time": [
+                    {"timestamp": point["key_as_string"], **self._stats_bucket(point, interval_seconds)}
+                    for point in bucket["over_time"]["buckets"]
+                ]
+            }
+        return {"total": total, "endpoints": endpoints}
+
+    @staticmethod
+    def _stats_bucket(bucket: Dict[str, Any], seconds: float) -> Dict[str, Any]:
+        """
+        Сводка по одному бакету агрегации
+        """
+        count = bucket["doc_count"]
+        errors = bucket.get("errors", {}).get("doc_count", 0)
+        latency = bucket.get("latency", {}).get("values", {})
+        return {
+            "count": count,
+            "rate_per_s": count / seconds if seconds else 0.0,
+            "error_rate": errors / count if count else 0.0,
+            **{f"p{p}": latency.get(f"{float(p)}") for p in STATS_PERCENTILES}
+        }
+
     async def search_logs(self,
                    service_name: str,
                    query: Dict[str, Any],
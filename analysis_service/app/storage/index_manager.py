@@ -1,7 +1,41 @@
-from elasticsearch import AsyncElasticsearch
+from elasticsearch import AsyncElasticsearch, NotFoundError
 from datetime import datetime, timedelta
 from config.settings import settings
 
+LOG_INDEX_SETTINGS = {
+    "number_of_shards": 1,
+    "number_of_replicas": 1,
+    "index.refresh_interval": settings.LOG_REFRESH_INTERVAL,
+    "index.codec": "best_compression"
+}
+
+# Схема события лога (см. LogProcessor.prepare_log). Новые поля не попадают
+# в маппинг автоматически, тело запроса хранится только в _source
+LOG_MAPPINGS = {
+    "dynamic": False,
+    "properties": {
+        "@timestamp": {"type": "date"},
+        "timestamp": {"type": "date"},
+        "processed_at": {"type": "date", "index": False, "doc_values": False},
+        # У каждого data stream один сервис - значение хранится в маппинге
+        "service": {"type": "constant_keyword"},
+        "endpoint": {"type": "keyword"},
+        "method": {"type": "keyword"},
+        "status": {"type": "keyword"},
+        "status_code": {"type": "short"},
+        "duration_ms": {"type": "float"},
+        "trace_id": {"type": "keyword", "doc_values": False},
+        "log_type": {"type": "keyword"},
+        "level": {"type": "keyword"},
+        "message": {"type": "text"},
+        "error": {"type": "text"},
+        "error_message": {"type": "text"},
+        "error_type": {"type": "keyword"},
+        "stack_trace": {"type": "text", "index": False},
+        "payload": {"type": "object", "enabled": False}
+    }
+}
+
 class IndexManager:
     def __init__(self):
         self.client = AsyncElasticsearch(
@@ -13,7 +47,10 @@ class IndexManager:
         )
         
     async def setup_index_lifecycle(self):
-        """Настройка политики жизненного цикла индексов"""
+        """
+        Настройка жизненного цикла логов: каждый logs-{service} - data stream,
+        ILM переключает запись на новый backing-индекс и удаляет старые целиком
+        """
         # Создаем политику
         policy = {
             "policy": {
@@ -22,13 +59,13 @@ class IndexManager:
                         "min_age": "0ms",
                         "actions": {
                             "rollover": {
-                                "max_age": "7d",
-                                "max_size": "50gb"
+                                "max_age": settings.LOG_ROLLOVER_MAX_AGE,
+                                "max_primary_shard_size": settings.LOG_ROLLOVER_MAX_SIZE
                             }
                         }
                     },
                     "delete": {
-                        "min_age": "30d",
+                        "min_age": f"{settings.LOG_RETENTION_DAYS}d",
                         "actions": {
                             "delete": {}
                         }
@@ -43,56 +80,91 @@ class IndexManager:
             body=policy
         )
         
-        # Создаем шаблон индекса
-        template = {
-            "index_patterns": ["logs-*"],
-            "settings": {
-                "number_of_shards": 1,
-                "number_of_replicas": 1,
-                "lifecycle.name": "logs_policy",
-                "lifecycle.rollover_alias": "logs"
-            }
-        }
+        # Удаляем устаревший шаблон, который ссылался на несуществующий алиас
+        await self.client.indices.delete_template(name="logs_template", ignore=[404])
         
-        await self.client.indices.put_template(
+        # Шаблон data stream; приоритет выше встроенного шаблона logs-*-*
+        await self.client.indices.put_index_template(
             name="logs_template",
-            body=template
+            index_patterns=["logs-*"],
+            data_stream={},
+            priority=200,
+            template={
+                "settings": {
+                    **LOG_INDEX_SETTINGS,
+                    "index.lifecycle.name": "logs_policy"
+                },
+                "mappings": LOG_MAPPINGS
+            }
+        )
+        
+        await self.setup_rollup_index()
+    
+    async def setup_rollup_index(self):
+        """Шаблон индекса поминутных агрегатов"""
+        await self.client.indices.delete_template(name="rollups_template", ignore=[404])
+        await self.client.indices.put_index_template(
+            name="rollups_template",
+            index_patterns=[settings.ROLLUP_INDEX],
+            priority=200,
+            template={
+                "settings": {
+                    "number_of_shards": 1,
+                    "number_of_replicas": 1
+                },
+                "mappings": {
+                    "properties": {
+                        "service": {"type": "keyword"},
+                        "endpoint": {"type": "keyword"},
+                        "minute": {"type": "date"},
+                        "source": {"type": "keyword"},
+                        "count": {"type": "long"},
+                        "error_count": {"type": "long"},
+                        "duration_sum_ms": {"type": "double"},
+                        "p50": {"type": "float"},
+                        "p95": {"type": "float"},
+                        "p99": {"type": "float"},
+                        # Скетч нужен только для объединения, не для поиска
+                        "sketch": {"type": "object", "enabled": False}
+                    }
+                }
+            }
         )
     
-    async def cleanup_old_indices(self, days=30):
-        """Удаление старых индексов"""
+    async def cleanup_old_indices(self, days=None):
+        """
+        Удаление backing-индексов, все документы которых старше days дней.
+        Обычно это делает ILM; метод нужен для ручной очистки.
+        Текущий индекс записи не удаляется.
+        """
+        days = settings.LOG_RETENTION_DAYS if days is None else days
         cutoff_date = datetime.utcnow() - timedelta(days=days)
         
         try:
-            # Получаем список всех индексов
-            indices = await self.client.indices.get(index="logs-*")
-            
-            for index_name in indices:
+            response = await self.client.indices.get_data_stream(name="logs-*")
+        except NotFoundError:
+            return []
+        
+        deleted = []
+        for data_stream in response["data_streams"]:
+            # Последний backing-индекс - индекс записи
+            for index in data_stream["indices"][:-1]:
+                index_name = index["index_name"]
                 try:
-                    # Удаляем старые документы
-                    await self.client.delete_by_query(
+                    result = await self.client.search(
                         index=index_name,
-                        body={
-                            "query": {
-                                "range": {
-                                    "timestamp": {
-                                        "lte": cutoff_date.isoformat()
-                                    }
-                                }
-                            }
-                        }
+                        size=0,
+                        aggs={"newest": {"max": {"field": "@timestamp"}}}
                     )
-                    # Обновляем индексы после удаления
-                    await self.client.indices.refresh(index=index_name)
+                    newest = result["aggregations"]["newest"]["value"]
+                    if newest is not None and newest > cutoff_date.timestamp() * 1000:
+                        continue
+                    await self.client.indices.delete(index=index_name)
+                    deleted.append(index_name)
                 except Exception as e:
                     print(f"Error cleaning up index {index_name}: {str(e)}")
                     continue
-                    
-            # Принудительно обновляем все индексы
-            await self.client.indices.refresh(index="logs-*")
-        except Exception as e:
-            print(f"Error in cleanup_old_indices: {str(e)}")
-            raise
+        return deleted
     
     async def get_index_stats(self):
         """Получение статистики по индексам"""
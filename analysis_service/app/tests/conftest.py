@@ -6,6 +6,7 @@ from aiokafka import AIOKafkaProducer
 import json
 from main import app
 from config.settings import settings
+from storage.index_manager import IndexManager
 from datetime import datetime, timedelta
 
 @pytest.fixture
@@ -22,34 +23,17 @@ async def elastic_client():
             settings.ELASTICSEARCH_PASSWORD
         ) if settings.ELASTICSEARCH_USERNAME else None
     )
+    index_manager = IndexManager()
     try:
-        # Очищаем все индексы перед тестами
-        await client.indices.delete(index="logs-*", ignore=[404])
-        
-        # Создаем индекс с правильным маппингом
-        await client.indices.create(
-            index="logs-test_service",
-            body={
-                "mappings": {
-                    "properties": {
-                        "level": {"type": "keyword"},
-                        "timestamp": {"type": "date"},
-                        "service": {"type": "keyword"},
-                        "message": {"type": "text"},
-                        "error_message": {"type": "text"},
-                        "error_type": {"type": "keyword"},
-                        "stack_trace": {"type": "text"},
-                        "metadata": {"type": "object"}
-                    }
-                }
-            },
-            ignore=[400]  # Игнорируем ошибку, если индекс уже существует
-        )
+        # Логи пишутся в data stream'ы по шаблону logs-*; очищаем их перед тестами
+        await index_manager.setup_index_lifecycle()
+        await client.indices.delete_data_stream(name="logs-*", ignore=[404])
         
         yield client
     finally:
-        # Очищаем все индексы после тестов
-        await client.indices.delete(index="logs-*", ignore=[404])
+        # Очищаем все data stream'ы после тестов
+        await client.indices.delete_data_stream(name="logs-*", ignore=[404])
+        await index_manager.client.close()
         await client.close()
 
 @pytest_asyncio.fixture
@@ -18,7 +18,8 @@ async def test_get_logs(test_client, elastic_client):
     # Сохраняем тестовый лог
     await elastic_client.index(
         index='logs-test_service',
-        document=test_log
+        document={**test_log, '@timestamp': test_log['timestamp']},
+        op_type='create'
     )
     await elastic_client.indices.refresh(index='logs-test_service')
     
@@ -46,7 +47,8 @@ async def test_get_error_logs(elastic_client):
     # Сохраняем тестовую ошибку
     await elastic_client.index(
         index='logs-test_service',
-        document=test_error
+        document={**test_error, '@timestamp': test_error['timestamp']},
+        op_type='create'
     )
     await elastic_client.indices.refresh(index='logs-test_service')
     
@@ -73,4 +75,38 @@ async def test_get_error_logs(elastic_client):
                 }
             }
         )
-        assert len(result['hits']['hits']) > 0 
\ No newline at end of file
+        assert len(result['hits']['hits']) > 0 
+@pytest.mark.asyncio
+async def test_get_stats(elastic_client):
+    # Подготовка тестовых данных: 20 запросов, из них 5 с ошибкой
+    now = datetime.utcnow()
+    for i in range(20):
+        await elastic_client.index(
+            index='logs-test_service',
+            op_type='create',
+            document={
+                '@timestamp': now.isoformat(),
+                'timestamp': now.isoformat(),
+                'service': 'test_service',
+                'endpoint': '/products/{product_id}',
+                'method': 'GET',
+                'status': 'error' if i < 5 else 'success',
+                'duration_ms': float(i + 1)
+            }
+        )
+    await elastic_client.indices.refresh(index='logs-test_service')
+    
+    # Тестируем API
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.get('/stats/test_service', params={'minutes': 10, 'interval': '1m'})
+        assert response.status_code == 200
+        stats = response.json()
+        endpoint_stats = stats['endpoints']['/products/{product_id}']
+        assert endpoint_stats['count'] == 20
+        assert endpoint_stats['error_rate'] == 0.25
+        assert endpoint_stats['p50'] is not None
+        assert sum(point['count'] for point in endpoint_stats['over_time']) == 20
+        
+        # Некорректный интервал
+        response = await ac.get('/stats/test_service', params={'interval': '1week'})
+        assert response.status_code == 400
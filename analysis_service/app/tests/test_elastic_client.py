@@ -1,6 +1,9 @@
 import pytest
 from datetime import datetime, timedelta
+import storage.elastic_client
 from storage.elastic_client import ElasticClient
+from processors.rollups import Rollup
+from config.settings import settings
 from storage.index_manager import IndexManager
 
 @pytest.mark.asyncio
@@ -17,7 +20,8 @@ async def test_index_log(elastic_client):
     # Индексируем лог
     await elastic_client.index(
         index='logs-test_service',
-        document=test_log
+        document={**test_log, '@timestamp': test_log['timestamp']},
+        op_type='create'
     )
     await elastic_client.indices.refresh(index='logs-test_service')
     
@@ -61,7 +65,8 @@ async def test_search_logs(elastic_client):
     for log in test_logs:
         await elastic_client.index(
             index='logs-test_service',
-            document=log
+            document={**log, '@timestamp': log['timestamp']},
+            op_type='create'
         )
     
     await elastic_client.indices.refresh(index='logs-test_service')
@@ -125,18 +130,27 @@ async def test_index_lifecycle(elastic_client):
         }
     ]
     
-    # Индексируем логи
-    for log in test_logs:
-        await elastic_client.index(
-            index='logs-test_service',
-            document=log
-        )
+    # Старый лог попадает в первый backing-индекс, после rollover
+    # новый лог пишется в следующий
+    old_log, new_log = test_logs
+    await elastic_client.index(
+        index='logs-test_service',
+        document={**old_log, '@timestamp': old_log['timestamp']},
+        op_type='create'
+    )
+    await elastic_client.indices.rollover(alias='logs-test_service')
+    await elastic_client.index(
+        index='logs-test_service',
+        document={**new_log, '@timestamp': new_log['timestamp']},
+        op_type='create'
+    )
     
     await elastic_client.indices.refresh(index='logs-test_service')
     
-    # Запускаем очистку старых индексов
+    # Запускаем очистку старых индексов: индекс удаляется целиком
     index_manager = IndexManager()
-    await index_manager.cleanup_old_indices(days=30)
+    deleted = await index_manager.cleanup_old_indices(days=30)
+    assert len(deleted) == 1
     await elastic_client.indices.refresh(index='logs-test_service')
     
     # Проверяем, что старые логи удалены
@@ -172,4 +186,31 @@ async def test_index_lifecycle(elastic_client):
         }
     )
     
-    assert len(result['hits']['hits']) > 0 
\ No newline at end of file
+    assert len(result['hits']['hits']) > 0 
+
+@pytest.mark.asyncio
+async def test_get_rollups_pages_through_all_minutes(elastic_client, monkeypatch):
+    # Агрегатов больше, чем помещается на страницу: ни одна минута не теряется
+    monkeypatch.setattr(storage.elastic_client, "ROLLUP_PAGE_SIZE", 3)
+    start = datetime.utcnow().replace(second=0, microsecond=0) - timedelta(minutes=10)
+    rollups = []
+    for i in range(5):
+        for endpoint in ('/a', '/b'):
+            rollup = Rollup('test_rollup_service', endpoint, start + timedelta(minutes=i), 0.01)
+            rollup.add(float(i + 1), False)
+            rollups.append(rollup)
+    client = ElasticClient()
+    await client.init()
+    try:
+        await elastic_client.delete_by_query(index=settings.ROLLUP_INDEX, ignore_unavailable=True,
+                                             query={"term": {"service": "test_rollup_service"}})
+        await client.write_rollups(rollups, source='test')
+        await elastic_client.indices.refresh(index=settings.ROLLUP_INDEX)
+
+        result = await client.get_rollups('test_rollup_service', {'gte': start.isoformat()})
+
+        assert [(r.minute, r.endpoint) for r in result] == [(r.minute, r.endpoint) for r in rollups]
+    finally:
+        await elastic_client.delete_by_query(index=settings.ROLLUP_INDEX, ignore_unavailable=True,
+                                             query={"term": {"service": "test_rollup_service"}})
+        await client.close()
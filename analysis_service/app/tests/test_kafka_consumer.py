@@ -1,5 +1,7 @@
 import pytest
+import json
 from datetime import datetime
+from types import SimpleNamespace
 from consumers.kafka_consumer import KafkaLogConsumer
 from processors.log_processor import LogProcessor
 
@@ -90,4 +92,52 @@ async def test_process_error(kafka_producer, elastic_client):
     saved_error = result['hits']['hits'][0]['_source']
     assert saved_error['error_message'] == 'Test error message'
     assert saved_error['level'] == 'ERROR'
-    assert 'processed_at' in saved_error 
\ No newline at end of file
+    assert 'processed_at' in saved_error 
+@pytest.mark.asyncio
+async def test_process_batch(elastic_client):
+    # Пачка сообщений в том виде, в котором их возвращает getmany
+    messages = [
+        SimpleNamespace(
+            topic='errors' if i % 10 == 0 else 'logs',
+            partition=0,
+            offset=i,
+            key=None,
+            value=json.dumps({
+                'timestamp': datetime.utcnow().isoformat(),
+                'service': 'test_service',
+                'level': 'INFO',
+                'message': f'Batch log {i}',
+                'metadata': {'test': 'batch'}
+            }).encode('utf-8')
+        )
+        for i in range(50)
+    ]
+    # Некорректное сообщение уходит в DLQ и не мешает остальным
+    poison = SimpleNamespace(topic='logs', partition=0, offset=50, key=None, value=b'not json')
+    
+    processor = LogProcessor()
+    result = await processor.process_batch(messages + [poison])
+    assert result['indexed'] == 50
+    assert result['retryable'] == []
+    assert [message for message, _ in result['dead_letters']] == [poison]
+    
+    # Повторная обработка той же пачки не создаёт дубликатов
+    result = await processor.process_batch(messages)
+    assert result['indexed'] == 50
+    
+    await elastic_client.indices.refresh(index='logs-test_service')
+    result = await elastic_client.count(
+        index='logs-test_service',
+        body={'query': {'match': {'message': 'Batch'}}}
+    )
+    assert result['count'] == 50
+    
+    # Произвольные поля события хранятся в неиндексируемом payload
+    result = await elastic_client.search(index='logs-test_service', body={'size': 1})
+    assert result['hits']['hits'][0]['_source']['payload'] == {'metadata': {'test': 'batch'}}
+    
+    result = await elastic_client.count(
+        index='logs-test_service',
+        body={'query': {'term': {'log_type': 'error'}}}
+    )
+    assert result['count'] == 5
@@ -0,0 +1,64 @@
+import random
+from datetime import datetime, timedelta, timezone
+from processors.rollups import QuantileSketch, Rollup, RollupAggregator, merge_rollups
+
+def test_sketch_quantiles():
+    random.seed(42)
+    values = [random.expovariate(1 / 50) for _ in range(10000)]
+    sketch = QuantileSketch(0.01)
+    for value in values:
+        sketch.add(value)
+
+    values.sort()
+    for q in (0.5, 0.95, 0.99):
+        exact = values[int(q * (len(values) - 1))]
+        assert abs(sketch.quantile(q) - exact) <= exact * 0.02
+
+def test_sketch_merge_and_serialization():
+    left, right, combined = QuantileSketch(), QuantileSketch(), QuantileSketch()
+    for i in range(1, 1001):
+        (left if i % 2 else right).add(i)
+        combined.add(i)
+
+    left.merge(QuantileSketch.from_dict(right.to_dict()))
+    assert left.count == 1000
+    assert left.quantile(0.99) == combined.quantile(0.99)
+
+def test_aggregator_rollups():
+    minute = datetime(2024, 1, 1, 12, 0)
+    aggregator = RollupAggregator(grace_seconds=30)
+    for i in range(100):
+        aggregator.add({
+            'timestamp': (minute + timedelta(seconds=i % 60)).isoformat(),
+            'service': 'test_service',
+            'endpoint': '/products/{product_id}',
+            'status': 'error' if i % 10 == 0 else 'success',
+            'duration_ms': float(i + 1)
+        })
+
+    # Минута ещё не закрыта с учётом ожидания запоздавших событий
+    assert aggregator.pop_closed(now=minute + timedelta(seconds=80)) == []
+    rollups = aggregator.pop_closed(now=minute + timedelta(seconds=90))
+    assert len(rollups) == 1
+    assert rollups[0].count == 100
+    assert rollups[0].error_count == 10
+
+    # Агрегаты двух потребителей за одну минуту объединяются
+    copy = Rollup.from_document(rollups[0].to_document())
+    merged = merge_rollups([rollups[0], copy])
+    assert merged[copy.key].count == 200
+    assert merged[copy.key].to_document()['p50'] == copy.to_document()['p50']
+
+def test_aggregator_minutes_in_utc():
+    # Событие с поясом попадает в минуту UTC, как и диапазоны /stats и /rollups
+    aggregator = RollupAggregator(grace_seconds=0)
+    moscow = timezone(timedelta(hours=3))
+    aggregator.add({
+        'timestamp': datetime(2024, 1, 1, 15, 0, 30, tzinfo=moscow).isoformat(),
+        'service': 'test_service',
+        'endpoint': '/products',
+        'status': 'success',
+        'duration_ms': 5.0
+    })
+    [rollup] = aggregator.pop_closed(now=datetime(2024, 1, 1, 12, 1))
+    assert rollup.minute == datetime(2024, 1, 1, 12, 0)
@@ -1,80 +1,400 @@
 import json
-import functools
+import os
 import asyncio
+import atexit
+import threading
+import time
+from collections import deque
 from aiokafka import AIOKafkaProducer
-from datetime import datetime
+from metrics import count_log_event
 
 # Kafka configuration
-KAFKA_BOOTSTRAP_SERVERS = "kafka:9092"
+KAFKA_BOOTSTRAP_SERVERS = os.getenv("KAFKA_BOOTSTRAP_SERVERS", "kafka:9092")
 # KAFKA_TOPIC = "auth_logs"
+LOGS_TOPIC = "logs"
+ERRORS_TOPIC = "errors"
 
-async def get_kafka_producer():
-    try:
+# Настройки батчинга producer'а: сообщения копятся до KAFKA_LINGER_MS
+# или до KAFKA_MAX_BATCH_SIZE байт и уходят в брокер одним запросом
+KAFKA_LINGER_MS = int(os.getenv("KAFKA_LINGER_MS", "50"))
+KAFKA_MAX_BATCH_SIZE = int(os.getenv("KAFKA_MAX_BATCH_SIZE", "65536"))
+KAFKA_COMPRESSION_TYPE = os.getenv("KAFKA_COMPRESSION_TYPE", "gzip")
+KAFKA_REQUEST_TIMEOUT_MS = int(os.getenv("KAFKA_REQUEST_TIMEOUT_MS", "10000"))
+# Пауза перед повторным подключением, если брокер недоступен
+KAFKA_RECONNECT_BACKOFF_S = float(os.getenv("KAFKA_RECONNECT_BACKOFF_S", "5"))
+
+# Настройки очереди логов
+LOG_QUEUE_MAXSIZE = int(os.getenv("LOG_QUEUE_MAXSIZE", "10000"))
+LOG_ERROR_QUEUE_MAXSIZE = int(os.getenv("LOG_ERROR_QUEUE_MAXSIZE", "10000"))
+# drop_oldest - вытесняются самые старые логи успешных запросов,
+# drop_newest - отбрасывается новый лог. Ошибки не отбрасываются никогда.
+LOG_OVERFLOW_POLICY = os.getenv("LOG_OVERFLOW_POLICY", "drop_oldest")
+LOG_FLUSH_BATCH_SIZE = int(os.getenv("LOG_FLUSH_BATCH_SIZE", "500"))
+LOG_FLUSH_INTERVAL_S = float(os.getenv("LOG_FLUSH_INTERVAL_S", "1"))
+LOG_SHUTDOWN_TIMEOUT_S = float(os.getenv("LOG_SHUTDOWN_TIMEOUT_S", "10"))
+
+# Настройки буфера на диске на время недоступности Kafka
+LOG_SPOOL_DIR = os.getenv("LOG_SPOOL_DIR", "/tmp/log_spool/auth_service")
+LOG_SPOOL_SEGMENT_BYTES = int(os.getenv("LOG_SPOOL_SEGMENT_BYTES", str(16 * 1024 * 1024)))
+
+# Общий для всего процесса producer, запускается в lifespan приложения
+_producer = None
+_producer_lock = asyncio.Lock()
+_reconnect_after = 0.0
+
+
+async def start_kafka_producer():
+    """
+    Запуск общего Kafka producer'а.
+    Ошибка подключения не роняет приложение: producer будет
+    запущен повторно при отправке следующего лога.
+    """
+    global _producer, _reconnect_after
+    async with _producer_lock:
+        if _producer is not None:
+            return _producer
+        if time.monotonic() < _reconnect_after:
+            return None
         producer = AIOKafkaProducer(
             bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
-            value_serializer=lambda v: json.dumps(v).encode('utf-8')
+            value_serializer=lambda v: json.dumps(v).encode('utf-8'),
+            linger_ms=KAFKA_LINGER_MS,
+            max_batch_size=KAFKA_MAX_BATCH_SIZE,
+            request_timeout_ms=KAFKA_REQUEST_TIMEOUT_MS,
+            compression_type=None if KAFKA_COMPRESSION_TYPE == "none" else KAFKA_COMPRESSION_TYPE
         )
-        await producer.start()
-        return producer
+        try:
+            await producer.start()
+        except Exception as e:
+            print(f"Error creating Kafka producer: {e}")
+            await producer.stop()
+            _reconnect_after = time.monotonic() + KAFKA_RECONNECT_BACKOFF_S
+            return None
+        _producer = producer
+        return _producer
+
+
+async def stop_kafka_producer():
+    """
+    Остановка общего producer'а с отправкой накопленных сообщений
+    """
+    global _producer
+    async with _producer_lock:
+        producer, _producer = _producer, None
+    if producer is None:
+        return
+    try:
+        await producer.flush()
+    except Exception as e:
+        print(f"Error flushing Kafka producer: {e}")
+    finally:
+        await producer.stop()
+
+
+async def get_kafka_producer():
+    if _producer is not None:
+        return _producer
+    return await start_kafka_producer()
+
+
+class LogSpool:
+    """
+    Буфер логов на локальном диске.
+    Записи дописываются в текущий сегмент (JSON Lines), закрытые сегменты
+    переотправляются в Kafka после восстановления брокера.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self._lock = threading.Lock()
+        self._file = None
+        self._path = None
+        os.makedirs(self.directory, exist_ok=True)
+
+    def append(self, records):
+        """Дописывает пары (topic, log_data) в текущий сегмент"""
+        lines = "".join(json.dumps({"topic": t, "value": v}) + "\n" for t, v in records)
+        with self._lock:
+            if self._file is None:
+                self._path = os.path.join(self.directory, f"segment-{time.time_ns()}.jsonl")
+                self._file = open(self._path, "a", encoding="utf-8")
+            self._file.write(lines)
+            self._file.flush()
+            if self._file.tell() >= self.segment_bytes:
+                self._seal()
+
+    def _seal(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._path = None
+
+    def seal(self):
+        """Закрывает текущий сегмент, чтобы его можно было переотправить"""
+        with self._lock:
+            self._seal()
+
+    def segments(self):
+        """Закрытые сегменты в порядке записи"""
+        with self._lock:
+            names = sorted(n for n in os.listdir(self.directory) if n.endswith(".jsonl"))
+            return [os.path.join(self.directory, n) for n in names
+                    if os.path.join(self.directory, n) != self._path]
+
+    def has_data(self):
+        with self._lock:
+            return self._path is not None or any(n.endswith(".jsonl") for n in os.listdir(self.directory))
+
+    @staticmethod
+    def read_segment(path: str):
+        records = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    records.append((record["topic"], record["value"]))
+                except (ValueError, KeyError):
+                    # Недописанная строка после аварийного завершения
+                    continue
+        return records
+
+    @staticmethod
+    def rewrite_segment(path: str, records):
+        """Оставляет в сегменте только ещё не отправленные записи"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for topic, value in records:
+                f.write(json.dumps({"topic": topic, "value": value}) + "\n")
+        os.replace(tmp_path, path)
+
+
+# Очереди логов: ошибки и успешные запросы хранятся раздельно,
+# чтобы при переполнении вытеснять только успешные логи
+_log_queue = None
+_error_queue = None
+_wakeup = None
+_flusher_task = None
+_stopping = False
+_spool = None
+# Ошибки, не поместившиеся в _error_queue или записанные до запуска
+# конвейера; на диск их пишет фоновая задача
+_error_overflow = deque()
+# Пачка, которую сейчас отправляет _flush_loop: при ошибке она
+# отправляется снова, при остановке по таймауту - пишется на диск
+_in_flight = []
+_kafka_healthy = True
+_next_probe_at = 0.0
+
+
+def enqueue_log(topic: str, log_data: dict):
+    """
+    Постановка лога в очередь без ожидания Kafka.
+    Вызывается на пути обработки запроса, поэтому никогда не блокируется.
+    """
+    if _log_queue is None:
+        if topic == ERRORS_TOPIC:
+            # Ошибки не теряются и до запуска конвейера
+            _error_overflow.append((topic, log_data))
+        else:
+            count_log_event("dropped", topic)
+        return
+    if topic == ERRORS_TOPIC:
+        if _error_queue.full():
+            # Ошибки не теряются: при переполнении очереди уходят на диск,
+            # но запись в файл делает _flush_loop, а не цикл событий запроса
+            _error_overflow.append((topic, log_data))
+        else:
+            _error_queue.put_nowait((topic, log_data))
+            count_log_event("enqueued", topic)
+    else:
+        if _log_queue.full():
+            if LOG_OVERFLOW_POLICY == "drop_newest":
+                count_log_event("dropped", topic)
+                return
+            dropped_topic, _ = _log_queue.get_nowait()
+            count_log_event("dropped", dropped_topic)
+        _log_queue.put_nowait((topic, log_data))
+        count_log_event("enqueued", topic)
+    _wakeup.set()
+
+
+def _take_batch():
+    batch = []
+    for queue in (_error_queue, _log_queue):
+        while len(batch) < LOG_FLUSH_BATCH_SIZE and not queue.empty():
+            batch.append(queue.get_nowait())
+    return batch
+
+
+async def _send_batch(producer, records):
+    """
+    Отправляет записи и возвращает количество подтверждённых брокером
+    с начала списка
+    """
+    futures = []
+    try:
+        for topic, value in records:
+            futures.append(await producer.send(topic, value))
     except Exception as e:
-        print(f"Error creating Kafka producer: {e}")
-        raise
+        print(f"Error sending logs to Kafka: {e}")
+    results = await asyncio.gather(*futures, return_exceptions=True)
+    for sent, result in enumerate(results):
+        if isinstance(result, Exception):
+            print(f"Error delivering logs to Kafka: {result}")
+            return sent
+    return len(results)
+
+
+async def _spool_records(records):
+    if not records:
+        return
+    await asyncio.to_thread(_spool.append, records)
+    for topic, _ in records:
+        count_log_event("spooled", topic)
+
+
+async def _spool_overflow():
+    # Записи убираются из очереди только после записи на диск;
+    # новые добавляются справа, поэтому снимаются первые len(records)
+    records = list(_error_overflow)
+    await _spool_records(records)
+    for _ in records:
+        _error_overflow.popleft()
+
+
+@atexit.register
+def _spool_on_exit():
+    """Ошибки, записанные после остановки конвейера, сохраняются при выходе"""
+    if _error_overflow:
+        (_spool or LogSpool(LOG_SPOOL_DIR, LOG_SPOOL_SEGMENT_BYTES)).append(list(_error_overflow))
+        _error_overflow.clear()
+
+
+def _mark_kafka_unavailable():
+    global _kafka_healthy, _next_probe_at
+    _kafka_healthy = False
+    _next_probe_at = time.monotonic() + KAFKA_RECONNECT_BACKOFF_S
 
-def log_to_kafka(func):
-    @functools.wraps(func)
-    async def wrapper(*args, **kwargs):
-        start_time = datetime.now()
+
+async def _deliver(batch):
+    """Отправка пачки в Kafka, а при недоступности брокера - на диск"""
+    global _kafka_healthy
+    if not _kafka_healthy and time.monotonic() < _next_probe_at:
+        await _spool_records(batch)
+        return
+    producer = await get_kafka_producer()
+    if producer is None:
+        _mark_kafka_unavailable()
+        await _spool_records(batch)
+        return
+    sent = await _send_batch(producer, batch)
+    if sent < len(batch):
+        _mark_kafka_unavailable()
+        await _spool_records(batch[sent:])
+        return
+    _kafka_healthy = True
+
+
+async def _replay_spool():
+    """Переотправка сегментов с диска после восстановления Kafka"""
+    global _kafka_healthy
+    _spool.seal()
+    for path in _spool.segments():
+        producer = await get_kafka_producer()
+        if producer is None:
+            _mark_kafka_unavailable()
+            return
+        records = await asyncio.to_thread(LogSpool.read_segment, path)
+        for start in range(0, len(records), LOG_FLUSH_BATCH_SIZE):
+            chunk = records[start:start + LOG_FLUSH_BATCH_SIZE]
+            sent = await _send_batch(producer, chunk)
+            for topic, _ in chunk[:sent]:
+                count_log_event("replayed", topic)
+            if sent < len(chunk):
+                _mark_kafka_unavailable()
+                await asyncio.to_thread(LogSpool.rewrite_segment, path, records[start + sent:])
+                return
+        os.remove(path)
+    _kafka_healthy = True
+
+
+async def _flush_loop():
+    global _in_flight
+    while True:
         try:
-            # Get request object from args if it exists
-            request = next((arg for arg in args if hasattr(arg, 'json')), None)
-            
-            # Prepare log data
-            log_data = {
-                "timestamp": start_time.isoformat(),
-                "service": "auth_service",
-                "endpoint": func.__name__,
-                "status": "started",
-                "request_data": {}
-            }
-            
-            # Try to get request data if available
-            if request:
+            _wakeup.clear()
+            await _spool_overflow()
+            if not _in_flight:
+                _in_flight = _take_batch()
+            if _in_flight:
+                await _deliver(_in_flight)
+                _in_flight = []
+                continue
+            if _stopping:
+                return
+            if _spool.has_data() and (_kafka_healthy or time.monotonic() >= _next_probe_at):
                 try:
-                    log_data["request_data"] = await request.json()
-                except:
-                    pass
-            
-            # Execute the original function
-            result = await func(*args, **kwargs)
-            
-            # Update log data with success
-            log_data.update({
-                "status": "success",
-                "duration_ms": (datetime.now() - start_time).total_seconds() * 1000
-            })
-            
-            # Send log to Kafka
-            producer = await get_kafka_producer()
-            print("LOG_TO_KAFKA: sending log", log_data)
-            await producer.send_and_wait("logs", log_data)
-            await producer.stop()
-            
-            return result
-            
+                    await _replay_spool()
+                except Exception as e:
+                    print(f"Error replaying spooled logs: {e}")
+            try:
+                await asyncio.wait_for(_wakeup.wait(), timeout=LOG_FLUSH_INTERVAL_S)
+            except asyncio.TimeoutError:
+                pass
         except Exception as e:
-            # Update log data with error
-            log_data.update({
-                "status": "error",
-                "error": str(e),
-                "duration_ms": (datetime.now() - start_time).total_seconds() * 1000
-            })
-            
-            # Send error log to Kafka
-            producer = await get_kafka_producer()
-            print("LOG_TO_KAFKA: sending error", log_data)
-            await producer.send_and_wait("errors", log_data)
-            await producer.stop()
-            
-            raise
-    
-    return wrapper 
\ No newline at end of file
+            # Например, диск для буфера заполнен: задача не завершается,
+            # пачка остается в _in_flight и отправляется снова после паузы
+            print(f"Error in log flusher: {e}")
+            await asyncio.sleep(LOG_FLUSH_INTERVAL_S)
+
+
+async def start_log_pipeline():
+    """
+    Запуск конвейера логов: producer и фоновая задача, разгружающая очередь
+    """
+    global _log_queue, _error_queue, _wakeup, _flusher_task, _stopping, _spool, _in_flight
+    if _flusher_task is not None:
+        return
+    _in_flight = []
+    _log_queue = asyncio.Queue(maxsize=LOG_QUEUE_MAXSIZE)
+    _error_queue = asyncio.Queue(maxsize=LOG_ERROR_QUEUE_MAXSIZE)
+    _wakeup = asyncio.Event()
+    _stopping = False
+    _spool = LogSpool(LOG_SPOOL_DIR, LOG_SPOOL_SEGMENT_BYTES)
+    if await start_kafka_producer() is None:
+        _mark_kafka_unavailable()
+    _flusher_task = asyncio.create_task(_flush_loop())
+
+
+async def stop_log_pipeline():
+    """
+    Остановка конвейера: очередь дописывается в Kafka, а то, что не успело
+    уйти за LOG_SHUTDOWN_TIMEOUT_S, сохраняется на диск до следующего запуска
+    """
+    global _log_queue, _error_queue, _flusher_task, _stopping, _in_flight
+    if _flusher_task is None:
+        return
+    _stopping = True
+    _wakeup.set()
+    try:
+        await asyncio.wait_for(_flusher_task, timeout=LOG_SHUTDOWN_TIMEOUT_S)
+    except asyncio.TimeoutError:
+        print("Timeout while flushing log queue, spooling the rest to disk")
+    except Exception as e:
+        print(f"Error in log flusher: {e}")
+    # Пачка, прерванная таймаутом, могла уйти в Kafka частично: доставка
+    # "хотя бы раз", часть записей после переотправки может повториться
+    remaining, _in_flight = _in_flight or _take_batch(), []
+    try:
+        await _spool_overflow()
+        while remaining:
+            await _spool_records(remaining)
+            remaining = _take_batch()
+    except Exception as e:
+        print(f"Error spooling logs on shutdown: {e}")
+    _spool.seal()
+    _flusher_task = None
+    _log_queue = None
+    _error_queue = None
+    await stop_kafka_producer()
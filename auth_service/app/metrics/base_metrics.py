@@ -40,6 +40,31 @@ class BaseMetrics:
             ['service', 'operation']
         )
 
+        # Метрики конвейера логов в Kafka
+        self.metrics['log_enqueued'] = Counter(
+            'log_events_enqueued_total',
+            'Total number of log events put into the in-process queue',
+            ['service', 'topic']
+        )
+
+        self.metrics['log_dropped'] = Counter(
+            'log_events_dropped_total',
+            'Total number of log events dropped on queue overflow',
+            ['service', 'topic']
+        )
+
+        self.metrics['log_spooled'] = Counter(
+            'log_events_spooled_total',
+            'Total number of log events written to the disk spool',
+            ['service', 'topic']
+        )
+
+        self.metrics['log_replayed'] = Counter(
+            'log_events_replayed_total',
+            'Total number of spooled log events replayed to Kafka',
+            ['service', 'topic']
+        )
+
     def api_metrics(self):
         """Декоратор для автоматического сбора метрик API"""
         def decorator(func):
@@ -54,22 +79,26 @@ class BaseMetrics:
                     raise e
                 finally:
                     duration = time.time() - start_time
-                    self.metrics['api_requests'].labels(
-                        service=self.service_name,
-                        endpoint=func.__name__,
-                        method='GET',  # TODO: сделать динамическим
-                        status=status
-                    ).inc()
-                    
-                    self.metrics['api_duration'].labels(
-                        service=self.service_name,
-                        endpoint=func.__name__,
-                        method='GET'  # TODO: сделать динамическим
-                    ).observe(duration)
+                    self.observe_api_request(func.__name__, 'GET', status, duration)
                 return response
             return wrapper
         return decorator
 
+    def observe_api_request(self, endpoint: str, method: str, status: str, duration: float):
+        """Учёт одного API-запроса (используется декоратором и middleware)"""
+        self.metrics['api_requests'].labels(
+            service=self.service_name,
+            endpoint=endpoint,
+            method=method,
+            status=status
+        ).inc()
+
+        self.metrics['api_duration'].labels(
+            service=self.service_name,
+            endpoint=endpoint,
+            method=method
+        ).observe(duration)
+
     def db_metrics(self, operation: str):
         """Декоратор для автоматического сбора метрик БД"""
         def decorator(func):
@@ -98,6 +127,13 @@ class BaseMetrics:
             return wrapper
         return decorator
 
+    def count_log_event(self, event: str, topic: str):
+        """Учёт событий конвейера логов: enqueued, dropped, spooled, replayed"""
+        self.metrics[f'log_{event}'].labels(
+            service=self.service_name,
+            topic=topic
+        ).inc()
+
     async def metrics_endpoint(self):
         """Эндпоинт для Prometheus"""
         return Response(generate_latest(), media_type='text/plain') 
\ No newline at end of file
@@ -7,10 +7,14 @@ from sqlalchemy.orm import joinedload, selectinload
 from sqlalchemy import text, delete
 from metrics import db_metrics
 import httpx
-import requests
 from http import HTTPStatus
 import jwt
 import os
+from datetime import datetime, timezone
+from logging_decorator import enqueue_log, ERRORS_TOPIC
+from instrumentation import SERVICE_NAME
+
+CATALOG_URL = "http://catalog_service:8003"
 
 @db_metrics(operation="get_cart_items")
 async def get_cart_items(db: AsyncSession, user_id: int):
@@ -153,6 +157,31 @@ async def get_all_cart_items(db: AsyncSession, user_id: int):
     
     return cart.items
 
+def log_checkout_error(user_id: int, error: str, items: list):
+    enqueue_log(ERRORS_TOPIC, {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "service": SERVICE_NAME,
+        "endpoint": "create_order",
+        "status": "error",
+        "error": error,
+        "request_data": {"user_id": user_id, "items": items}
+    })
+
+
+async def restore_stock(client: httpx.AsyncClient, user_id: int, items: list):
+    """Компенсация списания, если заказ не удалось создать"""
+    try:
+        response = await client.post(f"{CATALOG_URL}/api/products/increment_stock_batch",
+                                     json={"items": items}, timeout=3)
+        if response.status_code == 200:
+            return
+        error = f"{response.status_code} {response.text}"
+    except httpx.HTTPError as e:
+        error = str(e)
+    # Остатки придется вернуть вручную: позиции есть в логе ошибок
+    log_checkout_error(user_id, f"Stock restore failed: {error}", items)
+
+
 async def create_order_logic(token: str, db: AsyncSession):
     from db.functions import get_cart_with_items, clear_user_cart
     from db.models import CartItem
@@ -171,28 +200,45 @@ async def create_order_logic(token: str, db: AsyncSession):
     if not cart_data:
         return {"error": "Cart not found"}
 
+    # Остатки по всем позициям списываются одним запросом в одной транзакции
+    # до создания заказа: если товара не хватает, заказ не создается
+    items = [{"product_id": item["product_id"], "quantity": item["quantity"]}
+             for item in cart_data["cart_items"]]
     headers = {
         "Authorization": f"Bearer {token}",
         "Content-Type": "application/json"
     }
-    order_response = requests.post(
-        "http://auth_service:8001/create_order",
-        headers=headers,
-        json=cart_data
-    )
-    if order_response.status_code != 200:
-        raise HTTPException(status_code=502, detail="Order service error")
-
-    order_id = order_response.json().get("order_id")
-    if order_id:
-        for item in cart_data["cart_items"]:
-            try:
-                requests.post(
-                    "http://catalog_service:8003/api/products/decrement_stock",
-                    json={"product_id": item["product_id"], "quantity": item["quantity"]},
-                    timeout=3
-                )
-            except Exception as e:
-                print(f"Ошибка уменьшения stock для товара {item['product_id']}: {e}")
-        await clear_user_cart(db, user_id)
+    async with httpx.AsyncClient() as client:
+        try:
+            stock_response = await client.post(f"{CATALOG_URL}/api/products/decrement_stock_batch",
+                                               json={"items": items}, timeout=3)
+        except httpx.HTTPError as e:
+            log_checkout_error(user_id, f"Stock decrement failed: {e}", items)
+            raise HTTPException(status_code=HTTPStatus.BAD_GATEWAY, detail="Catalog service error")
+        if stock_response.status_code == HTTPStatus.CONFLICT:
+            # Итог по каждой позиции: каких товаров не хватило
+            raise HTTPException(status_code=HTTPStatus.CONFLICT, detail=stock_response.json().get("detail"))
+        if stock_response.status_code != 200:
+            log_checkout_error(user_id, f"Stock decrement failed: {stock_response.status_code} {stock_response.text}", items)
+            raise HTTPException(status_code=HTTPStatus.BAD_GATEWAY, detail="Catalog service error")
+
+        order_id = None
+        try:
+            order_response = await client.post(
+                "http://auth_service:8001/create_order",
+                headers=headers,
+                json=cart_data
+            )
+            if order_response.status_code == 200:
+                order_id = order_response.json().get("order_id")
+            else:
+                log_checkout_error(user_id, f"Order creation failed: {order_response.status_code} {order_response.text}", items)
+        except httpx.HTTPError as e:
+            log_checkout_error(user_id, f"Order creation failed: {e}", items)
+        if not order_id:
+            # Заказ не создан - списанные остатки возвращаются, корзина остается
+            await restore_stock(client, user_id, items)
+            raise HTTPException(status_code=502, detail="Order service error")
+
+    await clear_user_cart(db, user_id)
     return {"message": "Order created successfully"}
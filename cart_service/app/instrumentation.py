@@ -0,0 +1,134 @@
+import json
+import os
+import random
+import time
+from datetime import datetime, timezone
+from urllib.parse import parse_qsl
+from opentelemetry import trace
+from metrics import observe_api_request
+from logging_decorator import enqueue_log, LOGS_TOPIC, ERRORS_TOPIC
+
+SERVICE_NAME = "cart_service"
+
+# Доля запросов, для которых в лог попадает тело, и его предельный размер
+LOG_BODY_SAMPLE_RATE = float(os.getenv("LOG_BODY_SAMPLE_RATE", "0.1"))
+LOG_BODY_MAX_BYTES = int(os.getenv("LOG_BODY_MAX_BYTES", "4096"))
+
+# Пути, которые не логируются и не попадают в метрики
+EXCLUDED_PATHS = ("/metrics", "/health", "/static")
+SENSITIVE_FIELDS = {"password", "token", "access_token", "secret"}
+
+
+def _parse_body(body: bytes, content_type: str):
+    """Разбор сохранённого тела запроса с маскированием чувствительных полей"""
+    try:
+        if content_type.startswith("application/json"):
+            data = json.loads(body)
+        elif content_type.startswith("application/x-www-form-urlencoded"):
+            data = dict(parse_qsl(body.decode("utf-8")))
+        else:
+            return {}
+    except ValueError:
+        return {}
+    if isinstance(data, dict):
+        return {k: "***" if k in SENSITIVE_FIELDS else v for k, v in data.items()}
+    return data
+
+
+class InstrumentationMiddleware:
+    """
+    ASGI middleware, которое один раз измеряет каждый запрос и по этому
+    измерению пишет метрику Prometheus, атрибуты спана и лог в Kafka.
+    Запрос помечается шаблоном маршрута и реальным HTTP-методом.
+    """
+
+    def __init__(self, app, service_name: str = SERVICE_NAME,
+                 body_sample_rate: float = LOG_BODY_SAMPLE_RATE,
+                 body_max_bytes: int = LOG_BODY_MAX_BYTES,
+                 excluded_paths=EXCLUDED_PATHS):
+        self.app = app
+        self.service_name = service_name
+        self.body_sample_rate = body_sample_rate
+        self.body_max_bytes = body_max_bytes
+        self.excluded_paths = tuple(excluded_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.excluded_paths):
+            await self.app(scope, receive, send)
+            return
+
+        # Время событий - UTC с указанием пояса, как ожидает analysis_service
+        timestamp = datetime.now(timezone.utc)
+        start_time = time.perf_counter()
+        status_code = 500
+        error = None
+        capture_body = scope["method"] in ("POST", "PUT", "PATCH") and random.random() < self.body_sample_rate
+        body = bytearray()
+        body_size = 0
+
+        async def receive_wrapper():
+            nonlocal body_size
+            message = await receive()
+            if capture_body and message["type"] == "http.request":
+                chunk = message.get("body", b"")
+                body_size += len(chunk)
+                if body_size <= self.body_max_bytes:
+                    body.extend(chunk)
+            return message
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            duration = time.perf_counter() - start_time
+            self._record(scope, timestamp, duration, status_code, error,
+                         body if capture_body else None, body_size)
+
+    def _record(self, scope, timestamp, duration, status_code, error, body, body_size):
+        # Шаблон маршрута (например /products/{product_id}) проставляет роутер FastAPI
+        route = scope.get("route")
+        endpoint = getattr(route, "path", None) or "unmatched"
+        method = scope["method"]
+        is_error = error is not None or status_code >= 400
+        duration_ms = duration * 1000
+
+        observe_api_request(endpoint, method, "error" if is_error else "success", duration)
+
+        trace_id = None
+        span = trace.get_current_span()
+        if span.is_recording():
+            span.set_attribute("http.route", endpoint)
+            span.set_attribute("app.duration_ms", duration_ms)
+            span_context = span.get_span_context()
+            trace_id = format(span_context.trace_id, "032x")
+
+        log_data = {
+            "timestamp": timestamp.isoformat(),
+            "service": self.service_name,
+            "endpoint": endpoint,
+            "method": method,
+            "status": "error" if is_error else "success",
+            "status_code": status_code,
+            "duration_ms": duration_ms,
+            "trace_id": trace_id,
+            "request_data": {}
+        }
+        if error is not None:
+            log_data["error"] = str(error)
+        if body is not None:
+            if body_size > self.body_max_bytes:
+                log_data["request_data"] = {"truncated": True, "size": body_size}
+            else:
+                headers = dict(scope.get("headers") or [])
+                content_type = headers.get(b"content-type", b"").decode("latin-1")
+                log_data["request_data"] = _parse_body(bytes(body), content_type)
+
+        enqueue_log(ERRORS_TOPIC if is_error else LOGS_TOPIC, log_data)
@@ -14,8 +14,9 @@ from fastapi.security import OAuth2PasswordBearer
 from db.models import Cart, CartItem
 import jwt
 import requests
-from logging_decorator import log_to_kafka
-from metrics import metrics_endpoint, api_metrics
+from logging_decorator import start_log_pipeline, stop_log_pipeline
+from instrumentation import InstrumentationMiddleware
+from metrics import metrics_endpoint
 from config.tracing import setup_tracing
 from metrics.tracing_decorator import trace_function
 import os
@@ -42,11 +43,17 @@ def verify_token(token: str):
 
 async def lifespan(app: FastAPI) -> AsyncGenerator:
     await init_db()
+    await start_log_pipeline()
     yield
+    await stop_log_pipeline()
 
 
 app = FastAPI(lifespan=lifespan)
 
+# Единое измерение запросов: метрики, атрибуты спана и лог в Kafka.
+# Добавляется до трейсинга, чтобы выполняться внутри серверного спана.
+app.add_middleware(InstrumentationMiddleware)
+
 # Инициализация трейсинга
 tracer = setup_tracing(app)
 
@@ -67,8 +74,6 @@ async def metrics():
     return await metrics_endpoint()
 
 @app.get("/cart/add")
-@api_metrics()
-@trace_function(name="add_to_cart", include_request=True)
 async def add_to_cart(product_id: int = None, token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
     user_id = verify_token(token)
     cart = await add_product_to_cart(db, user_id, product_id)
@@ -80,8 +85,6 @@ async def add_to_cart(product_id: int = None, token: str = Depends(oauth2_scheme
         raise HTTPException(status_code=500, detail="Failed to add product to cart")
 
 @app.get("/check_cart")
-@api_metrics()
-@trace_function(name="check_cart", include_request=True)
 async def check_cart(product_id: int = None, token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
     user_id = verify_token(token)
     cart = await get_cart_by_user_id(db, user_id)
@@ -102,8 +105,6 @@ async def check_cart(product_id: int = None, token: str = Depends(oauth2_scheme)
 
 
 @app.get("/cart/delete")
-@api_metrics()
-@trace_function(name="delete_from_cart", include_request=True)
 async def delete_from_cart(product_id: int = None, token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
     user_id = verify_token(token)
     cart = await remove_product_from_cart(db, user_id, product_id)
@@ -116,36 +117,26 @@ async def delete_from_cart(product_id: int = None, token: str = Depends(oauth2_s
 
 
 @app.get("/cart/createorder")
-@api_metrics()
-@trace_function(name="create_order", include_request=True)
 async def create_order(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
     return await create_order_logic(token, db)
 
 
 @app.get("/cart/{user_id}")
-@api_metrics()
-@trace_function(name="get_cart", include_request=True)
 async def get_cart(user_id: int, db: AsyncSession = Depends(get_db)):
     items = await get_cart_items(db, user_id)
     return items
 
 @app.post("/cart/{user_id}", response_model=CartResponse)
-@api_metrics()
-@trace_function(name="add_to_cart_post", include_request=True)
 async def add_to_cart(user_id: int, product: CartItemBase, db: AsyncSession = Depends(get_db)):
     cart = await add_product_to_cart(db, user_id, product.product_id, product.quantity)
     return cart
 
 @app.put("/cart/{user_id}/{product_id}", response_model=CartResponse)
-@api_metrics()
-@trace_function(name="update_cart_item_quantity", include_request=True)
 async def update_cart_item_quantity(user_id: int, product_id: int, quantity: int, db: AsyncSession = Depends(get_db)):
     cart = await update_product_quantity_in_cart(db, user_id, product_id, quantity)
     return cart
 
 @app.get("/")
-@api_metrics()
-@trace_function(name="health_check", include_request=True)
 async def health_check():
     """Health check endpoint."""
     return {"status": "cart_service running"}
@@ -6,6 +6,8 @@ metrics = BaseMetrics('cart_service')
 # Export the required functions
 metrics_endpoint = metrics.metrics_endpoint
 db_metrics = metrics.db_metrics
+count_log_event = metrics.count_log_event
+observe_api_request = metrics.observe_api_request
 api_metrics = metrics.api_metrics
 
-__all__ = ['BaseMetrics', 'metrics_endpoint', 'api_metrics', 'db_metrics']
\ No newline at end of file
+__all__ = ['BaseMetrics', 'metrics_endpoint', 'api_metrics', 'db_metrics', 'count_log_event', 'observe_api_request']
\ No newline at end of file
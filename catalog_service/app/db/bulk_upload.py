@@ -0,0 +1,316 @@
+# catalog_service/app/db/bulk_upload.py
+"""
+Массовая загрузка товаров продавца из CSV или JSONL.
+
+Файл читается потоково блоками по READ_SIZE из временного файла,
+в который Starlette складывает загрузку; блоки разбираются и
+проверяются в потоке (RecordParser), проверенные строки копятся
+до CHUNK_SIZE, поэтому в памяти держится только текущая пачка. Строки пачки
+загружаются через COPY во временную таблицу и одним запросом
+переносятся в products (строки с id обновляют товары продавца,
+остальные добавляются). Изменения попадают в search_outbox той же
+транзакцией, а в индекс - пачками через search/indexer.py.
+
+Колонки: name, description, price, stock, category_id, active, id (необязательно).
+"""
+import asyncio
+import csv
+import json
+import math
+import asyncpg
+from fastapi import HTTPException, UploadFile
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from db.models import Category
+from db.cache import product_cache, bump_search_generation
+from metrics import db_metrics
+
+CHUNK_SIZE = 5000
+# Размер блока чтения загруженного файла
+READ_SIZE = 1024 * 1024
+# Сколько ошибок по строкам возвращать в ответе
+MAX_REPORTED_ERRORS = 100
+# Предел колонок integer в products
+INT4_MAX = 2 ** 31 - 1
+
+STAGING_COLUMNS = ["line_no", "product_id", "name", "description", "price", "stock", "active", "category_id"]
+
+STAGING_DDL = """
+    CREATE TEMP TABLE IF NOT EXISTS product_upload_staging (
+        line_no integer,
+        product_id integer,
+        name text,
+        description text,
+        price double precision,
+        stock integer,
+        active boolean,
+        category_id integer
+    ) ON COMMIT DROP
+"""
+
+# Обновление товаров продавца, указанных по id
+MERGE_UPDATE = """
+    WITH updated AS (
+        UPDATE products p
+        SET name = s.name, description = s.description, price = s.price,
+            stock = s.stock, active = s.active, category_id = s.category_id,
+            version = p.version + 1
+        FROM product_upload_staging s
+        WHERE s.product_id = p.id AND p.seller_id = :seller_id
+        RETURNING p.id, s.line_no
+    ), queued AS (
+        INSERT INTO search_outbox (product_id, op) SELECT id, 'index' FROM updated
+    )
+    SELECT id, line_no FROM updated
+"""
+
+# Добавление новых товаров
+MERGE_INSERT = """
+    WITH inserted AS (
+        INSERT INTO products (name, description, price, stock, active, category_id, seller_id)
+        SELECT name, description, price, stock, active, category_id, :seller_id
+        FROM product_upload_staging
+        WHERE product_id IS NULL
+        ORDER BY line_no
+        RETURNING id
+    )
+    INSERT INTO search_outbox (product_id, op) SELECT id, 'index' FROM inserted
+    RETURNING product_id
+"""
+
+TRUE_VALUES = {"1", "true", "yes", "да"}
+FALSE_VALUES = {"0", "false", "no", "нет"}
+
+
+def upload_format(upload: UploadFile) -> str:
+    filename = (upload.filename or "").lower()
+    if filename.endswith(".csv") or upload.content_type == "text/csv":
+        return "csv"
+    if filename.endswith((".jsonl", ".ndjson")) or upload.content_type in ("application/jsonl", "application/x-ndjson"):
+        return "jsonl"
+    raise HTTPException(status_code=400, detail="Supported formats: .csv, .jsonl")
+
+
+def decode_line(line: bytes, line_no: int) -> str:
+    text = line.decode("utf-8", errors="replace")
+    return text.lstrip("\ufeff") if line_no == 1 else text
+
+
+class RecordParser:
+    """
+    Разбор и проверка файла по блокам. feed() вызывается в потоке через
+    asyncio.to_thread, поэтому состояние между блоками (хвост незаконченной
+    строки, незакрытая кавычка CSV, заголовок) хранится в объекте.
+    Разбивка по b"\n" безопасна для UTF-8.
+
+    Поле CSV в кавычках может содержать перевод строки, поэтому строки
+    собираются в запись, пока число кавычек в ней нечетное
+    (экранированная кавычка "" четность не меняет).
+    """
+
+    def __init__(self, fmt: str, category_ids: set):
+        self.fmt = fmt
+        self.category_ids = category_ids
+        self.buffer = b""
+        self.line_no = 0
+        self.header = None
+        self.pending = []
+        self.start = None
+        self.quotes = 0
+
+    def feed(self, data: bytes) -> tuple:
+        """
+        Разбор очередного блока; пустой блок - конец файла.
+        Returns: (строки для COPY, [(номер строки, текст ошибки), ...])
+        """
+        rows, errors = [], []
+        if data:
+            self.buffer += data
+            *lines, self.buffer = self.buffer.split(b"\n")
+        else:
+            lines, self.buffer = ([self.buffer] if self.buffer else []), b""
+        for line in lines:
+            self.line_no += 1
+            self.add_line(self.line_no, decode_line(line, self.line_no), rows, errors)
+        if not data and self.pending:
+            # Незакрытая кавычка в конце файла - разбираем как есть
+            self.add_csv_row(self.start, next(csv.reader(["\n".join(self.pending)])), rows, errors)
+            self.pending = []
+        return rows, errors
+
+    def add_line(self, line_no: int, line: str, rows: list, errors: list):
+        if self.fmt == "csv":
+            if not self.pending:
+                self.start = line_no
+            self.pending.append(line)
+            self.quotes += line.count('"')
+            if self.quotes % 2:
+                return
+            record = "\n".join(self.pending)
+            self.pending, self.quotes = [], 0
+            if record.strip():
+                self.add_csv_row(self.start, next(csv.reader([record])), rows, errors)
+            return
+        if not line.strip():
+            return
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            errors.append((line_no, f"invalid JSON: {e}"))
+            return
+        if not isinstance(record, dict):
+            errors.append((line_no, "expected a JSON object"))
+            return
+        self.add_record(line_no, record, rows, errors)
+
+    def add_csv_row(self, line_no: int, row: list, rows: list, errors: list):
+        if self.header is None:
+            self.header = [field.strip() for field in row]
+        elif len(row) > len(self.header):
+            errors.append((line_no, "too many columns"))
+        else:
+            self.add_record(line_no, dict(zip(self.header, row)), rows, errors)
+
+    def add_record(self, line_no: int, record: dict, rows: list, errors: list):
+        try:
+            rows.append(validate_record(line_no, record, self.category_ids))
+        except ValueError as e:
+            errors.append((line_no, str(e)))
+
+
+def parse_bool(value, default: bool) -> bool:
+    if value is None or value == "":
+        return default
+    if isinstance(value, bool):
+        return value
+    value = str(value).strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise ValueError(f"active: expected a boolean, got {value!r}")
+
+
+def parse_int(record: dict, field: str, default=None, minimum: int = 0):
+    """Целое в диапазоне колонки integer PostgreSQL"""
+    value = record.get(field)
+    if value is None or value == "":
+        if default is None:
+            raise ValueError(f"{field}: expected an integer, got {value!r}")
+        return default
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field}: expected an integer, got {value!r}")
+    if not minimum <= value <= INT4_MAX:
+        raise ValueError(f"{field} must be between {minimum} and {INT4_MAX}")
+    return value
+
+
+def parse_text(record: dict, field: str):
+    value = record.get(field)
+    if value is None or value == "":
+        return None
+    value = str(value)
+    if "\x00" in value:
+        # PostgreSQL не хранит NUL в text: COPY упал бы на всей пачке
+        raise ValueError(f"{field}: NUL characters are not allowed")
+    return value
+
+
+def validate_record(line_no: int, record: dict, category_ids: set) -> tuple:
+    """Строка для COPY в порядке STAGING_COLUMNS; ValueError с описанием при ошибке"""
+    name = (parse_text(record, "name") or "").strip()
+    if not name:
+        raise ValueError("name is required")
+    description = parse_text(record, "description")
+    try:
+        price = float(record.get("price"))
+    except (TypeError, ValueError):
+        raise ValueError(f"price: expected a number, got {record.get('price')!r}")
+    if not math.isfinite(price) or price < 0:
+        raise ValueError("price must be a non-negative number")
+    stock = parse_int(record, "stock", default=0)
+    category_id = parse_int(record, "category_id", minimum=1)
+    if category_id not in category_ids:
+        raise ValueError(f"category {category_id} does not exist")
+    product_id = parse_int(record, "id", default=0, minimum=1) or None
+    active = parse_bool(record.get("active"), True)
+    return (line_no, product_id, name, description, price, stock, active, category_id)
+
+
+@db_metrics(operation="bulk_upload_chunk")
+async def merge_chunk(db: AsyncSession, rows: list, seller_id: int):
+    """COPY пачки во временную таблицу и перенос в products одной транзакцией"""
+    await db.execute(text(STAGING_DDL))
+    connection = await db.connection()
+    raw_connection = await connection.get_raw_connection()
+    await raw_connection.driver_connection.copy_records_to_table(
+        "product_upload_staging", records=rows, columns=STAGING_COLUMNS
+    )
+    updated = (await db.execute(text(MERGE_UPDATE), {"seller_id": seller_id})).all()
+    inserted = (await db.execute(text(MERGE_INSERT), {"seller_id": seller_id})).all()
+    await db.commit()
+    for product_id, _ in updated:
+        product_cache.invalidate(product_id)
+    bump_search_generation()
+    return {line_no for _, line_no in updated}, len(inserted)
+
+
+async def bulk_upload_products(db: AsyncSession, upload: UploadFile, seller_id: int):
+    """
+    Returns:
+        {"inserted": int, "updated": int, "failed": int,
+         "errors": [{"line": int, "error": str}, ...], "errors_truncated": bool}
+    """
+    fmt = upload_format(upload)
+    if not 0 < seller_id <= INT4_MAX:
+        raise HTTPException(status_code=400, detail="Invalid seller id")
+    result = await db.execute(select(Category.id))
+    category_ids = set(result.scalars().all())
+
+    summary = {"inserted": 0, "updated": 0, "failed": 0, "errors": [], "errors_truncated": False}
+
+    def add_error(line_no: int, error: str):
+        summary["failed"] += 1
+        if len(summary["errors"]) < MAX_REPORTED_ERRORS:
+            summary["errors"].append({"line": line_no, "error": error})
+        else:
+            summary["errors_truncated"] = True
+
+    async def merge(rows: list):
+        try:
+            updated_lines, inserted = await merge_chunk(db, rows, seller_id)
+        except (SQLAlchemyError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+            # Пачка откатывается целиком, предыдущие уже сохранены
+            print(f"Bulk upload chunk failed for seller {seller_id}: {e}")
+            await db.rollback()
+            for row in rows:
+                add_error(row[0], f"chunk not saved: {e}")
+            return
+        summary["inserted"] += inserted
+        summary["updated"] += len(updated_lines)
+        for row in rows:
+            if row[1] is not None and row[0] not in updated_lines:
+                add_error(row[0], f"product {row[1]} not found among seller's products")
+
+    parser = RecordParser(fmt, category_ids)
+    rows = []
+    while True:
+        data = await upload.read(READ_SIZE)
+        # Разбор и проверка - в потоке, чтобы не занимать цикл событий
+        parsed, errors = await asyncio.to_thread(parser.feed, data)
+        for line_no, error in errors:
+            add_error(line_no, error)
+        rows += parsed
+        while len(rows) >= CHUNK_SIZE:
+            await merge(rows[:CHUNK_SIZE])
+            rows = rows[CHUNK_SIZE:]
+        if not data:
+            break
+    if rows:
+        await merge(rows)
+    summary["errors"].sort(key=lambda error: error["line"])
+    return summary
@@ -0,0 +1,116 @@
+# catalog_service/app/db/cache.py
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+from metrics import count_cache
+
+
+class LRUCache:
+    """
+    LRU-кэш в памяти процесса с ограничением числа записей и временем жизни.
+    Запись, прочитанная из БД до инвалидации ключа, в кэш не попадает:
+    перед чтением берется token(), а set() сверяет его с последней инвалидацией.
+    """
+
+    def __init__(self, name: str, max_entries: int, ttl: float):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._seq = 0
+        # Номер последней инвалидации по ключу (ограничен так же, как записи)
+        self._invalidated: "OrderedDict[Hashable, int]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            count_cache(self.name, "miss")
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            count_cache(self.name, "expired")
+            count_cache(self.name, "miss")
+            return None
+        self._entries.move_to_end(key)
+        count_cache(self.name, "hit")
+        return value
+
+    def token(self) -> int:
+        return self._seq
+
+    def set(self, key: Hashable, value: Any, token: int = None):
+        if token is not None and self._invalidated.get(key, -1) > token:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            count_cache(self.name, "eviction")
+
+    def invalidate(self, key: Hashable):
+        self._seq += 1
+        self._invalidated[key] = self._seq
+        self._invalidated.move_to_end(key)
+        while len(self._invalidated) > self.max_entries:
+            self._invalidated.popitem(last=False)
+        if self._entries.pop(key, None) is not None:
+            count_cache(self.name, "invalidation")
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Кэш get_product_by_id. TTL ограничивает расхождение между экземплярами
+# сервиса: инвалидация при записи действует только в своем процессе
+product_cache = LRUCache(
+    "product",
+    max_entries=int(os.getenv("PRODUCT_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("PRODUCT_CACHE_TTL_S", "30"))
+)
+
+# Список категорий с готовым телом ответа и ETag. Категории меняются
+# только миграциями, поэтому достаточно TTL
+categories_cache = LRUCache(
+    "categories",
+    max_entries=1,
+    ttl=float(os.getenv("CATEGORIES_CACHE_TTL_S", "60"))
+)
+
+# Кэш подсказок поиска по префиксу. Короткий TTL: подсказки могут слегка
+# отставать от каталога, зато популярные префиксы не доходят до Elasticsearch
+suggest_cache = LRUCache(
+    "suggest",
+    max_entries=int(os.getenv("SUGGEST_CACHE_SIZE", "5000")),
+    ttl=float(os.getenv("SUGGEST_CACHE_TTL_S", "10"))
+)
+
+# Кэш результатов поиска. Ключ включает поколение индекса: оно растет при
+# каждой записи товаров и после переиндексации, поэтому результаты,
+# полученные до изменения, больше не находятся и вытесняются по LRU
+search_cache = LRUCache(
+    "search",
+    max_entries=int(os.getenv("SEARCH_CACHE_SIZE", "2000")),
+    ttl=float(os.getenv("SEARCH_CACHE_TTL_S", "60"))
+)
+_search_generation = 0
+
+
+def search_generation() -> int:
+    return _search_generation
+
+
+def bump_search_generation():
+    """Вызывается после записи товаров в БД и после обновления индекса"""
+    global _search_generation
+    _search_generation += 1
+    search_cache.clear()
+
+
+def search_cache_key(query: str, **params) -> tuple:
+    """Ключ кэша: нормализованный запрос, параметры и текущее поколение индекса"""
+    return (search_generation(), " ".join(query.lower().split()), tuple(sorted(params.items())))
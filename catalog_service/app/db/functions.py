@@ -1,73 +1,215 @@
 # catalog_service / app / db / functions.py
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy import tuple_, any_, bindparam, insert, update, delete, literal, and_, or_, func, Integer
+from sqlalchemy.dialects.postgresql import ARRAY
 from fastapi import HTTPException
-from db.models import Product, Category
+from db.models import Product, Category, ProductImage, Review, Question, RelatedProduct, SearchOutbox
 from db.schemas import ProductBase, Product as ProductSchema, CategorySchemas, ProductBase
 from sqlalchemy.orm import selectinload
+from db.pagination import (DEFAULT_PAGE_SIZE, LISTING_CURSOR_FIELDS, SEARCH_CURSOR_FIELDS,
+                           encode_cursor, decode_cursor)
+from db.cache import product_cache, bump_search_generation
 from metrics import db_metrics
+from search.elastic import LISTING_FIELDS
+from search.documents import product_query, product_source
 
 
-# Получение всех продуктов с пагинацией
+# Колонки товара в ответах API (поля ProductBase и версия)
+PRODUCT_COLUMNS = (Product.id, Product.name, Product.description, Product.price, Product.stock,
+                   Product.active, Product.category_id, Product.seller_id, Product.version)
+
+def product_row_dict(row):
+    """Товар из строки product_query() или RETURNING с category_name"""
+    return {**product_source(row), "version": row.version, "images": []}  # Возвращаем пустой список вместо None
+
+def product_etag(product: dict) -> str:
+    """Строгий ETag товара: меняется вместе с версией"""
+    return f'"product-{product["id"]}-v{product["version"]}"'
+
+
+def filter_products(query, category: int = None, seller: int = None, min_price: float = None,
+                    max_price: float = None, active: bool = None):
+    """Условия WHERE для фильтров каталога"""
+    if category is not None:
+        query = query.filter(Product.category_id == category)
+    if seller is not None:
+        query = query.filter(Product.seller_id == seller)
+    if min_price is not None:
+        query = query.filter(Product.price >= min_price)
+    if max_price is not None:
+        query = query.filter(Product.price <= max_price)
+    if active is not None:
+        query = query.filter(Product.active == active)
+    return query
+
+# Получение страницы продуктов: keyset-пагинация по (name, id).
+# Страница начинается сразу после ключа из курсора, поэтому любая
+# страница стоит столько же, сколько первая (индексы ix_products_*_name_id)
 @db_metrics(operation="get_all_products")
-async def get_all_products(db: AsyncSession, category: int = None, search: str = '', skip: int = 0, limit: int = 1000):
-    if category:
-        if search != '':
-            result = await db.execute(
-                select(Product).filter(Product.category_id == category).filter(
-                    Product.name.ilike(f"%{search}%")).order_by(Product.name).offset(skip).limit(limit).options(selectinload(Product.images)))
-        else:
-            result = await db.execute(
-                select(Product).filter(Product.category_id == category).order_by(Product.name).offset(skip).limit(
-                    limit).options(selectinload(Product.images)))
-    elif search != '':
-        result = await db.execute(select(Product).filter(
-            Product.name.ilike(f"%{search}%")).order_by(Product.name).offset(skip).limit(limit).options(selectinload(Product.images)))
-    else:
-        result = await db.execute(select(Product).order_by(Product.name).offset(skip).limit(limit).options(selectinload(Product.images)))
-    products = result.scalars().all()
-    products_list = [ProductBase.from_orm(product) for product in products]
+async def get_all_products(db: AsyncSession, category: int = None, search: str = '',
+                           limit: int = DEFAULT_PAGE_SIZE, cursor: str = None, seller: int = None,
+                           min_price: float = None, max_price: float = None, active: bool = None):
+    after = decode_cursor(cursor, LISTING_CURSOR_FIELDS)
+    # Только колонки ответа: без ORM-объектов и Pydantic-моделей на каждую строку
+    query = filter_products(select(*PRODUCT_COLUMNS), category, seller, min_price, max_price, active)
+    if search != '':
+        query = query.filter(Product.name.ilike(f"%{search}%"))
+    if after is not None:
+        query = query.filter(tuple_(Product.name, Product.id) > tuple_(*after))
+    # Лишняя запись показывает, есть ли следующая страница
+    result = await db.execute(query.order_by(Product.name, Product.id).limit(limit + 1))
+    products = result.mappings().all()
 
-    products_dict = [product.dict() for product in products_list]
+    page = products[:limit]
+    next_cursor = encode_cursor(page[-1]["name"], page[-1]["id"]) if len(products) > limit else None
 
-    return products_dict
+    return [dict(product) for product in page], next_cursor
 
-# Получение одного продукта
-@db_metrics(operation="get_product_by_id")
-async def get_product_by_id(db: AsyncSession, product_id: int):
-    result = await db.execute(
-        select(Product)
-        .options(selectinload(Product.category), selectinload(Product.images))
-        .filter(Product.id == product_id)
+# Порядок выдачи поиска в Postgres; как и в Elasticsearch (SEARCH_SORTS),
+# id в конце делает порядок однозначным для курсора
+def search_sort_keys(score):
+    return {
+        "relevance": [(score, "desc"), (Product.id, "asc")],
+        "price_asc": [(Product.price, "asc"), (Product.id, "asc")],
+        "price_desc": [(Product.price, "desc"), (Product.id, "asc")],
+        "name": [(Product.name, "asc"), (Product.id, "asc")],
+    }
+
+def after_key(keys, values):
+    """Условие keyset-пагинации для сортировки с разными направлениями"""
+    (column, direction), value = keys[0], values[0]
+    if len(keys) == 1:
+        return column > value if direction == "asc" else column < value
+    beyond = column > value if direction == "asc" else column < value
+    return or_(beyond, and_(column == value, after_key(keys[1:], values[1:])))
+
+# Поиск товаров в Postgres - запасной путь, когда Elasticsearch недоступен
+# или выбран CATALOG_SEARCH_BACKEND=postgres. Совпадения ищутся по триграммам
+# (GIN-индексы ix_products_*_trgm), ранжирование - по similarity.
+# Ответ и курсоры устроены так же, как в search.elastic.search_products.
+@db_metrics(operation="search_products_db")
+async def search_products_db(db: AsyncSession, query: str, size: int = 10, sort: str = "relevance",
+                             cursor: str = None, price_interval: float = 1000, **filters):
+    score = func.greatest(
+        func.similarity(Product.name, query),
+        func.similarity(func.coalesce(Product.description, ""), query)
+    )
+    keys = search_sort_keys(score)[sort]
+    after = decode_cursor(cursor, SEARCH_CURSOR_FIELDS[sort])
+    pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    matches = or_(
+        Product.name.ilike(pattern),
+        Product.description.ilike(pattern),
+        Product.name.op("%")(query)
     )
-    product = result.scalar_one_or_none()
+    # Фильтр по категории не влияет на фасет категорий, как post_filter в ES
+    category = filters.pop("category", None)
+    matched = filter_products(select(Product.id).filter(matches), **filters).subquery()
+    page_filter = Product.id.in_(select(matched.c.id))
+    if category is not None:
+        page_filter = and_(page_filter, Product.category_id == category)
+
+    page_query = select(*[getattr(Product, field) for field in LISTING_FIELDS], score.label("score")).filter(page_filter)
+    if after is not None:
+        page_query = page_query.filter(after_key(keys, after))
+    page_query = page_query.order_by(*[column.asc() if direction == "asc" else column.desc()
+                                       for column, direction in keys])
+    rows = (await db.execute(page_query.limit(size))).all()
+    total = (await db.execute(select(func.count()).select_from(Product).filter(page_filter))).scalar_one()
 
+    next_cursor = None
+    if len(rows) == size:
+        last = rows[-1]
+        sort_values = {"relevance": last.score, "price_asc": last.price, "price_desc": last.price, "name": last.name}
+        next_cursor = encode_cursor(sort_values[sort], last.id)
+
+    facets = None
+    if after is None:
+        categories = await db.execute(
+            select(Product.category_id, func.count().label("count"))
+            .filter(Product.id.in_(select(matched.c.id)))
+            .group_by(Product.category_id)
+            .order_by(func.count().desc())
+            .limit(100)
+        )
+        bucket = func.floor(Product.price / price_interval) * price_interval
+        prices = await db.execute(
+            select(bucket.label("bucket"), func.count().label("count"))
+            .filter(page_filter)
+            .group_by(bucket)
+            .order_by(bucket)
+        )
+        facets = {
+            "categories": [{"id": row.category_id, "count": row.count} for row in categories],
+            "price_histogram": [{"from": row.bucket, "to": row.bucket + price_interval, "count": row.count}
+                                for row in prices]
+        }
+    return {
+        "items": [{field: getattr(row, field) for field in LISTING_FIELDS} for row in rows],
+        "next_cursor": next_cursor,
+        "total": total,
+        "facets": facets
+    }
+
+def enqueue_search_update(db: AsyncSession, product_id: int, op: str = "index"):
+    """
+    Запись изменения товара в outbox; фиксируется вместе с изменением товара,
+    в индекс попадает через search/indexer.py
+    """
+    db.add(SearchOutbox(product_id=product_id, op=op))
+
+# Получение одного продукта: сначала из кэша, при промахе - из БД
+async def get_product_by_id(db: AsyncSession, product_id: int):
+    product = product_cache.get(product_id)
     if product is None:
+        token = product_cache.token()
+        product = await load_product_by_id(db, product_id)
+        if product is None:
+            return None
+        product_cache.set(product_id, product, token)
+    # Копия, чтобы изменения вызывающего кода не попали в кэш
+    return dict(product)
+
+@db_metrics(operation="get_product_by_id")
+async def load_product_by_id(db: AsyncSession, product_id: int):
+    result = await db.execute(product_query().where(Product.id == product_id))
+    row = result.one_or_none()
+
+    if row is None:
         return None
 
-    products_dict = {
-        "id": product.id,
-        "name": product.name,
-        "description": product.description,
-        "price": product.price,
-        "stock": product.stock,
-        "category_id": product.category_id,
-        "seller_id": product.seller_id,
-        "category": {"id": product.category.id, "name": product.category.name} if product.category else None,
-        "images": []  # Возвращаем пустой список вместо None
-    }
+    return product_row_dict(row)
 
-    return products_dict
+# Получение нескольких продуктов: найденные в кэше не запрашиваются,
+# остальные читаются одним запросом WHERE id = ANY(:ids)
+async def get_products_by_ids(db: AsyncSession, product_ids: list):
+    products = {}
+    misses = []
+    for product_id in dict.fromkeys(product_ids):
+        product = product_cache.get(product_id)
+        if product is None:
+            misses.append(product_id)
+        else:
+            products[product_id] = dict(product)
+    if misses:
+        token = product_cache.token()
+        for product in await load_products_by_ids(db, misses):
+            product_cache.set(product["id"], product, token)
+            products[product["id"]] = dict(product)
+    return products
+
+@db_metrics(operation="get_products_by_ids")
+async def load_products_by_ids(db: AsyncSession, product_ids: list):
+    result = await db.execute(
+        product_query().where(Product.id == any_(bindparam("ids", product_ids, type_=ARRAY(Integer))))
+    )
+    return [product_row_dict(row) for row in result]
 
 @db_metrics(operation="get_all_categories")
 async def get_all_categories(db: AsyncSession):
-    result = await db.execute(select(Category))
-    categories = result.scalars().all()
-
-    # Преобразуем SQLAlchemy объекты в Pydantic модели
-    categories_list = [CategorySchemas.from_orm(category) for category in categories]
-
-    categories_dict = [category.dict() for category in categories_list]
+    result = await db.execute(select(Category.id, Category.name))
+    categories_dict = [dict(category) for category in result.mappings()]
 
     return categories_dict
 
@@ -81,106 +223,201 @@ async def get_seller_by_id(db: AsyncSession, seller_id: int):
     # seller_id_dict = seller_id_list.dict()
     # return seller_id_dict
 
+# Запись товара одним запросом: изменение товара с RETURNING оформлено как CTE,
+# рядом в том же запросе пишется строка outbox, а название категории
+# присоединяется к результату. Вместе с COMMIT - два обращения к БД
+def write_with_outbox(written, op: str = "index"):
+    product = written.cte("product")
+    queued = insert(SearchOutbox).from_select(
+        ["product_id", "op"], select(product.c.id, literal(op))
+    ).cte("queued")
+    return (
+        select(product, Category.name.label("category_name"))
+        .outerjoin(Category, Category.id == product.c.category_id)
+        .add_cte(queued)
+    )
+
 # Создание нового товара
 @db_metrics(operation="create_product")
 async def create_product(db: AsyncSession, name: str, description: str, price: float, stock: int, category_id: int, seller_id: int):
     if price < 0 or stock < 0:
         raise HTTPException(status_code=400, detail="Price and stock must be non-negative.")
-    new_product = Product(
-        name=name,
-        description=description,
-        price=price,
-        stock=stock,
-        category_id=category_id,
-        seller_id=seller_id
-    )
-    db.add(new_product)
+    result = await db.execute(write_with_outbox(
+        insert(Product)
+        .values(
+            name=name,
+            description=description,
+            price=price,
+            stock=stock,
+            category_id=category_id,
+            seller_id=seller_id
+        )
+        .returning(*PRODUCT_COLUMNS)
+    ))
+    row = result.one()
     await db.commit()  # Сохраняем в базу данных
-    await db.refresh(new_product)  # Обновляем объект с последними данными из базы
-
-    # Явно загружаем связанные отношения для response_model
-    loaded_product = await db.execute(
-        select(Product)
-        .options(selectinload(Product.category), selectinload(Product.images))
-        .filter(Product.id == new_product.id)
-    )
-    return loaded_product.scalar_one_or_none()
+    bump_search_generation()
+    return product_row_dict(row)
 
 # Обновление продукта
 @db_metrics(operation="update_product")
 async def update_product(db: AsyncSession, product_id: int, name: str, description: str, price: float, stock: int):
-    # Получаем продукт по ID как SQLAlchemy-модель, с жадной загрузкой отношений
-    result = await db.execute(
-        select(Product)
-        .options(selectinload(Product.category), selectinload(Product.images))
-        .filter(Product.id == product_id)
-    )
-    product_model = result.scalar_one_or_none()
-
-    if not product_model:
-        raise HTTPException(status_code=404, detail="Product not found")
-
     # Проверка на отрицательные значения для цены и количества
     if price < 0 or stock < 0:
         raise HTTPException(status_code=400, detail="Price and stock must be non-negative.")
-    
-    # Обновление данных продукта
-    product_model.name = name
-    product_model.description = description
-    product_model.price = price
-    product_model.stock = stock
 
-    await db.commit()
-    await db.refresh(product_model)
-
-    # Преобразуем в словарь для возврата
-    product_dict = {
-        "id": product_model.id,
-        "name": product_model.name,
-        "description": product_model.description,
-        "price": product_model.price,
-        "stock": product_model.stock,
-        "category_id": product_model.category_id,
-        "seller_id": product_model.seller_id,
-        "active": product_model.active,
-        "category": {"id": product_model.category.id, "name": product_model.category.name} if product_model.category else None,
-        "images": []  # Возвращаем пустой список вместо None
-    }
+    result = await db.execute(write_with_outbox(
+        update(Product)
+        .where(Product.id == product_id)
+        .values(name=name, description=description, price=price, stock=stock,
+                version=Product.version + 1)
+        .returning(*PRODUCT_COLUMNS)
+    ))
+    row = result.one_or_none()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Product not found")
 
-    return product_dict
+    await db.commit()
+    product_cache.invalidate(product_id)
+    bump_search_generation()
+    return product_row_dict(row)
 
 
 # Удаление товара
 @db_metrics(operation="delete_product")
 async def delete_product(db: AsyncSession, product_id: int):
-    # Получаем продукт по ID как SQLAlchemy-модель, с жадной загрузкой отношений
+    # Связанные строки отвязываются в том же запросе (как при удалении через ORM),
+    # ссылки related_products удаляются; внешние ключи проверяются в конце запроса
+    detached = [
+        update(model).where(model.product_id == product_id).values(product_id=None)
+        .cte(f"detached_{model.__tablename__}")
+        for model in (ProductImage, Review, Question)
+    ]
+    unlinked = delete(RelatedProduct).where(or_(
+        RelatedProduct.product_id == product_id,
+        RelatedProduct.related_product_id == product_id
+    )).cte("unlinked")
     result = await db.execute(
-        select(Product)
-        .options(selectinload(Product.category), selectinload(Product.images))
-        .filter(Product.id == product_id)
+        write_with_outbox(
+            delete(Product).where(Product.id == product_id).returning(*PRODUCT_COLUMNS),
+            op="delete"
+        ).add_cte(*detached, unlinked)
     )
-    product_model = result.scalar_one_or_none()
-
-    if not product_model:
+    if result.one_or_none() is None:
         raise HTTPException(status_code=404, detail="Product not found")
-    
-    await db.delete(product_model)
+
     await db.commit()
+    product_cache.invalidate(product_id)
+    bump_search_generation()
 
     return product_id # Возвращаем ID удаленного товара
 
-@db_metrics(operation="decrement_stock")
+# Метрики пишет decrement_stock_batch
 async def decrement_stock(db: AsyncSession, product_id: int, quantity: int):
-    result = await db.execute(select(Product).filter(Product.id == product_id))
-    product = result.scalar_one_or_none()
-    if not product:
+    result = await decrement_stock_batch(db, [{"product_id": product_id, "quantity": quantity}])
+    item = result["items"][0]
+    if item["status"] == "not_found":
         raise HTTPException(status_code=404, detail="Product not found")
-    if product.stock < quantity:
+    if item["status"] == "insufficient_stock":
         raise HTTPException(status_code=400, detail="Not enough stock")
-    product.stock -= quantity
+    return {"success": True, "product_id": product_id, "new_stock": item["stock"]}
+
+# Списание остатков по всем позициям заказа в одной транзакции.
+# Каждая позиция - условный UPDATE ... WHERE stock >= :q RETURNING stock,
+# поэтому параллельные заказы не уводят остаток в минус и не теряют
+# обновления. Если хотя бы одна позиция не списалась, откатываются все.
+@db_metrics(operation="decrement_stock_batch")
+async def decrement_stock_batch(db: AsyncSession, items: list):
+    quantities = {}
+    for item in items:
+        if item["quantity"] <= 0:
+            raise HTTPException(status_code=400, detail="Quantity must be greater than zero.")
+        quantities[item["product_id"]] = quantities.get(item["product_id"], 0) + item["quantity"]
+
+    # Строки блокируются в порядке id, чтобы встречные заказы не взаимоблокировались
+    outcomes = {}
+    for product_id in sorted(quantities):
+        quantity = quantities[product_id]
+        result = await db.execute(
+            update(Product)
+            .where(Product.id == product_id, Product.stock >= quantity)
+            .values(stock=Product.stock - quantity, version=Product.version + 1)
+            .returning(Product.stock)
+        )
+        stock = result.scalar_one_or_none()
+        if stock is None:
+            outcomes[product_id] = {"status": "insufficient_stock", "stock": None}
+        else:
+            outcomes[product_id] = {"status": "ok", "stock": stock}
+
+    failed = [product_id for product_id, outcome in outcomes.items() if outcome["status"] != "ok"]
+    if failed:
+        await db.rollback()
+        result = await db.execute(
+            select(Product.id, Product.stock)
+            .filter(Product.id == any_(bindparam("ids", failed, type_=ARRAY(Integer))))
+        )
+        available = dict(result.all())
+        for product_id in failed:
+            if product_id in available:
+                outcomes[product_id]["stock"] = available[product_id]
+            else:
+                outcomes[product_id]["status"] = "not_found"
+        for outcome in outcomes.values():
+            if outcome["status"] == "ok":
+                outcome["status"] = "rolled_back"
+                outcome["stock"] = None
+    else:
+        for product_id in quantities:
+            enqueue_search_update(db, product_id)
+        await db.commit()
+        for product_id in quantities:
+            product_cache.invalidate(product_id)
+        bump_search_generation()
+
+    return {
+        "success": not failed,
+        "items": [{"product_id": product_id, "quantity": quantities[product_id], **outcomes[product_id]}
+                  for product_id in quantities]
+    }
+
+
+# Возврат остатков по позициям заказа, который не удалось создать после
+# decrement_stock_batch (компенсация в cart_service). Удаленные товары
+# пропускаются со статусом not_found.
+@db_metrics(operation="increment_stock_batch")
+async def increment_stock_batch(db: AsyncSession, items: list):
+    quantities = {}
+    for item in items:
+        if item["quantity"] <= 0:
+            raise HTTPException(status_code=400, detail="Quantity must be greater than zero.")
+        quantities[item["product_id"]] = quantities.get(item["product_id"], 0) + item["quantity"]
+
+    restocked = {}
+    for product_id in sorted(quantities):
+        result = await db.execute(
+            update(Product)
+            .where(Product.id == product_id)
+            .values(stock=Product.stock + quantities[product_id], version=Product.version + 1)
+            .returning(Product.stock)
+        )
+        stock = result.scalar_one_or_none()
+        if stock is not None:
+            restocked[product_id] = stock
+            enqueue_search_update(db, product_id)
     await db.commit()
-    await db.refresh(product)
-    return {"success": True, "product_id": product_id, "new_stock": product.stock}
+    for product_id in restocked:
+        product_cache.invalidate(product_id)
+    if restocked:
+        bump_search_generation()
+
+    return {
+        "success": True,
+        "items": [{"product_id": product_id, "quantity": quantities[product_id],
+                   "status": "ok" if product_id in restocked else "not_found",
+                   "stock": restocked.get(product_id)}
+                  for product_id in quantities]
+    }
 
 
 def check_seller_permission(product: dict, user_id: int):
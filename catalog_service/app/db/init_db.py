@@ -2,10 +2,31 @@
 
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy import text
 from db.database import engine, Base
 from db.models import Product, Category, ProductImage, Review, Question, RelatedProduct
 
+# Колонки, появившиеся после создания таблиц
+COLUMN_DDL = [
+    "ALTER TABLE products ADD COLUMN IF NOT EXISTS version integer NOT NULL DEFAULT 1",
+]
+
+# Индексы, появившиеся после создания таблиц
+INDEX_DDL = [
+    "CREATE INDEX IF NOT EXISTS ix_products_name_id ON products (name, id)",
+    "CREATE INDEX IF NOT EXISTS ix_products_category_name_id ON products (category_id, name, id)",
+    "CREATE INDEX IF NOT EXISTS ix_products_seller_name_id ON products (seller_id, name, id)",
+    # Триграммные индексы для поиска в Postgres (ILIKE '%...%' и оператор %);
+    # не объявлены в модели, так как требуют расширения pg_trgm
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_products_name_trgm ON products USING gin (name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_products_description_trgm ON products USING gin (description gin_trgm_ops)",
+]
+
 async def init_db():
     async with engine.begin() as conn:
         # Создание всех таблиц
-        await conn.run_sync(Base.metadata.create_all)
\ No newline at end of file
+        await conn.run_sync(Base.metadata.create_all)
+        # create_all не добавляет колонки и индексы в уже существующие таблицы
+        for statement in COLUMN_DDL + INDEX_DDL:
+            await conn.execute(text(statement))
\ No newline at end of file
@@ -1,5 +1,5 @@
 # catalog_service/app/db/models.py
-from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, Float, Boolean, ForeignKey, Index, DateTime, func
 from sqlalchemy.orm import relationship
 from db.database import Base
 
@@ -14,6 +14,8 @@ class Product(Base):
     active = Column(Boolean, default=True)  # Признак активного товара
     category_id = Column(Integer, ForeignKey("categories.id"))  # Связь с категорией товара
     seller_id = Column(Integer)  # Продавец товара
+    # Версия товара: увеличивается при каждом изменении, основа ETag
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
     # Связи
     category = relationship("Category", back_populates="products")
@@ -23,6 +25,14 @@ class Product(Base):
     questions = relationship("Question", back_populates="product")
     # related_products = relationship("Product", secondary="related_products", back_populates="related_products")
 
+    __table_args__ = (
+        # Порядок списка товаров и keyset-пагинация, в том числе внутри
+        # категории и внутри товаров продавца
+        Index("ix_products_name_id", "name", "id"),
+        Index("ix_products_category_name_id", "category_id", "name", "id"),
+        Index("ix_products_seller_name_id", "seller_id", "name", "id"),
+    )
+
 class Category(Base):
     __tablename__ = "categories"
 
@@ -84,3 +94,17 @@ class RelatedProduct(Base):
     related_product = relationship("Product", foreign_keys=[related_product_id])
 
 
+
+
+class SearchOutbox(Base):
+    """
+    Изменения товаров для поискового индекса. Строка пишется в той же
+    транзакции, что и изменение товара, и удаляется индексатором
+    после записи в Elasticsearch (search/indexer.py)
+    """
+    __tablename__ = "search_outbox"
+
+    id = Column(BigInteger, primary_key=True)
+    product_id = Column(Integer, nullable=False, index=True)
+    op = Column(String(16), nullable=False)  # index | delete
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
@@ -0,0 +1,71 @@
+# catalog_service/app/db/pagination.py
+import base64
+import json
+import math
+from typing import Any, Callable, List, Optional, Sequence
+
+# Размер страницы списка товаров по умолчанию и предельный
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# Предел колонки integer (id товара)
+INT4_MAX = 2 ** 31 - 1
+
+
+def encode_cursor(*values: Any) -> str:
+    """
+    Непрозрачный курсор: ключ сортировки последней записи страницы
+    """
+    raw = json.dumps(list(values), separators=(",", ":"), ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def cursor_id(value: Any) -> bool:
+    # bool - подкласс int, но в курсоре не встречается
+    return isinstance(value, int) and not isinstance(value, bool) and 0 <= value <= INT4_MAX
+
+
+def cursor_number(value: Any) -> bool:
+    if not isinstance(value, (int, float)) or isinstance(value, bool):
+        return False
+    try:
+        return math.isfinite(value)
+    except OverflowError:
+        return False
+
+
+def cursor_text(value: Any) -> bool:
+    # NUL не может быть в тексте PostgreSQL - запрос завершился бы ошибкой
+    return isinstance(value, str) and "\x00" not in value
+
+
+# Поля курсора для каждой сортировки поиска (SEARCH_SORTS в Elasticsearch
+# и search_sort_keys в Postgres): значение ключа и id
+SEARCH_CURSOR_FIELDS = {
+    "relevance": (cursor_number, cursor_id),
+    "price_asc": (cursor_number, cursor_id),
+    "price_desc": (cursor_number, cursor_id),
+    "name": (cursor_text, cursor_id),
+}
+
+# Курсор списка товаров: (name, id)
+LISTING_CURSOR_FIELDS = (cursor_text, cursor_id)
+
+
+def decode_cursor(cursor: Optional[str], fields: Sequence[Callable[[Any], bool]]) -> Optional[List[Any]]:
+    """
+    Разбор курсора; ValueError, если курсор поврежден, другого формата
+    или значения не подходят к сортировке (fields - проверка каждого значения).
+    Значения уходят в SQL и в search_after, поэтому проверяются до запроса.
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, UnicodeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != len(fields):
+        raise ValueError("Invalid cursor")
+    if not all(valid(value) for valid, value in zip(fields, values)):
+        raise ValueError("Invalid cursor")
+    return values
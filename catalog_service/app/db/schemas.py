@@ -45,6 +45,11 @@ class ProductBase(BaseModel):
     class Config:
         from_attributes = True
 
+# Позиция заказа для пакетного списания остатков
+class StockDecrement(BaseModel):
+    product_id: int
+    quantity: int
+
 # Схема для товара (ProductBase - для чтения/обновления - с ID)
 class Product(ProductBase):
     id: int
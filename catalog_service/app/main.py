@@ -1,23 +1,34 @@
 # catalog_service/app/main.py
 
-from fastapi import FastAPI, Depends, HTTPException, Query, Header, Response, Body, Request
+from fastapi import FastAPI, Depends, HTTPException, Query, Header, Response, Body, Request, UploadFile, File
 from sqlalchemy.ext.asyncio import AsyncSession
 from db.database import get_db
-from db.schemas import ProductBase, Product as ProductSchema, CategorySchemas, ProductCreate  # Импортируем Pydantic модель и ProductCreate
-from typing import List, AsyncGenerator
+from db.schemas import ProductBase, Product as ProductSchema, CategorySchemas, ProductCreate, StockDecrement  # Импортируем Pydantic модель и ProductCreate
+from typing import List, AsyncGenerator, Literal, Optional
 from db.functions import *
 from db.init_db import init_db
+from db.bulk_upload import bulk_upload_products
+from db.cache import product_cache, categories_cache, suggest_cache, search_cache, search_cache_key
+from db.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 from fastapi.middleware.cors import CORSMiddleware
-from logging_decorator import log_to_kafka
-from metrics import metrics_endpoint, api_metrics
+from fastapi.responses import ORJSONResponse
+from logging_decorator import start_log_pipeline, stop_log_pipeline
+from instrumentation import InstrumentationMiddleware
+from metrics import metrics_endpoint, count_search_fallback
 from config.tracing import setup_tracing
 from metrics.tracing_decorator import trace_function
-from search.elastic import create_index, index_product, delete_product_from_index, search_products
+from search.elastic import create_index, search_products, suggest_products
+from elasticsearch import ApiError, TransportError
+from search.indexer import OutboxIndexer
+from search.reindex import reindex_products, reindex_status
 
 from fastapi.security import OAuth2PasswordBearer
 import jwt
 import httpx
 import os
+import asyncio
+import hashlib
+import orjson
 from dotenv import load_dotenv
 from http import HTTPStatus
 
@@ -26,6 +37,9 @@ SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# Движок поиска товаров: elasticsearch (с переходом на Postgres при ошибках) или postgres
+SEARCH_BACKEND = os.getenv("CATALOG_SEARCH_BACKEND", "elasticsearch")
+
 def verify_token(token: str):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -38,9 +52,19 @@ def verify_token(token: str):
 
 async def lifespan(app: FastAPI) -> AsyncGenerator:
     await init_db()
+    await create_index()
+    await start_log_pipeline()
+    indexer = OutboxIndexer()
+    indexer.start()
     yield
+    await indexer.stop()
+    await stop_log_pipeline()
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
-app = FastAPI(lifespan=lifespan)
+# Единое измерение запросов: метрики, атрибуты спана и лог в Kafka.
+# Добавляется до трейсинга, чтобы выполняться внутри серверного спана.
+app.add_middleware(InstrumentationMiddleware)
 
 # Инициализация трейсинга
 tracer = setup_tracing(app)
@@ -64,61 +88,182 @@ async def metrics():
     return await metrics_endpoint()
 
 @app.get("/api/products")  # Указываем Pydantic модель для списка продуктов
-@log_to_kafka
-@api_metrics()
-@trace_function(name="read_products", include_request=True)
 async def read_products(
     searchquery: str = Query(default='', alias="search"),
     category: int = None,
     seller: int = None,
+    min_price: float = Query(default=None, ge=0),
+    max_price: float = Query(default=None, ge=0),
+    active: bool = None,
+    limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str = None,
+    sort: Literal["relevance", "price_asc", "price_desc", "name"] = "relevance",
+    price_interval: float = Query(default=1000, gt=0),
     db: AsyncSession = Depends(get_db)
 ):
-    if searchquery:  # Если пользователь вводит запрос
-        products = await search_products(searchquery)
-        if category is not None:
-            products = [p for p in products if p["category_id"] == category]
-        if seller is not None:
-            products = [p for p in products if p["seller_id"] == seller]
-        return products
-    else:
-        products = await get_all_products(db, category, "")
-        if seller is not None:
-            products = [p for p in products if p["seller_id"] == seller]
-        return products
+    """
+    Страница товаров: {"items": [...], "next_cursor": str | None}.
+    Следующая страница запрашивается с cursor=next_cursor.
+    Фильтры применяются в запросе к Postgres или Elasticsearch.
+    При поиске ответ также содержит total, а на первой странице - facets
+    (категории и гистограмма цен с шагом price_interval); sort задает порядок.
+    Без поиска товары упорядочены по названию.
+    Если Elasticsearch недоступен, поиск выполняется в Postgres с тем же форматом ответа.
+    Результаты поиска Elasticsearch кэшируются до следующего изменения товаров (search_cache).
+    """
+    filters = dict(category=category, seller=seller, min_price=min_price,
+                   max_price=max_price, active=active)
+    try:
+        if searchquery:  # Если пользователь вводит запрос
+            if SEARCH_BACKEND == "elasticsearch":
+                key = search_cache_key(searchquery, sort=sort, cursor=cursor, limit=limit,
+                                       price_interval=price_interval, **filters)
+                cached = search_cache.get(key)
+                if cached is not None:
+                    return ORJSONResponse(cached)
+                try:
+                    result = await search_products(searchquery, size=limit, sort=sort, cursor=cursor,
+                                                   price_interval=price_interval, **dict(filters))
+                    search_cache.set(key, result)
+                    return ORJSONResponse(result)
+                except (TransportError, ApiError) as e:
+                    # Поиск деградирует до более медленного, но рабочего
+                    print(f"[WARN] Elasticsearch недоступен, поиск через Postgres: {e}")
+                    count_search_fallback(type(e).__name__)
+            return ORJSONResponse(await search_products_db(db, searchquery, size=limit, sort=sort, cursor=cursor,
+                                                           price_interval=price_interval, **filters))
+        products, next_cursor = await get_all_products(db, search="", limit=limit, cursor=cursor, **filters)
+    except ValueError:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail="Invalid cursor")
+    # Строки из БД - уже готовые словари; сериализуются сразу в байты,
+    # без jsonable_encoder
+    return ORJSONResponse({"items": products, "next_cursor": next_cursor})
+
+
+@app.get("/api/products/suggest")
+async def suggest(q: str = Query(..., min_length=1, max_length=100),
+                  limit: int = Query(default=8, ge=1, le=20)):
+    """
+    Подсказки при наборе запроса: {"products": [...], "categories": [...]}.
+    Ответы по популярным префиксам берутся из кэша suggest_cache.
+    """
+    prefix = " ".join(q.lower().split())
+    if not prefix:
+        return {"products": [], "categories": []}
+    key = (prefix, limit)
+    suggestions = suggest_cache.get(key)
+    if suggestions is None:
+        try:
+            suggestions = await suggest_products(prefix, size=limit)
+        except (TransportError, ApiError) as e:
+            # Без подсказок поиск продолжает работать
+            print(f"[WARN] Подсказки недоступны: {e}")
+            return {"products": [], "categories": []}
+        suggest_cache.set(key, suggestions)
+    return suggestions
+
+
+# Категории кэшируются браузером и промежуточными кэшами; товар - с обязательной
+# перепроверкой по ETag, так как остаток меняется при каждом заказе
+CATEGORIES_CACHE_CONTROL = "public, max-age=300"
+PRODUCT_CACHE_CONTROL = "no-cache"
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Сравнение с заголовком If-None-Match (список ETag или *)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return etag in candidates or f"W/{etag}" in candidates
+
+def not_modified(etag: str, cache_control: str) -> Response:
+    return Response(status_code=HTTPStatus.NOT_MODIFIED, headers={"ETag": etag, "Cache-Control": cache_control})
 
 
 @app.get("/api/categories")
-@log_to_kafka
-@api_metrics()
-@trace_function(name="get_categories", include_request=True)
-async def get_categories(db: AsyncSession = Depends(get_db)):
-    categories = await get_all_categories(db)
-    return categories
+async def get_categories(request: Request, db: AsyncSession = Depends(get_db)):
+    entry = categories_cache.get("all")
+    if entry is None:
+        body = orjson.dumps(await get_all_categories(db))
+        entry = (f'"categories-{hashlib.sha256(body).hexdigest()[:32]}"', body)
+        categories_cache.set("all", entry)
+    etag, body = entry
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        return not_modified(etag, CATEGORIES_CACHE_CONTROL)
+    return Response(content=body, media_type="application/json",
+                    headers={"ETag": etag, "Cache-Control": CATEGORIES_CACHE_CONTROL})
 
 @app.get("/api/get_product")  # Указываем Pydantic модель для списка продуктов
-@log_to_kafka
-@api_metrics()
-@trace_function(name="get_product", include_request=True)
-async def get_product(id: int = None, db: AsyncSession = Depends(get_db)):
+async def get_product(request: Request, id: int = None, db: AsyncSession = Depends(get_db)):
+    """
+    Товар с ETag по его версии. Если версия из If-None-Match совпадает
+    с товаром в кэше, ответ 304 отдается без обращения к БД.
+    """
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match:
+        cached = product_cache.get(id)
+        if cached is not None and etag_matches(if_none_match, product_etag(cached)):
+            return not_modified(product_etag(cached), PRODUCT_CACHE_CONTROL)
     product = await get_product_by_id(db, id)
     if product is None:
         raise HTTPException(status_code=404, detail="Product not found")
-    return product
+    etag = product_etag(product)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag, PRODUCT_CACHE_CONTROL)
+    return ORJSONResponse(product, headers={"ETag": etag, "Cache-Control": PRODUCT_CACHE_CONTROL})
+
+
+# Поля товара, которые можно запросить в /api/products/batch
+PRODUCT_FIELDS = {"id", "name", "description", "price", "stock", "active", "category_id", "seller_id", "version", "category", "images"}
+MAX_BATCH_IDS = 200
+
+async def products_batch(ids: List[int], fields: Optional[List[str]], db: AsyncSession):
+    if len(ids) > MAX_BATCH_IDS:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail=f"At most {MAX_BATCH_IDS} ids per request")
+    if fields:
+        unknown = set(fields) - PRODUCT_FIELDS
+        if unknown:
+            raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    products = await get_products_by_ids(db, ids)
+    if fields:
+        products = {product_id: {field: product[field] for field in fields}
+                    for product_id, product in products.items()}
+    return {
+        "products": products,
+        "missing": [product_id for product_id in dict.fromkeys(ids) if product_id not in products]
+    }
+
+@app.get("/api/products/batch")
+async def get_products_batch(ids: str, fields: str = None, db: AsyncSession = Depends(get_db)):
+    """
+    Несколько товаров за один запрос: ?ids=1,2,3&fields=name,price.
+    Ответ: {"products": {id: товар}, "missing": [id, ...]}
+    """
+    try:
+        product_ids = [int(product_id) for product_id in ids.split(",") if product_id.strip()]
+    except ValueError:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail="ids must be comma-separated integers")
+    field_list = [field.strip() for field in fields.split(",") if field.strip()] if fields else None
+    return ORJSONResponse(await products_batch(product_ids, field_list, db))
+
+@app.post("/api/products/batch")
+async def post_products_batch(
+    ids: List[int] = Body(...),
+    fields: Optional[List[str]] = Body(default=None),
+    db: AsyncSession = Depends(get_db)
+):
+    """То же, что GET, для длинных списков: {"ids": [...], "fields": [...]}"""
+    return ORJSONResponse(await products_batch(ids, fields, db))
 
 
 @app.get("/api/get_seller")  # Указываем Pydantic модель для списка продуктов
-@log_to_kafka
-@api_metrics()
-@trace_function(name="get_seller", include_request=True)
 async def get_seller(id: int = None, db: AsyncSession = Depends(get_db)):
     seller = await get_seller_by_id(db, id)
     return seller
 
 
 @app.get("/products/{product_id}", response_model=ProductSchema)  # Указываем Pydantic модель для одного товара
-@log_to_kafka
-@api_metrics()
-@trace_function(name="read_product", include_request=True)
 async def read_product(product_id: int, db: AsyncSession = Depends(get_db)):
     product = await get_product_by_id(db, product_id)
     if not product:
@@ -126,9 +271,6 @@ async def read_product(product_id: int, db: AsyncSession = Depends(get_db)):
     return product
 
 @app.post("/products", response_model=ProductSchema)
-@log_to_kafka
-@api_metrics()
-@trace_function(name="create_new_product", include_request=True)
 async def create_new_product(product: ProductCreate, db: AsyncSession = Depends(get_db)):
     # Извлекаем параметры из объекта ProductCreate
     new_product = await create_product(
@@ -140,17 +282,25 @@ async def create_new_product(product: ProductCreate, db: AsyncSession = Depends(
         category_id=product.category_id,
         seller_id=product.seller_id
     )
-    # Преобразуем SQLAlchemy-модель в Pydantic-схему, затем в словарь для индексации
-    product_for_indexing = ProductSchema.from_orm(new_product).dict()
-    await index_product(product_for_indexing) # Индексируем в Elasticsearch
+    # В поисковый индекс товар попадает через outbox (search/indexer.py)
     return new_product
 
 
+@app.post("/api/products/bulk_upload")
+async def bulk_upload(
+    file: UploadFile = File(...),
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Массовая загрузка товаров продавца из CSV или JSONL (см. db/bulk_upload.py).
+    Ответ - сводка: сколько добавлено и обновлено, ошибки по номерам строк.
+    """
+    seller_id = verify_token(token)
+    return await bulk_upload_products(db, file, seller_id)
+
 
 @app.put("/edit_product/{product_id}", response_model=ProductSchema)
-@log_to_kafka
-@api_metrics()
-@trace_function(name="update_existing_product", include_request=True)
 async def update_existing_product(
     product_id: int, product: ProductBase, token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)
 ):
@@ -169,14 +319,10 @@ async def update_existing_product(
     )
     if not updated_product:
         raise HTTPException(status_code=404, detail="Product not found")
-    await index_product(updated_product)  # Переиндексируем
     return updated_product
 
 
 @app.delete("/products/{product_id}")  # Указываем Pydantic модель для ответа
-@log_to_kafka
-@api_metrics()
-@trace_function(name="delete_existing_product", include_request=True)
 async def delete_existing_product(product_id: int, token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
     user_id = verify_token(token)
     existing_product = await get_product_by_id(db, product_id)
@@ -189,9 +335,6 @@ async def delete_existing_product(product_id: int, token: str = Depends(oauth2_s
     return {"message": f"Product with ID {deleted_product_id} deleted successfully"}
 
 @app.post("/api/products/decrement_stock")
-@log_to_kafka
-@api_metrics()
-@trace_function(name="decrement_stock", include_request=True)
 async def decrement_stock_endpoint(
     product_id: int = Body(...),
     quantity: int = Body(...),
@@ -199,13 +342,30 @@ async def decrement_stock_endpoint(
 ):
     return await decrement_stock(db, product_id, quantity)
 
-@app.post("/admin_delete_product")
-@log_to_kafka
-@api_metrics()
-@trace_function(name="admin_delete_product", include_request=True)
-async def admin_delete_product(request: Request, db: AsyncSession = Depends(get_db)):
-    data = await request.json()
-    product_id = data.get("id")
+@app.post("/api/products/decrement_stock_batch")
+async def decrement_stock_batch_endpoint(
+    items: List[StockDecrement] = Body(..., embed=True),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Списание остатков по всем позициям заказа: всё или ничего.
+    Ответ содержит итог по каждой позиции: ok, insufficient_stock,
+    not_found или rolled_back (списание отменено из-за другой позиции).
+    """
+    result = await decrement_stock_batch(db, [item.dict() for item in items])
+    if not result["success"]:
+        raise HTTPException(status_code=HTTPStatus.CONFLICT, detail=result)
+    return result
+
+@app.post("/api/products/increment_stock_batch")
+async def increment_stock_batch_endpoint(
+    items: List[StockDecrement] = Body(..., embed=True),
+    db: AsyncSession = Depends(get_db)
+):
+    """Возврат остатков по позициям заказа, который не удалось создать после списания"""
+    return await increment_stock_batch(db, [item.dict() for item in items])
+
+def require_admin(request: Request):
     token = request.headers.get("Authorization")
     if not token or not token.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Missing or invalid token")
@@ -216,5 +376,27 @@ async def admin_delete_product(request: Request, db: AsyncSession = Depends(get_
     except Exception:
         raise HTTPException(status_code=401, detail="Invalid token")
     if role not in ("admin", "RoleEnum.admin"):
-        raise HTTPException(status_code=403, detail="Only admin can delete products")
+        raise HTTPException(status_code=403, detail="Only admin can perform this action")
+
+@app.post("/admin_delete_product")
+async def admin_delete_product(request: Request, db: AsyncSession = Depends(get_db)):
+    data = await request.json()
+    product_id = data.get("id")
+    require_admin(request)
     return await admin_delete_product_logic(db, product_id)
+
+@app.post("/admin/reindex", status_code=HTTPStatus.ACCEPTED)
+async def start_reindex(request: Request, batch_size: int = Query(default=2000, ge=100, le=10000)):
+    """Запуск полной переиндексации товаров в фоне; статус - GET /admin/reindex"""
+    require_admin(request)
+    if reindex_status.get("state") == "running":
+        raise HTTPException(status_code=HTTPStatus.CONFLICT, detail="Reindex is already running")
+    app.state.reindex_task = asyncio.create_task(reindex_products(batch_size))
+    # Статус running выставляется при старте задачи
+    await asyncio.sleep(0)
+    return dict(reindex_status)
+
+@app.get("/admin/reindex")
+async def get_reindex_status(request: Request):
+    require_admin(request)
+    return dict(reindex_status)
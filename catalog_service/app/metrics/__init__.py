@@ -6,6 +6,13 @@ metrics = BaseMetrics('catalog_service')
 # Export the required functions
 metrics_endpoint = metrics.metrics_endpoint
 db_metrics = metrics.db_metrics
+count_log_event = metrics.count_log_event
+observe_api_request = metrics.observe_api_request
 api_metrics = metrics.api_metrics
+set_outbox_lag = metrics.set_outbox_lag
+count_search_indexed = metrics.count_search_indexed
+count_cache = metrics.count_cache
+count_search_fallback = metrics.count_search_fallback
 
-__all__ = ['BaseMetrics', 'metrics_endpoint', 'api_metrics', 'db_metrics'] 
\ No newline at end of file
+__all__ = ['BaseMetrics', 'metrics_endpoint', 'api_metrics', 'db_metrics', 'count_log_event', 'observe_api_request',
+           'set_outbox_lag', 'count_search_indexed', 'count_cache', 'count_search_fallback'] 
\ No newline at end of file
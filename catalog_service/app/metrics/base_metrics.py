@@ -1,4 +1,4 @@
-from prometheus_client import Counter, Histogram, generate_latest
+from prometheus_client import Counter, Gauge, Histogram, generate_latest
 from fastapi import Response
 from typing import Dict, Any
 import time
@@ -40,6 +40,63 @@ class BaseMetrics:
             ['service', 'operation']
         )
 
+        # Метрики конвейера логов в Kafka
+        self.metrics['log_enqueued'] = Counter(
+            'log_events_enqueued_total',
+            'Total number of log events put into the in-process queue',
+            ['service', 'topic']
+        )
+
+        self.metrics['log_dropped'] = Counter(
+            'log_events_dropped_total',
+            'Total number of log events dropped on queue overflow',
+            ['service', 'topic']
+        )
+
+        self.metrics['log_spooled'] = Counter(
+            'log_events_spooled_total',
+            'Total number of log events written to the disk spool',
+            ['service', 'topic']
+        )
+
+        self.metrics['log_replayed'] = Counter(
+            'log_events_replayed_total',
+            'Total number of spooled log events replayed to Kafka',
+            ['service', 'topic']
+        )
+
+        # Метрики фоновой индексации товаров (outbox)
+        self.metrics['outbox_pending'] = Gauge(
+            'search_outbox_pending',
+            'Number of product changes waiting to be indexed',
+            ['service']
+        )
+
+        self.metrics['outbox_lag'] = Gauge(
+            'search_outbox_lag_seconds',
+            'Age of the oldest product change waiting to be indexed',
+            ['service']
+        )
+
+        self.metrics['search_indexed'] = Counter(
+            'search_indexed_total',
+            'Total number of product index operations sent to Elasticsearch',
+            ['service', 'op', 'status']
+        )
+
+        self.metrics['search_fallback'] = Counter(
+            'search_fallback_total',
+            'Searches served by Postgres because Elasticsearch failed',
+            ['service', 'reason']
+        )
+
+        # Метрики кэшей в памяти процесса
+        self.metrics['cache_operations'] = Counter(
+            'cache_operations_total',
+            'In-process cache lookups and evictions by result',
+            ['service', 'cache', 'result']
+        )
+
     def api_metrics(self):
         """Декоратор для автоматического сбора метрик API"""
         def decorator(func):
@@ -54,22 +111,26 @@ class BaseMetrics:
                     raise e
                 finally:
                     duration = time.time() - start_time
-                    self.metrics['api_requests'].labels(
-                        service=self.service_name,
-                        endpoint=func.__name__,
-                        method='GET',  # TODO: сделать динамическим
-                        status=status
-                    ).inc()
-                    
-                    self.metrics['api_duration'].labels(
-                        service=self.service_name,
-                        endpoint=func.__name__,
-                        method='GET'  # TODO: сделать динамическим
-                    ).observe(duration)
+                    self.observe_api_request(func.__name__, 'GET', status, duration)
                 return response
             return wrapper
         return decorator
 
+    def observe_api_request(self, endpoint: str, method: str, status: str, duration: float):
+        """Учёт одного API-запроса (используется декоратором и middleware)"""
+        self.metrics['api_requests'].labels(
+            service=self.service_name,
+            endpoint=endpoint,
+            method=method,
+            status=status
+        ).inc()
+
+        self.metrics['api_duration'].labels(
+            service=self.service_name,
+            endpoint=endpoint,
+            method=method
+        ).observe(duration)
+
     def db_metrics(self, operation: str):
         """Декоратор для автоматического сбора метрик БД"""
         def decorator(func):
@@ -98,6 +159,42 @@ class BaseMetrics:
             return wrapper
         return decorator
 
+    def count_log_event(self, event: str, topic: str):
+        """Учёт событий конвейера логов: enqueued, dropped, spooled, replayed"""
+        self.metrics[f'log_{event}'].labels(
+            service=self.service_name,
+            topic=topic
+        ).inc()
+
+    def set_outbox_lag(self, pending: int, lag_seconds: float):
+        """Отставание индексации: число изменений в outbox и возраст старейшего"""
+        self.metrics['outbox_pending'].labels(service=self.service_name).set(pending)
+        self.metrics['outbox_lag'].labels(service=self.service_name).set(lag_seconds)
+
+    def count_search_indexed(self, op: str, status: str, count: int = 1):
+        """Учёт операций index/delete, отправленных в Elasticsearch"""
+        if count:
+            self.metrics['search_indexed'].labels(
+                service=self.service_name,
+                op=op,
+                status=status
+            ).inc(count)
+
+    def count_search_fallback(self, reason: str):
+        """Учёт поисковых запросов, выполненных в Postgres из-за ошибки Elasticsearch"""
+        self.metrics['search_fallback'].labels(
+            service=self.service_name,
+            reason=reason
+        ).inc()
+
+    def count_cache(self, cache: str, result: str):
+        """Учёт операций кэша: hit, miss, expired, eviction, invalidation"""
+        self.metrics['cache_operations'].labels(
+            service=self.service_name,
+            cache=cache,
+            result=result
+        ).inc()
+
     async def metrics_endpoint(self):
         """Эндпоинт для Prometheus"""
         return Response(generate_latest(), media_type='text/plain') 
\ No newline at end of file
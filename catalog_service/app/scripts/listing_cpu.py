@@ -0,0 +1,96 @@
+"""
+Процессорное время на страницу списка товаров: прежний путь
+(ORM-объекты с selectinload(images), ProductBase.from_orm().dict(),
+jsonable_encoder и json.dumps, как в JSONResponse) и выборка колонок
+из get_all_products с сериализацией через orjson.
+
+Если товаров меньше --rows, недостающие создаются во временной
+категории и удаляются в конце.
+
+    python -m scripts.listing_cpu --rows 1000 --iterations 50
+"""
+import argparse
+import asyncio
+import json
+import time
+import orjson
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import delete, func
+from sqlalchemy.future import select
+from sqlalchemy.orm import selectinload
+from db.database import async_session, engine
+from db.functions import get_all_products
+from db.init_db import init_db
+from db.models import Product, Category
+from db.schemas import ProductBase
+
+
+async def legacy_page(db, limit: int) -> bytes:
+    result = await db.execute(
+        select(Product).options(selectinload(Product.images)).order_by(Product.name, Product.id).limit(limit + 1)
+    )
+    products = result.scalars().all()[:limit]
+    content = {"items": [ProductBase.from_orm(product).dict() for product in products], "next_cursor": None}
+    return json.dumps(jsonable_encoder(content), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+async def projected_page(db, limit: int) -> bytes:
+    products, next_cursor = await get_all_products(db, limit=limit)
+    return orjson.dumps({"items": products, "next_cursor": next_cursor})
+
+
+async def measure(page, limit: int, iterations: int) -> dict:
+    cpu = wall = 0.0
+    for _ in range(iterations):
+        async with async_session() as db:
+            cpu_start, wall_start = time.process_time(), time.perf_counter()
+            await page(db, limit)
+            cpu += time.process_time() - cpu_start
+            wall += time.perf_counter() - wall_start
+    return {"cpu_ms": cpu / iterations * 1000, "wall_ms": wall / iterations * 1000}
+
+
+async def run(rows: int, iterations: int):
+    await init_db()
+    category_id = None
+    async with async_session() as db:
+        existing = (await db.execute(select(func.count()).select_from(Product))).scalar_one()
+        if existing < rows:
+            category = Category(name="listing-cpu benchmark")
+            db.add(category)
+            await db.flush()
+            category_id = category.id
+            db.add_all(Product(name=f"benchmark {i:06d}", description="benchmark", price=float(i),
+                               stock=1, active=True, category_id=category_id, seller_id=0)
+                       for i in range(rows - existing))
+            await db.commit()
+    try:
+        # Прогрев: пул соединений и кэш подготовленных запросов
+        await measure(legacy_page, rows, 2)
+        await measure(projected_page, rows, 2)
+        before = await measure(legacy_page, rows, iterations)
+        after = await measure(projected_page, rows, iterations)
+    finally:
+        if category_id is not None:
+            async with async_session() as db:
+                await db.execute(delete(Product).where(Product.category_id == category_id))
+                await db.execute(delete(Category).where(Category.id == category_id))
+                await db.commit()
+        await engine.dispose()
+
+    print(f"{'variant':<10}{'cpu ms':>10}{'wall ms':>10}")
+    for variant, stats in (("before", before), ("after", after)):
+        print(f"{variant:<10}{stats['cpu_ms']:>10.2f}{stats['wall_ms']:>10.2f}")
+    print(f"CPU reduction: {before['cpu_ms'] / after['cpu_ms']:.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU per catalog listing page")
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(run(args.rows, args.iterations))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Сравнение операций записи товара: прежний путь через ORM
+(flush/commit/refresh и жадные загрузки) и запросы с RETURNING
+из db/functions.py.
+
+Для каждой операции считаются обращения к БД - SQL-запросы, BEGIN и
+COMMIT - и среднее время. Товары создаются в отдельной категории,
+которая удаляется в конце вместе со строками outbox.
+
+    python -m scripts.write_roundtrips --iterations 200
+"""
+import argparse
+import asyncio
+import time
+from collections import defaultdict
+from sqlalchemy import event, delete
+from sqlalchemy.future import select
+from sqlalchemy.orm import selectinload
+from db.database import async_session, engine
+from db.functions import create_product, update_product, delete_product
+from db.init_db import init_db
+from db.models import Product, Category, SearchOutbox
+
+SELLER_ID = 0
+
+
+class RoundTripCounter:
+    """Счетчик обращений к БД через события движка"""
+
+    def __init__(self):
+        self.count = 0
+        sync_engine = engine.sync_engine
+        event.listen(sync_engine, "before_cursor_execute", self._on_statement)
+        event.listen(sync_engine, "begin", self._on_transaction)
+        event.listen(sync_engine, "commit", self._on_transaction)
+        event.listen(sync_engine, "rollback", self._on_transaction)
+
+    def _on_statement(self, *args):
+        self.count += 1
+
+    def _on_transaction(self, *args):
+        self.count += 1
+
+
+# Прежние реализации, до перехода на RETURNING
+async def legacy_create(db, name, category_id):
+    product = Product(name=name, description="benchmark", price=100.0, stock=10,
+                      category_id=category_id, seller_id=SELLER_ID)
+    db.add(product)
+    await db.flush()
+    db.add(SearchOutbox(product_id=product.id, op="index"))
+    await db.commit()
+    await db.refresh(product)
+    result = await db.execute(
+        select(Product)
+        .options(selectinload(Product.category), selectinload(Product.images))
+        .filter(Product.id == product.id)
+    )
+    return result.scalar_one().id
+
+
+async def legacy_update(db, product_id):
+    result = await db.execute(
+        select(Product)
+        .options(selectinload(Product.category), selectinload(Product.images))
+        .filter(Product.id == product_id)
+    )
+    product = result.scalar_one()
+    product.price += 1
+    db.add(SearchOutbox(product_id=product_id, op="index"))
+    await db.commit()
+    await db.refresh(product)
+
+
+async def legacy_delete(db, product_id):
+    # reviews и questions тоже загружаются: иначе ORM пытается
+    # подгрузить их лениво при удалении, что в async-сессии невозможно
+    result = await db.execute(
+        select(Product)
+        .options(selectinload(Product.category), selectinload(Product.images),
+                 selectinload(Product.reviews), selectinload(Product.questions))
+        .filter(Product.id == product_id)
+    )
+    await db.delete(result.scalar_one())
+    db.add(SearchOutbox(product_id=product_id, op="delete"))
+    await db.commit()
+
+
+async def new_create(db, name, category_id):
+    product = await create_product(db, name=name, description="benchmark", price=100.0, stock=10,
+                                   category_id=category_id, seller_id=SELLER_ID)
+    return product["id"]
+
+
+async def new_update(db, product_id):
+    await update_product(db, product_id, name=f"benchmark {product_id}", description="benchmark",
+                         price=101.0, stock=10)
+
+
+async def new_delete(db, product_id):
+    await delete_product(db, product_id)
+
+
+async def measure(counter, results, key, operation):
+    # Каждая операция в своей сессии, как запрос к API
+    async with async_session() as db:
+        before = counter.count
+        start = time.perf_counter()
+        value = await operation(db)
+        results[key]["seconds"] += time.perf_counter() - start
+        results[key]["round_trips"] += counter.count - before
+        results[key]["calls"] += 1
+        return value
+
+
+async def run(iterations: int):
+    await init_db()
+    counter = RoundTripCounter()
+    results = defaultdict(lambda: {"calls": 0, "round_trips": 0, "seconds": 0.0})
+    product_ids = []
+
+    async with async_session() as db:
+        category = Category(name="write-roundtrips benchmark")
+        db.add(category)
+        await db.commit()
+        category_id = category.id
+
+    try:
+        for variant, (create, update, remove) in {
+            "before": (legacy_create, legacy_update, legacy_delete),
+            "after": (new_create, new_update, new_delete),
+        }.items():
+            for i in range(iterations):
+                product_id = await measure(counter, results, (variant, "create"),
+                                           lambda db: create(db, f"benchmark {i}", category_id))
+                product_ids.append(product_id)
+                await measure(counter, results, (variant, "update"), lambda db: update(db, product_id))
+                await measure(counter, results, (variant, "delete"), lambda db: remove(db, product_id))
+    finally:
+        async with async_session() as db:
+            await db.execute(delete(Product).where(Product.category_id == category_id))
+            # Удаленных товаров нет и в индексе - строки outbox не нужны
+            await db.execute(delete(SearchOutbox).where(SearchOutbox.product_id.in_(product_ids)))
+            await db.execute(delete(Category).where(Category.id == category_id))
+            await db.commit()
+        await engine.dispose()
+
+    print(f"{'operation':<10}{'variant':<10}{'round trips':>14}{'avg ms':>10}")
+    for operation in ("create", "update", "delete"):
+        for variant in ("before", "after"):
+            stats = results[(variant, operation)]
+            print(f"{operation:<10}{variant:<10}"
+                  f"{stats['round_trips'] / stats['calls']:>14.1f}"
+                  f"{stats['seconds'] / stats['calls'] * 1000:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Round trips per catalog write operation")
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(run(args.iterations))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+# catalog_service/app/search/documents.py
+from sqlalchemy.future import select
+from db.models import Product, Category
+
+
+def product_query():
+    """Колонки товара для поискового документа, с названием категории"""
+    return (
+        select(
+            Product.id, Product.name, Product.description, Product.price, Product.stock,
+            Product.active, Product.category_id, Product.seller_id, Product.version,
+            Category.name.label("category_name")
+        )
+        .outerjoin(Category, Product.category_id == Category.id)
+    )
+
+
+def product_source(row) -> dict:
+    """Документ товара для индекса products_catalog"""
+    return {
+        "id": row.id,
+        "name": row.name,
+        "description": row.description,
+        "price": row.price,
+        "stock": row.stock,
+        "active": row.active,
+        "category_id": row.category_id,
+        "seller_id": row.seller_id,
+        "category": {"id": row.category_id, "name": row.category_name} if row.category_id else None
+    }
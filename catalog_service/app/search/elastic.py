@@ -1,8 +1,9 @@
 # catalog_service/app/search/elastic.py
 
+from datetime import datetime
 from elasticsearch import AsyncElasticsearch, NotFoundError
-from elasticsearch.helpers import async_bulk
 from elasticsearch import ConnectionError
+from db.pagination import encode_cursor, decode_cursor, SEARCH_CURSOR_FIELDS
 
 
 ELASTICSEARCH_URL = "http://elasticsearch_engine:9200"
@@ -21,7 +22,125 @@ es = AsyncElasticsearch(
 )
 
 
+# Самый длинный индексируемый префикс слова в name.prefix
+PREFIX_MAX_GRAM = 20
+
+# Настройки и маппинг индекса товаров. INDEX_NAME - алиас, который
+# указывает на текущий версионный индекс products_catalog_<время>;
+# изменения маппинга применяются через reindex_products
+INDEX_CONFIG = {
+    "settings": {
+        "analysis": {
+            "filter": {
+                "autocomplete_filter": {
+                    "type": "edge_ngram",
+                    "min_gram": 2,
+                    "max_gram": 20
+                },
+                "russian_stop": {
+                    "type": "stop",
+                    "stopwords": "_russian_"
+                },
+                "russian_stemmer": {
+                    "type": "stemmer",
+                    "language": "russian"
+                },
+                # Префиксы для подсказок: без стемминга, иначе законченное
+                # слово ("кружки") не совпадает ни с одной n-граммой основы
+                "prefix_filter": {
+                    "type": "edge_ngram",
+                    "min_gram": 1,
+                    "max_gram": PREFIX_MAX_GRAM
+                },
+                "prefix_truncate": {
+                    "type": "truncate",
+                    "length": PREFIX_MAX_GRAM
+                }
+                # "synonym_filter": {
+                #     "type": "synonym",
+                #     "synonyms_path": "synonyms.txt",
+                # }
+            },
+            "analyzer": {
+                "autocomplete": {
+                    "type": "custom",
+                    "tokenizer": "standard",
+                    "filter": [
+                        "lowercase",
+                        "russian_stop",
+                        "russian_stemmer",
+                        #"synonym_filter",
+                        "autocomplete_filter"
+                    ]
+                },
+                "prefix_index": {
+                    "type": "custom",
+                    "tokenizer": "standard",
+                    "filter": ["lowercase", "prefix_filter"]
+                },
+                # Слово длиннее PREFIX_MAX_GRAM ищется по первым PREFIX_MAX_GRAM символам
+                "prefix_search": {
+                    "type": "custom",
+                    "tokenizer": "standard",
+                    "filter": ["lowercase", "prefix_truncate"]
+                }
+            }
+        }
+    },
+    "mappings": {
+        "properties": {
+            "id": {"type": "integer"},
+            "name": {
+                "type": "text",
+                "analyzer": "autocomplete",
+                "fields": {
+                    # Для сортировки по названию
+                    "raw": {"type": "keyword"},
+                    # Для подсказок при наборе (suggest_products)
+                    "prefix": {"type": "text", "analyzer": "prefix_index", "search_analyzer": "prefix_search"}
+                }
+            },
+            "description": {
+                "type": "text",
+                "analyzer": "autocomplete",
+                "search_analyzer": "standard"
+            },
+            "price": {"type": "float"},
+            "quantity": {"type": "integer"},
+            "available": {"type": "boolean"},
+            "category_id": {"type": "integer"},
+            "seller_id": {"type": "integer"},
+            "active": {"type": "boolean"},
+            "brand_id": {"type": "integer"}
+        }
+    }
+}
+
+
+# Алиас индекса, который строит reindex_products. Пока он существует,
+# индексатор outbox пишет изменения и в него, с внешними версиями
+# (Product.version), чтобы старое состояние не перезаписало новое
+BUILD_ALIAS = f"{INDEX_NAME}-building"
+
+# Версия удаления: больше любой версии товара, поэтому запоздавшая запись
+# удаленного товара из снимка отклоняется (id товаров не переиспользуются)
+DELETED_VERSION = 2 ** 62
+
+
+def versioned_index_name() -> str:
+    return f"{INDEX_NAME}_{datetime.utcnow():%Y%m%d%H%M%S}"
+
+
+async def building_indices() -> list:
+    """Индексы, которые сейчас строит переиндексация"""
+    try:
+        return list(await es.indices.get_alias(name=BUILD_ALIAS))
+    except NotFoundError:
+        return []
+
+
 async def create_index():
+    """Создание первого версионного индекса с алиасом INDEX_NAME, если его нет"""
     try:
         print(f"Проверка доступности Elasticsearch по адресу: {ELASTICSEARCH_URL}")
         exists = await es.indices.exists(index=INDEX_NAME)
@@ -34,101 +153,158 @@ async def create_index():
         return
 
     if not exists:
-        print(f"Создание индекса {INDEX_NAME}")
-
-        index_config = {
-            "settings": {
-                "analysis": {
-                    "filter": {
-                        "autocomplete_filter": {
-                            "type": "edge_ngram",
-                            "min_gram": 2,
-                            "max_gram": 20
-                        },
-                        "russian_stop": {
-                            "type": "stop",
-                            "stopwords": "_russian_"
-                        },
-                        "russian_stemmer": {
-                            "type": "stemmer",
-                            "language": "russian"
-                        }
-                        # "synonym_filter": {
-                        #     "type": "synonym",
-                        #     "synonyms_path": "synonyms.txt",
-                        # }
-                    },
-                    "analyzer": {
-                        "autocomplete": {
-                            "type": "custom",
-                            "tokenizer": "standard",
-                            "filter": [
-                                "lowercase",
-                                "russian_stop",
-                                "russian_stemmer",
-                                #"synonym_filter",
-                                "autocomplete_filter"
-                            ]
-                        }
-                    }
-                }
-            },
-            "mappings": {
-                "properties": {
-                    "name": {
-                        "type": "text",
-                        "analyzer": "autocomplete",
-                    },
-                    "description": {
-                        "type": "text",
-                        "analyzer": "autocomplete",
-                        "search_analyzer": "standard"
-                    },
-                    "price": {"type": "float"},
-                    "quantity": {"type": "integer"},
-                    "available": {"type": "boolean"},
-                    "category_id": {"type": "integer"},
-                    "brand_id": {"type": "integer"}
-                }
-            }
-        }
-
+        index_name = versioned_index_name()
+        print(f"Создание индекса {index_name} с алиасом {INDEX_NAME}")
         await es.indices.create(
-            index=INDEX_NAME,
-            body=index_config
+            index=index_name,
+            body={**INDEX_CONFIG, "aliases": {INDEX_NAME: {}}}
         )
 
 
+def filter_clauses(category: int = None, seller: int = None, min_price: float = None,
+                   max_price: float = None, active: bool = None) -> list:
+    """Фильтры каталога как bool.filter: не влияют на релевантность и кэшируются"""
+    clauses = []
+    if category is not None:
+        clauses.append({"term": {"category_id": category}})
+    if seller is not None:
+        clauses.append({"term": {"seller_id": seller}})
+    price_range = {}
+    if min_price is not None:
+        price_range["gte"] = min_price
+    if max_price is not None:
+        price_range["lte"] = max_price
+    if price_range:
+        clauses.append({"range": {"price": price_range}})
+    if active is not None:
+        clauses.append({"term": {"active": active}})
+    return clauses
 
-async def index_product(product: dict):
-    """Добавляет или обновляет продукт в Elasticsearch"""
-    print(f"Индексируем продукт в Elastic: {product}")
-    await es.index(index=INDEX_NAME, id=product["id"], document=product)
 
+# Поля товара, нужные списку на главной странице
+LISTING_FIELDS = ["id", "name", "price", "stock", "active", "category_id", "seller_id"]
 
-async def delete_product_from_index(product_id: int):
-    """Удаляет продукт из Elasticsearch"""
-    try:
-        await es.delete(index=INDEX_NAME, id=product_id)
-    except NotFoundError:
-        pass
+# Варианты сортировки; id в конце делает порядок однозначным для search_after
+SEARCH_SORTS = {
+    "relevance": [{"_score": "desc"}, {"id": "asc"}],
+    "price_asc": [{"price": "asc"}, {"id": "asc"}],
+    "price_desc": [{"price": "desc"}, {"id": "asc"}],
+    "name": [{"name.raw": {"order": "asc", "unmapped_type": "keyword"}}, {"id": "asc"}],
+}
 
 
-async def search_products(query: str):
-    """Поиск продуктов по имени и описанию"""
+async def search_products(query: str, size: int = 10, sort: str = "relevance", cursor: str = None,
+                          price_interval: float = 1000, **filters):
+    """
+    Поиск продуктов по имени и описанию за один запрос к Elasticsearch:
+    страница товаров (search_after), и на первой странице - фасеты:
+    количество товаров по категориям и гистограмма цен.
+    
+    Фильтр по категории применяется через post_filter, чтобы фасет
+    категорий показывал все категории с совпадениями.
+    
+    Returns:
+        {"items": [...], "next_cursor": str | None, "total": int, "facets": {...} | None}
+    """
+    sort_spec = SEARCH_SORTS[sort]
+    search_after = decode_cursor(cursor, SEARCH_CURSOR_FIELDS[sort])
+    category = filters.pop("category", None)
+    category_filter = filter_clauses(category=category)
     search_body = {
         "query": {
-            "multi_match": {
-                "query": query,
-                "fields": ["name", "description"],
-                "fuzziness": "AUTO"
+            "bool": {
+                "must": {
+                    "multi_match": {
+                        "query": query,
+                        "fields": ["name", "description"],
+                        "fuzziness": "AUTO"
+                    }
+                },
+                "filter": filter_clauses(**filters)
             }
-        }
+        },
+        "post_filter": {"bool": {"filter": category_filter}},
+        "sort": sort_spec,
+        "size": size,
+        "_source": LISTING_FIELDS
     }
+    if search_after is not None:
+        search_body["search_after"] = search_after
+    else:
+        search_body["aggs"] = {
+            "categories": {"terms": {"field": "category_id", "size": 100}},
+            "prices": {
+                "filter": {"bool": {"filter": category_filter}},
+                "aggs": {
+                    "histogram": {"histogram": {"field": "price", "interval": price_interval, "min_doc_count": 1}}
+                }
+            }
+        }
 
-    response = await es.search(index="products_catalog", body=search_body)
+    response = await es.search(index=INDEX_NAME, body=search_body)
 
-    print(f"Ищем в Elastic запрос: '{query}'")
-    print("Ответ: ", response)
     hits = response["hits"]["hits"]
-    return [hit["_source"] for hit in hits]
+    next_cursor = encode_cursor(*hits[-1]["sort"]) if len(hits) == size else None
+    facets = None
+    if "aggregations" in response:
+        aggs = response["aggregations"]
+        facets = {
+            "categories": [{"id": b["key"], "count": b["doc_count"]} for b in aggs["categories"]["buckets"]],
+            "price_histogram": [{"from": b["key"], "to": b["key"] + price_interval, "count": b["doc_count"]}
+                                for b in aggs["prices"]["histogram"]["buckets"]]
+        }
+    return {
+        "items": [hit["_source"] for hit in hits],
+        "next_cursor": next_cursor,
+        "total": response["hits"]["total"]["value"],
+        "facets": facets
+    }
+
+
+# Бюджет времени на подсказку: при превышении отдаются найденные к этому моменту
+SUGGEST_TIMEOUT = "50ms"
+
+
+async def suggest_products(prefix: str, size: int = 8):
+    """
+    Подсказки при наборе: названия товаров и категории по префиксу.
+    Используется подполе name.prefix: n-граммы от начала каждого слова
+    без стемминга, поэтому префикс ищется как обычный терм без
+    fuzzy-разбора всего документа и находится и после того, как слово
+    набрано целиком.
+    
+    Returns:
+        {"products": [{"id", "name"}], "categories": [{"id", "name", "count"}]}
+    """
+    search_body = {
+        "query": {
+            "match": {
+                # Анализатор запроса prefix_search не режет префикс на n-граммы
+                "name.prefix": {"query": prefix, "operator": "and"}
+            }
+        },
+        "size": size,
+        "_source": ["id", "name"],
+        "track_total_hits": False,
+        "timeout": SUGGEST_TIMEOUT,
+        "aggs": {
+            "categories": {
+                "terms": {"field": "category_id", "size": 5},
+                "aggs": {"category": {"top_hits": {"size": 1, "_source": ["category"]}}}
+            }
+        }
+    }
+    response = await es.search(index=INDEX_NAME, body=search_body)
+    categories = []
+    for bucket in response["aggregations"]["categories"]["buckets"]:
+        top = bucket["category"]["hits"]["hits"]
+        category = top[0]["_source"].get("category") if top else None
+        categories.append({
+            "id": bucket["key"],
+            "name": category.get("name") if category else None,
+            "count": bucket["doc_count"]
+        })
+    return {
+        "products": [hit["_source"] for hit in response["hits"]["hits"]],
+        "categories": categories
+    }
@@ -0,0 +1,126 @@
+# catalog_service/app/search/indexer.py
+"""
+Фоновая индексация товаров из transactional outbox.
+
+Изменение товара и строка search_outbox фиксируются одной транзакцией,
+поэтому запрос не ждет Elasticsearch, а изменение не теряется при его
+недоступности. Индексатор забирает строки пачками (FOR UPDATE SKIP LOCKED,
+чтобы несколько экземпляров сервиса не делили одни строки), оставляет
+последнее изменение каждого товара и отправляет один bulk-запрос.
+"""
+import asyncio
+from elasticsearch.helpers import async_bulk
+from sqlalchemy import delete, func
+from sqlalchemy.future import select
+from db.cache import bump_search_generation
+from db.database import async_session
+from db.models import Product, SearchOutbox
+from metrics import set_outbox_lag, count_search_indexed
+from search.documents import product_query, product_source
+from search.elastic import es, INDEX_NAME, DELETED_VERSION, building_indices
+
+
+class OutboxIndexer:
+    def __init__(self, batch_size: int = 500, poll_interval: float = 0.5, retry_backoff: float = 5.0):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.retry_backoff = retry_backoff
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                processed = await self.drain_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Строки остаются в outbox и будут обработаны при следующей попытке
+                print(f"Error indexing products from outbox: {str(e)}")
+                await asyncio.sleep(self.retry_backoff)
+                continue
+            if processed < self.batch_size:
+                await asyncio.sleep(self.poll_interval)
+
+    async def drain_once(self) -> int:
+        """Обработка одной пачки outbox; возвращает число обработанных строк"""
+        async with async_session() as session:
+            await self._update_lag(session)
+            result = await session.execute(
+                select(SearchOutbox.id, SearchOutbox.product_id, SearchOutbox.op)
+                .order_by(SearchOutbox.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            rows = result.all()
+            if not rows:
+                return 0
+
+            # Из нескольких изменений товара важно только последнее
+            latest = {}
+            for row in rows:
+                latest[row.product_id] = row.op
+            to_index = [product_id for product_id, op in latest.items() if op == "index"]
+            documents = {}
+            versions = {}
+            if to_index:
+                result = await session.execute(product_query().where(Product.id.in_(to_index)))
+                for row in result:
+                    documents[row.id] = product_source(row)
+                    versions[row.id] = row.version
+
+            # Проверяется после чтения товаров: изменение, зафиксированное после
+            # начала снимка переиндексации, попадет в строящийся индекс
+            building = await building_indices()
+            actions = []
+            for product_id in latest:
+                if product_id in documents:
+                    actions.append({"_op_type": "index", "_index": INDEX_NAME,
+                                    "_id": product_id, "_source": documents[product_id]})
+                    actions += [{"_op_type": "index", "_index": index, "_id": product_id,
+                                 "_source": documents[product_id], "_version": versions[product_id],
+                                 "_version_type": "external"} for index in building]
+                else:
+                    # Товар удален (в том числе после изменения в этой же пачке)
+                    actions.append({"_op_type": "delete", "_index": INDEX_NAME, "_id": product_id})
+                    actions += [{"_op_type": "delete", "_index": index, "_id": product_id,
+                                 "_version": DELETED_VERSION, "_version_type": "external"}
+                                for index in building]
+
+            _, errors = await async_bulk(es, actions, max_retries=3, raise_on_error=False)
+            # Удаление товара, которого нет в индексе, не ошибка; конфликт версий
+            # (только в строящемся индексе) значит, что там уже более новое состояние
+            errors = [error for error in errors
+                      if error.get("delete", {}).get("status") != 404
+                      and next(iter(error.values())).get("status") != 409]
+            if errors:
+                count_search_indexed("bulk", "error", len(errors))
+                raise RuntimeError(f"{len(errors)} index operations failed, first: {errors[0]}")
+
+            await session.execute(delete(SearchOutbox).where(SearchOutbox.id.in_([row.id for row in rows])))
+            await session.commit()
+            bump_search_generation()
+            count_search_indexed("index", "success", len(documents))
+            count_search_indexed("delete", "success", len(latest) - len(documents))
+            return len(rows)
+
+    async def _update_lag(self, session):
+        result = await session.execute(
+            select(
+                func.count(SearchOutbox.id),
+                func.extract("epoch", func.localtimestamp() - func.min(SearchOutbox.created_at))
+            )
+        )
+        pending, lag_seconds = result.one()
+        set_outbox_lag(pending, float(lag_seconds or 0))
@@ -0,0 +1,138 @@
+# catalog_service/app/search/reindex.py
+"""
+Полная переиндексация товаров из Postgres в Elasticsearch без простоя.
+
+Товары читаются серверным курсором и пишутся bulk-запросами в новый
+версионный индекс, после чего алиас INDEX_NAME атомарно переключается
+на него. Поиск все это время читает старый индекс.
+
+Изменения товаров, сделанные во время переиндексации, индексатор outbox
+пишет и в новый индекс (через алиас BUILD_ALIAS). Все записи в новый
+индекс идут с внешней версией Product.version, а удаления - с
+DELETED_VERSION, поэтому устаревшая строка снимка не перезаписывает
+более новое состояние и не возвращает удаленный товар.
+
+    python -m search.reindex --batch-size 2000
+"""
+import argparse
+import asyncio
+from datetime import datetime
+from elasticsearch import NotFoundError
+from elasticsearch.helpers import async_bulk
+from db.cache import bump_search_generation
+from db.database import async_session, engine
+from db.models import Product
+from search.documents import product_query, product_source
+from search.elastic import es, INDEX_NAME, INDEX_CONFIG, BUILD_ALIAS, versioned_index_name
+
+# Сколько предыдущих версий индекса оставлять для отката
+KEEP_PREVIOUS_INDICES = 1
+
+# Сколько новый индекс помнит удаленные документы, пока идет загрузка
+BUILD_GC_DELETES = "1d"
+
+# Состояние последней переиндексации (для GET /admin/reindex)
+reindex_status = {"state": "idle"}
+
+
+async def product_documents(index_name: str, batch_size: int):
+    """Товары из Postgres в виде bulk-операций, без загрузки всей таблицы в память"""
+    query = product_query().order_by(Product.id).execution_options(yield_per=batch_size)
+    async with async_session() as session:
+        rows = await session.stream(query)
+        async for row in rows:
+            yield {"_index": index_name, "_id": row.id, "_source": product_source(row),
+                   "_version": row.version, "_version_type": "external"}
+
+
+async def swap_alias(index_name: str):
+    """Атомарное переключение алиаса на новый индекс; индекс перестает считаться строящимся"""
+    actions = [{"add": {"index": index_name, "alias": INDEX_NAME}},
+               {"remove": {"index": index_name, "alias": BUILD_ALIAS}}]
+    if await es.indices.exists_alias(name=INDEX_NAME):
+        current = await es.indices.get_alias(name=INDEX_NAME)
+        actions += [{"remove": {"index": old, "alias": INDEX_NAME}} for old in current]
+    elif await es.indices.exists(index=INDEX_NAME):
+        # Старый индекс с именем алиаса удаляется в той же операции
+        actions.append({"remove_index": {"index": INDEX_NAME}})
+    await es.indices.update_aliases(actions=actions)
+
+
+async def drop_old_indices(current: str, keep: int = KEEP_PREVIOUS_INDICES):
+    try:
+        indices = sorted(await es.indices.get(index=f"{INDEX_NAME}_*"))
+    except NotFoundError:
+        return
+    old = [index for index in indices if index < current]
+    for index in old[:max(len(old) - keep, 0)]:
+        await es.indices.delete(index=index)
+
+
+async def reindex_products(batch_size: int = 2000, max_errors: int = 0) -> dict:
+    """
+    Построение нового индекса и переключение алиаса.
+    Если ошибок больше max_errors, новый индекс удаляется, алиас не меняется.
+    """
+    index_name = versioned_index_name()
+    swapped = False
+    reindex_status.clear()
+    reindex_status.update(state="running", index=index_name, indexed=0, errors=0,
+                          started_at=datetime.utcnow().isoformat())
+    try:
+        # Без реплик и обновлений на время загрузки. Алиас BUILD_ALIAS
+        # создается до начала снимка, чтобы индексатор не пропустил изменений;
+        # удаления помнятся до конца загрузки (gc_deletes)
+        await es.indices.create(index=index_name, body={
+            **INDEX_CONFIG,
+            "settings": {**INDEX_CONFIG["settings"], "number_of_replicas": 0, "refresh_interval": "-1",
+                         "gc_deletes": BUILD_GC_DELETES},
+            "aliases": {BUILD_ALIAS: {}}
+        })
+        indexed, errors = await async_bulk(
+            es, product_documents(index_name, batch_size),
+            chunk_size=batch_size, max_retries=3, raise_on_error=False
+        )
+        # Конфликт версий: индексатор уже записал более новое состояние товара
+        errors = [error for error in errors if error.get("index", {}).get("status") != 409]
+        reindex_status.update(indexed=indexed, errors=len(errors))
+        if len(errors) > max_errors:
+            print(f"Reindex into {index_name} failed: {len(errors)} errors, first: {errors[0]}")
+            await es.indices.delete(index=index_name)
+            reindex_status.update(state="failed", finished_at=datetime.utcnow().isoformat())
+            return dict(reindex_status)
+
+        await es.indices.put_settings(index=index_name, settings={
+            "index": {"number_of_replicas": None, "refresh_interval": None, "gc_deletes": None}
+        })
+        await es.indices.refresh(index=index_name)
+        await swap_alias(index_name)
+        swapped = True
+        bump_search_generation()
+        await drop_old_indices(index_name)
+        reindex_status.update(state="done", finished_at=datetime.utcnow().isoformat())
+    except Exception as e:
+        print(f"Reindex into {index_name} failed: {str(e)}")
+        if swapped:
+            # Алиас уже переключен, не удалось только убрать старые версии
+            reindex_status.update(state="done", error=str(e), finished_at=datetime.utcnow().isoformat())
+        else:
+            reindex_status.update(state="failed", error=str(e), finished_at=datetime.utcnow().isoformat())
+            await es.indices.delete(index=index_name, ignore_unavailable=True)
+    return dict(reindex_status)
+
+
+async def main(batch_size: int, max_errors: int):
+    try:
+        result = await reindex_products(batch_size, max_errors)
+        print(result)
+    finally:
+        await es.close()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the products search index")
+    parser.add_argument("--batch-size", type=int, default=2000)
+    parser.add_argument("--max-errors", type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(main(args.batch_size, args.max_errors))
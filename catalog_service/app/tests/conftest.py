@@ -0,0 +1,50 @@
+import os
+import jwt
+import pytest
+import pytest_asyncio
+from sqlalchemy import delete
+from db.database import async_session, engine
+from db.init_db import init_db
+from db.models import Product, Category, SearchOutbox
+
+# Продавец, от имени которого тесты загружают товары
+TEST_SELLER_ID = 987654
+
+
+@pytest_asyncio.fixture
+async def db_session():
+    """Сессия тестовой БД каталога; товары тестового продавца удаляются после теста"""
+    await init_db()
+    async with async_session() as session:
+        try:
+            yield session
+        finally:
+            await session.rollback()
+            product_ids = (await session.execute(
+                delete(Product).where(Product.seller_id == TEST_SELLER_ID).returning(Product.id)
+            )).scalars().all()
+            await session.execute(delete(SearchOutbox).where(SearchOutbox.product_id.in_(product_ids)))
+            await session.commit()
+    await engine.dispose()
+
+
+@pytest_asyncio.fixture
+async def category(db_session):
+    """Временная категория для загружаемых товаров"""
+    category = Category(name="bulk upload test")
+    db_session.add(category)
+    await db_session.commit()
+    category_id = category.id
+    yield category_id
+    await db_session.rollback()
+    product_ids = (await db_session.execute(
+        delete(Product).where(Product.category_id == category_id).returning(Product.id)
+    )).scalars().all()
+    await db_session.execute(delete(SearchOutbox).where(SearchOutbox.product_id.in_(product_ids)))
+    await db_session.execute(delete(Category).where(Category.id == category_id))
+    await db_session.commit()
+
+
+@pytest.fixture
+def seller_token():
+    return jwt.encode({"id": TEST_SELLER_ID}, os.getenv("SECRET_KEY"), algorithm=os.getenv("ALGORITHM"))
@@ -0,0 +1,124 @@
+import json
+import pytest
+from httpx import AsyncClient
+from sqlalchemy.future import select
+from main import app
+from db.models import Product, SearchOutbox
+from tests.conftest import TEST_SELLER_ID
+
+
+async def upload(token: str, filename: str, content: bytes, content_type: str):
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        return await ac.post(
+            "/api/products/bulk_upload",
+            files={"file": (filename, content, content_type)},
+            headers={"Authorization": f"Bearer {token}"}
+        )
+
+
+async def seller_products(db_session):
+    result = await db_session.execute(
+        select(Product).where(Product.seller_id == TEST_SELLER_ID).order_by(Product.name)
+    )
+    return result.scalars().all()
+
+
+@pytest.mark.asyncio
+async def test_bulk_upload_csv(db_session, category, seller_token):
+    content = (
+        "\ufeffname,description,price,stock,category_id,active\r\n"
+        f"Чайник,\"Объем 1,7 л\r\nстальной\",1990.5,3,{category},да\r\n"
+        f"Кружка,,250,10,{category},\r\n"
+        f",без названия,100,1,{category},\r\n"
+        f"Тарелка,,-5,1,{category},\r\n"
+        f"Ложка,,10,1,{category},1,лишнее\r\n"
+    ).encode("utf-8")
+
+    response = await upload(seller_token, "products.csv", content, "text/csv")
+
+    assert response.status_code == 200
+    summary = response.json()
+    assert summary["inserted"] == 2
+    assert summary["updated"] == 0
+    assert summary["failed"] == 3
+    assert [error["line"] for error in summary["errors"]] == [5, 6, 7]
+
+    products = await seller_products(db_session)
+    assert [product.name for product in products] == ["Кружка", "Чайник"]
+    assert products[1].description == "Объем 1,7 л\r\nстальной"
+    assert products[1].price == 1990.5
+    assert products[0].stock == 10 and products[0].active
+
+    # Каждый загруженный товар попадает в outbox для индексации
+    outbox = await db_session.execute(
+        select(SearchOutbox.product_id).where(SearchOutbox.product_id.in_([p.id for p in products]))
+    )
+    assert set(outbox.scalars().all()) == {product.id for product in products}
+
+
+@pytest.mark.asyncio
+async def test_bulk_upload_jsonl_updates_by_id(db_session, category, seller_token):
+    first = json.dumps({"name": "Лампа", "price": 700, "stock": 2, "category_id": category}, ensure_ascii=False)
+    response = await upload(seller_token, "products.jsonl", first.encode("utf-8"), "application/jsonl")
+    assert response.status_code == 200
+    assert response.json()["inserted"] == 1
+    [lamp] = await seller_products(db_session)
+    lamp_id, lamp_version = lamp.id, lamp.version
+
+    lines = [
+        json.dumps({"id": lamp_id, "name": "Лампа настольная", "price": 650, "stock": 5,
+                    "category_id": category}, ensure_ascii=False),
+        "",
+        "{не json",
+        json.dumps({"id": 999999999, "name": "Чужой", "price": 1, "category_id": category}),
+        json.dumps({"name": "Абажур", "price": 300, "category_id": category, "active": False}, ensure_ascii=False),
+    ]
+    response = await upload(seller_token, "products.jsonl", "\n".join(lines).encode("utf-8"), "application/jsonl")
+
+    assert response.status_code == 200
+    summary = response.json()
+    assert summary["inserted"] == 1
+    assert summary["updated"] == 1
+    assert [error["line"] for error in summary["errors"]] == [3, 4]
+
+    db_session.expire_all()
+    products = await seller_products(db_session)
+    assert [(p.name, p.price, p.stock, p.active) for p in products] == [
+        ("Абажур", 300, 0, False),
+        ("Лампа настольная", 650, 5, True),
+    ]
+    assert products[1].version == lamp_version + 1
+
+
+@pytest.mark.asyncio
+async def test_bulk_upload_reports_out_of_range_values(db_session, category, seller_token):
+    # Значения, которые не помещаются в колонки БД, - ошибки строк, а не 500
+    lines = [
+        json.dumps({"name": "Ваза", "price": 10, "stock": 2 ** 31, "category_id": category}, ensure_ascii=False),
+        json.dumps({"id": 2 ** 40, "name": "Ваза", "price": 10, "category_id": category}, ensure_ascii=False),
+        json.dumps({"name": "Ва\u0000за", "price": 10, "category_id": category}, ensure_ascii=False),
+        json.dumps({"name": "Ваза", "description": "\u0000", "price": 10, "category_id": category}, ensure_ascii=False),
+        json.dumps({"name": "Ваза", "price": 10, "category_id": 2 ** 63}, ensure_ascii=False),
+        json.dumps({"name": "Ваза", "price": 10, "stock": 1, "category_id": category}, ensure_ascii=False),
+    ]
+    response = await upload(seller_token, "products.jsonl", "\n".join(lines).encode("utf-8"), "application/jsonl")
+
+    assert response.status_code == 200
+    summary = response.json()
+    assert summary["inserted"] == 1
+    assert [error["line"] for error in summary["errors"]] == [1, 2, 3, 4, 5]
+    assert [product.stock for product in await seller_products(db_session)] == [1]
+
+
+@pytest.mark.asyncio
+async def test_bulk_upload_requires_token(db_session):
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.post("/api/products/bulk_upload",
+                                 files={"file": ("products.csv", b"name\n", "text/csv")})
+    assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_bulk_upload_rejects_unknown_format(db_session, seller_token):
+    response = await upload(seller_token, "products.xlsx", b"...", "application/octet-stream")
+    assert response.status_code == 400
@@ -0,0 +1,36 @@
+import pytest
+from db.pagination import (encode_cursor, decode_cursor, LISTING_CURSOR_FIELDS,
+                           SEARCH_CURSOR_FIELDS)
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor("Кружка", 42)
+    assert decode_cursor(cursor, LISTING_CURSOR_FIELDS) == ["Кружка", 42]
+    assert decode_cursor(encode_cursor(12.5, 7), SEARCH_CURSOR_FIELDS["price_asc"]) == [12.5, 7]
+    assert decode_cursor(None, LISTING_CURSOR_FIELDS) is None
+
+
+@pytest.mark.parametrize("values, fields", [
+    # Значения не того типа для сортировки
+    (("Кружка", "42"), LISTING_CURSOR_FIELDS),
+    ((1, 42), LISTING_CURSOR_FIELDS),
+    (("Кружка", True), LISTING_CURSOR_FIELDS),
+    ((["a"], 1), SEARCH_CURSOR_FIELDS["name"]),
+    (("12.5", 7), SEARCH_CURSOR_FIELDS["price_desc"]),
+    ((None, 7), SEARCH_CURSOR_FIELDS["relevance"]),
+    # Значения, которые не принимает БД
+    (("Кружка", 2 ** 31), LISTING_CURSOR_FIELDS),
+    (("Кру\x00жка", 1), LISTING_CURSOR_FIELDS),
+    ((10 ** 400, 1), SEARCH_CURSOR_FIELDS["price_asc"]),
+    # Другое число полей
+    (("Кружка",), LISTING_CURSOR_FIELDS),
+])
+def test_cursor_rejects_values_not_matching_sort(values, fields):
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor(*values), fields)
+
+
+def test_cursor_rejects_garbage():
+    for cursor in ("not base64!", "e30", encode_cursor() + "x"):
+        with pytest.raises(ValueError):
+            decode_cursor(cursor, LISTING_CURSOR_FIELDS)
@@ -9,8 +9,10 @@ import time
 import jwt
 import httpx
 import asyncio
-from logging_decorator import log_to_kafka
-from metrics import metrics_endpoint, api_metrics
+from typing import AsyncGenerator
+from logging_decorator import start_log_pipeline, stop_log_pipeline
+from instrumentation import InstrumentationMiddleware
+from metrics import metrics_endpoint
 from config.tracing import setup_tracing
 from metrics.tracing_decorator import trace_function
 
@@ -23,7 +25,16 @@ load_dotenv()  # Загружает переменные из .env
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 
-app = FastAPI()
+async def lifespan(app: FastAPI) -> AsyncGenerator:
+    await start_log_pipeline()
+    yield
+    await stop_log_pipeline()
+
+app = FastAPI(lifespan=lifespan)
+
+# Единое измерение запросов: метрики, атрибуты спана и лог в Kafka.
+# Добавляется до трейсинга, чтобы выполняться внутри серверного спана.
+app.add_middleware(InstrumentationMiddleware)
 
 # Инициализация трейсинга
 tracer = setup_tracing(app)
@@ -63,9 +74,6 @@ async def metrics():
     return await metrics_endpoint()
 
 @app.get("/", response_class=HTMLResponse)
-@log_to_kafka
-@api_metrics()
-@trace_function(name="read_home", include_request=True)
 async def read_home(request: Request):
     try:
         jwt_token = request.cookies.get("access_token")
@@ -79,9 +87,6 @@ async def read_home(request: Request):
     return templates.TemplateResponse("index.html", {"request": request, "email": email})
 
 @app.get("/profile", response_class=HTMLResponse)
-@log_to_kafka
-@api_metrics()
-@trace_function(name="get_profile", include_request=True)
 async def get_profile(request: Request):
     jwt_token = request.cookies.get("access_token")
     
@@ -101,9 +106,6 @@ async def get_profile(request: Request):
     return templates.TemplateResponse("profile.html", {"request": request, "email": email, "token": jwt_token})
 
 @app.get("/cart", response_class=HTMLResponse)
-@log_to_kafka
-@api_metrics()
-@trace_function(name="get_cart", include_request=True)
 async def get_cart(request: Request):
     jwt_token = request.cookies.get("access_token")
     
@@ -123,9 +125,6 @@ async def get_cart(request: Request):
     return templates.TemplateResponse("cart.html", {"request": request, "email": email, "token": jwt_token})
 
 @app.get("/wishlist", response_class=HTMLResponse)
-@log_to_kafka
-@api_metrics()
-@trace_function(name="get_wishlist", include_request=True)
 async def get_wishlist(request: Request):
     jwt_token = request.cookies.get("access_token")
     
@@ -145,9 +144,6 @@ async def get_wishlist(request: Request):
     return templates.TemplateResponse("wishlist.html", {"request": request, "email": email})
 
 @app.get("/orders", response_class=HTMLResponse)
-@log_to_kafka
-@api_metrics()
-@trace_function(name="get_orders", include_request=True)
 async def get_orders(request: Request):
     jwt_token = request.cookies.get("access_token")
     
@@ -167,31 +163,19 @@ async def get_orders(request: Request):
     return templates.TemplateResponse("orders.html", {"request": request, "email": email})
 
 @app.get("/login", response_class=HTMLResponse)
-@log_to_kafka
-@api_metrics()
-@trace_function(name="login", include_request=True)
 async def login(request: Request):
     return templates.TemplateResponse("login.html", {"request": request})
 
 @app.get("/product", response_class=HTMLResponse)
-@log_to_kafka
-@api_metrics()
-@trace_function(name="product", include_request=True)
 async def product(request: Request):
     jwt_token = request.cookies.get("access_token")
     return templates.TemplateResponse("product.html", {"request": request, "token": jwt_token})
 
 @app.get("/signup", response_class=HTMLResponse)
-@log_to_kafka
-@api_metrics()
-@trace_function(name="signup", include_request=True)
 async def signup(request: Request):
     return templates.TemplateResponse("signup.html", {"request": request})
 
 @app.post("/register")
-@log_to_kafka
-@api_metrics()
-@trace_function(name="register", include_request=True)
 async def register(request: Request, email: str = Form(...), password: str = Form(...), client: httpx.AsyncClient = Depends(get_http_client)):
     """Send a registration request to the auth service."""
     try:
@@ -209,9 +193,6 @@ async def register(request: Request, email: str = Form(...), password: str = For
         return templates.TemplateResponse("signup.html", {"request": request, "error": f"Ошибка сервера: {str(e)}"})
 
 @app.post("/login")
-@log_to_kafka
-@api_metrics()
-@trace_function(name="login_action", include_request=True)
 async def login_action(request: Request, email: str = Form(...), password: str = Form(...), client: httpx.AsyncClient = Depends(get_http_client)):
     """Send a login request to the auth service."""
     try:
@@ -238,9 +219,6 @@ async def login_action(request: Request, email: str = Form(...), password: str =
         return templates.TemplateResponse("login.html", {"request": request, "error": f"Ошибка сервера: {str(e)}"})
 
 @app.get("/logout")
-@log_to_kafka
-@api_metrics()
-@trace_function(name="logout", include_request=True)
 async def logout(response: Response):
     """Logout the user by clearing the access token cookie."""
     response = RedirectResponse(url="/", status_code=303)
@@ -248,16 +226,10 @@ async def logout(response: Response):
     return response
 
 @app.get("/signup/seller", response_class=HTMLResponse)
-@log_to_kafka
-@api_metrics()
-@trace_function(name="signup_seller", include_request=True)
 async def signup_seller(request: Request):
     return templates.TemplateResponse("signup_seller.html", {"request": request})
 
 @app.post("/register/seller")
-@log_to_kafka
-@api_metrics()
-@trace_function(name="register_seller", include_request=True)
 async def register_seller(request: Request, email: str = Form(...), password: str = Form(...), shop_name: str = Form(...), inn: str = Form(None), description: str = Form(None), client: httpx.AsyncClient = Depends(get_http_client)):
     """Отправить запрос на регистрацию продавца в auth_service."""
     try:
@@ -280,9 +252,6 @@ async def register_seller(request: Request, email: str = Form(...), password: st
         return templates.TemplateResponse("signup_seller.html", {"request": request, "error": f"Ошибка сервера: {str(e)}"})
 
 @app.get("/seller/add_product", response_class=HTMLResponse)
-@log_to_kafka
-@api_metrics()
-@trace_function(name="seller_add_product_page", include_request=True)
 async def seller_add_product_page(request: Request, client: httpx.AsyncClient = Depends(get_http_client)):
     jwt_token = request.cookies.get("access_token")
     if not jwt_token:
@@ -300,17 +269,23 @@ async def seller_add_product_page(request: Request, client: httpx.AsyncClient =
     return templates.TemplateResponse("seller_add_product.html", {"request": request})
 
 @app.post("/seller/add_product")
-@log_to_kafka
-@api_metrics()
-@trace_function(name="seller_add_product", include_request=True)
 async def seller_add_product(request: Request, client: httpx.AsyncClient = Depends(get_http_client)):
     form = await request.form()
     # Определяем, что отправлено: один товар или файл
     if "file" in form and form["file"]:
         # Загрузка файла с несколькими товарами
         upload_file = form["file"]
-        files = {"file": (upload_file.filename, await upload_file.read(), upload_file.content_type)}
-        response = await client.post(f"{CATALOG_SERVICE_URL}/api/products/bulk_upload", files=files)
+        jwt_token = request.cookies.get("access_token")
+        if not jwt_token:
+            return templates.TemplateResponse("seller_add_product.html", {"request": request, "error": "Необходима авторизация"})
+        # Файл передаётся потоком, без чтения целиком в память
+        files = {"file": (upload_file.filename, upload_file.file, upload_file.content_type)}
+        response = await client.post(
+            f"{CATALOG_SERVICE_URL}/api/products/bulk_upload",
+            files=files,
+            headers={"Authorization": f"Bearer {jwt_token}"},
+            timeout=None
+        )
         result = await response.aread()
         return templates.TemplateResponse("seller_add_product.html", {"request": request, "result": result.decode()})
     else:
@@ -350,9 +325,6 @@ async def seller_add_product(request: Request, client: httpx.AsyncClient = Depen
             return templates.TemplateResponse("seller_add_product.html", {"request": request, "error": result.get("detail", "Ошибка добавления товара")})
 
 @app.get("/seller/edit_product", response_class=HTMLResponse)
-@log_to_kafka
-@api_metrics()
-@trace_function(name="seller_edit_product_page", include_request=True)
 async def seller_edit_product_page(request: Request, id: int, client: httpx.AsyncClient = Depends(get_http_client)):
     jwt_token = request.cookies.get("access_token")
     if not jwt_token:
@@ -383,9 +355,6 @@ async def seller_edit_product_page(request: Request, id: int, client: httpx.Asyn
     return templates.TemplateResponse("seller_edit_product.html", {"request": request, "product": product})
 
 @app.post("/seller/update_product")
-@log_to_kafka
-@api_metrics()
-@trace_function(name="seller_update_product", include_request=True)
 async def seller_update_product(request: Request, id: int = Form(...), name: str = Form(...), price: float = Form(...), description: str = Form(None), stock: int = Form(None), client: httpx.AsyncClient = Depends(get_http_client)):
     jwt_token = request.cookies.get("access_token")
     if not jwt_token:
@@ -425,9 +394,6 @@ async def seller_update_product(request: Request, id: int = Form(...), name: str
         raise HTTPException(status_code=response.status_code, detail=result.get("detail", "Ошибка при обновлении товара"))
 
 @app.get("/seller/metrics", response_class=HTMLResponse)
-@log_to_kafka
-@api_metrics()
-@trace_function(name="seller_metrics_page", include_request=True)
 async def seller_metrics_page(request: Request, client: httpx.AsyncClient = Depends(get_http_client)):
     jwt_token = request.cookies.get("access_token")
     if not jwt_token:
@@ -447,9 +413,6 @@ async def seller_metrics_page(request: Request, client: httpx.AsyncClient = Depe
     return templates.TemplateResponse("seller_metrics.html", {"request": request})
 
 @app.post("/seller/delete_product")
-@log_to_kafka
-@api_metrics()
-@trace_function(name="seller_delete_product", include_request=True)
 async def seller_delete_product(request: Request, id: int = Form(...), client: httpx.AsyncClient = Depends(get_http_client)):
     jwt_token = request.cookies.get("access_token")
     if not jwt_token:
@@ -477,9 +440,6 @@ async def seller_delete_product(request: Request, id: int = Form(...), client: h
         raise HTTPException(status_code=response.status_code, detail="Ошибка при удалении товара")
 
 @app.get("/profile/edit", response_class=HTMLResponse)
-@log_to_kafka
-@api_metrics()
-@trace_function(name="edit_profile_page", include_request=True)
 async def edit_profile_page(request: Request, client: httpx.AsyncClient = Depends(get_http_client)):
     jwt_token = request.cookies.get("access_token")
     if not jwt_token:
@@ -497,9 +457,6 @@ async def edit_profile_page(request: Request, client: httpx.AsyncClient = Depend
     return templates.TemplateResponse("profile_edit.html", {"request": request, "profile": profile})
 
 @app.post("/profile/edit")
-@log_to_kafka
-@api_metrics()
-@trace_function(name="edit_profile_action", include_request=True)
 async def edit_profile_action(request: Request, client: httpx.AsyncClient = Depends(get_http_client)):
     form = await request.form()
     role = form.get("role")
@@ -534,9 +491,6 @@ async def edit_profile_action(request: Request, client: httpx.AsyncClient = Depe
         return templates.TemplateResponse("profile_edit.html", {"request": request, "error": error, "profile": form})
 
 @app.get("/admin/users", response_class=HTMLResponse)
-@log_to_kafka
-@api_metrics()
-@trace_function(name="admin_users_page", include_request=True)
 async def admin_users_page(request: Request, search: str = '', role: str = '', client: httpx.AsyncClient = Depends(get_http_client)):
     jwt_token = request.cookies.get("access_token")
     if not jwt_token:
@@ -557,9 +511,6 @@ async def admin_users_page(request: Request, search: str = '', role: str = '', c
     return templates.TemplateResponse("admin_users.html", {"request": request, "users": users, "search": search, "role": role})
 
 @app.post("/admin/delete_product")
-@log_to_kafka
-@api_metrics()
-@trace_function(name="admin_delete_product", include_request=True)
 async def admin_delete_product(request: Request, client: httpx.AsyncClient = Depends(get_http_client)):
     data = await request.json()
     product_id = data.get("id")
@@ -575,16 +526,10 @@ async def admin_delete_product(request: Request, client: httpx.AsyncClient = Dep
     return {"success": True}
 
 @app.get("/admin/metrics", response_class=HTMLResponse)
-@log_to_kafka
-@api_metrics()
-@trace_function(name="admin_metrics_page", include_request=True)
 async def admin_metrics_page(request: Request):
     return HTMLResponse("<h1>Здесь будут метрики (заглушка)</h1>")
 
 @app.post("/admin/delete_user")
-@log_to_kafka
-@api_metrics()
-@trace_function(name="admin_delete_user", include_request=True)
 async def admin_delete_user(request: Request, client: httpx.AsyncClient = Depends(get_http_client)):
     data = await request.json()
     user_id = data.get("id")
@@ -600,9 +545,6 @@ async def admin_delete_user(request: Request, client: httpx.AsyncClient = Depend
     return {"success": True}
 
 @app.get("/admin/orders", response_class=HTMLResponse)
-@log_to_kafka
-@api_metrics()
-@trace_function(name="admin_orders_page", include_request=True)
 async def admin_orders_page(request: Request, search: str = '', status: str = '', client: httpx.AsyncClient = Depends(get_http_client)):
     jwt_token = request.cookies.get("access_token")
     if not jwt_token:
@@ -618,9 +560,6 @@ async def admin_orders_page(request: Request, search: str = '', status: str = ''
     return templates.TemplateResponse("admin_orders.html", {"request": request, "orders": orders, "search": search, "status": status})
 
 @app.post("/admin/update_order_status")
-@log_to_kafka
-@api_metrics()
-@trace_function(name="admin_update_order_status", include_request=True)
 async def admin_update_order_status(request: Request, client: httpx.AsyncClient = Depends(get_http_client)):
     data = await request.json()
     order_id = data.get("order_id")